@@ -0,0 +1,144 @@
+from numpy import random, cumsum, abs, max, mean, dot, sqrt, sum, array
+from time import time
+
+from molpub import Score, cluster, align, procrustes
+
+
+def chain_structure(length, seed):
+    # random-walk chain with the C-alpha bond length around 3.8 angstroms.
+    return cumsum(random.default_rng(seed).normal(scale=2.2, size=(length, 3)), axis=0)
+
+
+def backend_benchmark(candidate_length=300, reference_length=1200, repeats=3):
+    # Compare the compiled backend with the NumPy backend on a domain-to-complex search.
+    reference = chain_structure(reference_length, 0)
+    noise = random.default_rng(1).normal(scale=0.3, size=(candidate_length, 3))
+    candidate = reference[500: 500 + candidate_length] + noise
+    print("similar type | numpy (s) | numba (s) | speedup | deviation")
+    for similar_type in ["RMSD", "TM", "GDT-HA", "GDT-TS"]:
+        costs, scores = [], []
+        for backend in ["numpy", "numba"]:
+            score_method = Score(similar_type, "CA", backend=backend)
+            score_method(candidate, reference)  # compile the kernels before timing.
+            start_time = time()
+            for _ in range(repeats):
+                scores.append(score_method(candidate, reference).score)
+            costs.append((time() - start_time) / repeats)
+        print(similar_type, "|", "%.3f" % costs[0], "|", "%.3f" % costs[1], "|",
+              "%.2fx" % (costs[0] / costs[1]), "|", "%.2e" % abs(scores[0] - scores[-1]))
+
+    structures = random.default_rng(2).normal(size=(400, candidate_length, 3))
+    print("similar type | many-to-many numpy (s) | numba (s) | maximum deviation")
+    for similar_type in ["RMSD", "TM", "GDT-TS"]:
+        costs, matrices = [], []
+        for backend in ["numpy", "numba"]:
+            score_method = Score(similar_type, "CA", backend=backend)
+            score_method.many_to_many(structures[:2])
+            start_time = time()
+            matrices.append(score_method.many_to_many(structures))
+            costs.append(time() - start_time)
+        print(similar_type, "|", "%.3f" % costs[0], "|", "%.3f" % costs[1], "|",
+              "%.2e" % max(abs(matrices[0] - matrices[1])))
+
+
+def coarse_benchmark(candidate_length=200, reference_length=2000, trials=10, coarse_step=4, refine_number=8):
+    # Compare the coarse-to-fine offset search with the exhaustive offset search (the recall of the best offset).
+    reference = chain_structure(reference_length, 0)
+    generator = random.default_rng(3)
+    print("similar type | noise | exhaustive (s) | coarse-to-fine (s) | recall | maximum score loss")
+    for similar_type in ["RMSD", "TM", "GDT-HA", "GDT-TS"]:
+        exhaustive_method = Score(similar_type, "CA")
+        coarse_method = Score(similar_type, "CA", coarse_step=coarse_step, refine_number=refine_number)
+        for noise in [0.5, 2.0]:
+            costs, hits, losses = [0.0, 0.0], 0, []
+            for _ in range(trials):
+                offset = generator.integers(0, reference_length - candidate_length)
+                candidate = reference[offset: offset + candidate_length]
+                candidate = candidate + generator.normal(scale=noise, size=(candidate_length, 3))
+                start_time = time()
+                exhaustive_result = exhaustive_method(candidate, reference)
+                costs[0] += time() - start_time
+                start_time = time()
+                coarse_result = coarse_method(candidate, reference)
+                costs[1] += time() - start_time
+                hits += int(exhaustive_result.start == coarse_result.start)
+                losses.append(abs(exhaustive_result.score - coarse_result.score))
+            print(similar_type, "|", noise, "|", "%.3f" % (costs[0] / trials), "|", "%.3f" % (costs[1] / trials), "|",
+                  "%.2f" % (hits / trials), "|", "%.2e" % max(losses))
+
+
+def leader_benchmark(frame_number=1000, length=100, metrics=0.3):
+    # Compare the leader clustering (with triangle-inequality pruning) with the member-wise clustering on a trajectory.
+    generator, frames = random.default_rng(4), [chain_structure(length, 0)]
+    for _ in range(frame_number - 1):
+        frames.append(frames[-1] + generator.normal(scale=0.15, size=(length, 3)))
+    score_method = Score("RMSD", "CA")
+    print("merge type | cost (s) | cluster number")
+    for merge_type in ["any", "leader"]:
+        start_time = time()
+        clusters = cluster(frames, score_method, True, metrics, merge_type)
+        print(merge_type, "|", "%.3f" % (time() - start_time), "|", len(clusters))
+
+
+def align_benchmark(structure_number=1000, length=100, domain_length=80):
+    # Compare the alignment reusing the superpositions of clustering with the alignment re-scoring every structure.
+    generator, structures = random.default_rng(5), []
+    for _ in range(structure_number):
+        structure = chain_structure(length, 0) + generator.normal(scale=0.5, size=(length, 3))
+        structures.append(structure[: domain_length] if generator.random() < 0.5 else structure)
+    print("similar type | merge type | cluster (s) | re-scoring align (s) | reusing align (s) | maximum deviation")
+    for similar_type, metrics in [("RMSD", 0.3), ("TM", 0.5)]:
+        score_method = Score(similar_type, "CA")
+        for merge_type in ["leader"]:
+            start_time = time()
+            cluster_flags = cluster(structures, score_method, True, metrics, merge_type)
+            cluster_cost = time() - start_time
+            start_time = time()
+            expected = [score_method(structure, structures[0]).candidate for structure in structures[1:]]
+            rescoring_cost = cluster_cost + time() - start_time
+            start_time = time()
+            alignment_results = align(structures, score_method, True, metrics, merge_type)
+            reusing_cost = time() - start_time
+            obtained = {}
+            for cluster_index, structure_indices in enumerate(cluster_flags):
+                obtained.update(zip(structure_indices, alignment_results[cluster_index]))
+            deviation = max([abs(obtained[index + 1] - candidate).max() for index, candidate in enumerate(expected)])
+            print(similar_type, "|", merge_type, "|", "%.3f" % cluster_cost, "|", "%.3f" % rescoring_cost, "|",
+                  "%.3f" % reusing_cost, "|", "%.2e" % deviation)
+
+
+def procrustes_benchmark(structure_number=2000, length=200, tolerance=1e-6, iteration_number=100):
+    # Compare the batched generalized Procrustes analysis with the structure-by-structure analysis.
+    generator, reference = random.default_rng(6), chain_structure(length, 0)
+    structures = array([reference + generator.normal(scale=1.0, size=(length, 3)) for _ in range(structure_number)])
+
+    start_time = time()
+    _, consensus = procrustes(structures, tolerance, iteration_number)
+    batched_cost = time() - start_time
+
+    start_time = time()
+    centers = mean(structures, axis=1, keepdims=True)
+    centered_structures = structures - centers
+    looped_consensus = centered_structures[0]
+    for _ in range(iteration_number):
+        aligned_structures = [dot(structure, Score.get_rotation(structure, looped_consensus))
+                              for structure in centered_structures]
+        updated_consensus = mean(aligned_structures, axis=0)
+        updated_consensus = dot(updated_consensus, Score.get_rotation(updated_consensus, centered_structures[0]))
+        change = sqrt(mean(sum((updated_consensus - looped_consensus) ** 2, axis=1)))
+        looped_consensus = updated_consensus
+        if change < tolerance:
+            break
+    looped_cost = time() - start_time
+
+    print("looped (s) | batched (s) | speedup | maximum deviation")
+    print("%.3f" % looped_cost, "|", "%.3f" % batched_cost, "|", "%.2fx" % (looped_cost / batched_cost), "|",
+          "%.2e" % max(abs(looped_consensus + centers[0] - consensus)))
+
+
+if __name__ == "__main__":
+    backend_benchmark()
+    coarse_benchmark()
+    leader_benchmark()
+    align_benchmark()
+    procrustes_benchmark()
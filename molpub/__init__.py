@@ -1,8 +1,10 @@
 from matplotlib import font_manager
 from molpub.layouts import DefaultStructureImage, PropertyStructureImage, HighlightStructureImage
 from molpub.layouts import obtain_widget_icon, Figure
-from molpub.handles import Monitor, Score, similar, cluster, align, set_properties, set_difference, kmer
+from molpub.handles import Monitor, Superposition, Score, ScoreMatrix, Clusterer, similar, prefilter, pairwise
+from molpub.handles import cluster, align, medoids, procrustes, set_properties, set_difference, kmer
 from molpub.handles import load_structure_from_file, save_structure_to_file
+from molpub.handles import load_models_from_file, save_structures_to_stack, load_structures_from_stack
 from os import path
 
 # load required font formats.
@@ -1,12 +1,30 @@
 # noinspection PyPackageRequirements
 from Bio.PDB import PDBParser, MMCIFParser, PDBIO, MMCIFIO, Structure, Chain, Residue, Atom
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
+from hashlib import blake2b
+from json import dump, load as load_json
 from logging import getLogger, CRITICAL
-from numpy import ndarray, array, arange, zeros, dot, transpose, linalg, where
-from numpy import argmin, argmax, min, max, mean, sum, sqrt
-from scipy.spatial.transform import Rotation
+from multiprocessing import get_context
+from os import path, listdir, remove
+from tempfile import TemporaryDirectory
+from time import time
+from molpub.kernels import njit, tm_kernel, gdt_kernel, qcp_kernel, tm_bound_kernel, gdt_bound_kernel
+from numpy import ndarray, array, asarray, arange, zeros, full, tile, concatenate, cumsum
+from numpy import dot, transpose, linalg, einsum, matmul, eye, sort, flatnonzero, quantile, isnan, nan
+from numpy import argmin, argmax, argsort, count_nonzero, min, max, maximum, mean, sum, sqrt, abs, clip, inf
+from numpy import conj, ceil, floor, log2, finfo, delete, where, minimum, bincount, isfinite, load, savez
+from numpy import memmap, triu_indices
+from numpy.fft import rfft, irfft
+from numpy.lib.format import open_memmap, magic
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy.cluster.hierarchy import linkage, fcluster
+from scipy.spatial import cKDTree
+from scipy.spatial.distance import cdist, pdist
 from typing import Iterator
 from warnings import filterwarnings
+
 try:
     from pymol2 import PyMOL  # Please refer to https://pymol.org/2/ for download of PyMOL library
 except ModuleNotFoundError:
@@ -93,22 +111,166 @@ class Monitor:
             print()
 
 
+class Superposition:
+
+    __slots__ = ["score", "rotation", "translation", "start", "reverse", "structure", "reference"]
+
+    def __init__(self, score: float, rotation: ndarray, translation: ndarray, start: int, reverse: bool,
+                 structure: ndarray, reference: ndarray):
+        """
+        Initialize the superposition result, only the transform is kept instead of the rotated coordinates.
+
+        :param score: score of the best superposition.
+        :type score: float
+
+        :param rotation: rotation matrix.
+        :type rotation: numpy.ndarray
+
+        :param translation: translation vector.
+        :type translation: numpy.ndarray
+
+        :param start: start location (in atoms) of the candidate structure in the reference structure.
+        :type start: int
+
+        :param reverse: structure 1 and structure 2 are exchanged as the candidate and the reference.
+        :type reverse: bool
+
+        :param structure: original candidate structure.
+        :type structure: numpy.ndarray
+
+        :param reference: original reference structure.
+        :type reference: numpy.ndarray
+
+        Example
+            >>> from numpy import array, eye, zeros
+            >>> from molpub.handles import Superposition
+            >>> structure = array([[0.0, 0.0, 0.0], [1.0, 0.0, 0.0]])
+            >>> result = Superposition(0.0, eye(3), array([0.0, 1.0, 0.0]), 0, False, structure, structure + [0, 1, 0])
+            >>> result.candidate
+            array([[0., 1., 0.],
+                   [1., 1., 0.]])
+            >>> score, candidate, reference, start, reverse = result
+        """
+        self.score = score
+        self.rotation = rotation
+        self.translation = translation
+        self.start = start
+        self.reverse = reverse
+        self.structure = structure
+        self.reference = reference
+
+    def __iter__(self):
+        """
+        Unpack the result as score, rotated candidate structure, original reference structure, start location
+        (in atoms) and reverse flag.
+        """
+        yield self.score
+        yield self.candidate
+        yield self.reference
+        yield self.start
+        yield self.reverse
+
+    def __getitem__(self, index):
+        """
+        Get the item of the unpacked result by the index, such as "result[3]" for the start location.
+
+        :param index: index (or slice) of the unpacked result.
+        :type index: int or slice
+
+        :return: item of the unpacked result.
+        :rtype: object
+        """
+        return tuple(self)[index]
+
+    @property
+    def candidate(self) -> ndarray:
+        """
+        Rotated candidate structure, which is produced on request.
+
+        :return: rotated candidate structure.
+        :rtype: numpy.ndarray
+        """
+        return self.transform(self.structure)
+
+    def transform(self, structure: ndarray) -> ndarray:
+        """
+        Move the structure by the rotation and translation of the superposition.
+
+        :param structure: structure in the frame of the candidate structure.
+        :type structure: numpy.ndarray
+
+        :return: moved structure.
+        :rtype: numpy.ndarray
+        """
+        return dot(structure, self.rotation) + self.translation
+
+
 class Score:
 
-    def __init__(self, similar_type: str = "RMSD", model_type: str = "CA"):
+    def __init__(self, similar_type: str = "RMSD", model_type: str = "CA", precision: str = "float64",
+                 backend: str = "numpy", coarse_step: int = 1, refine_number: int = 8, kmer_length: int = 4,
+                 cache_size: int = 0):
         """
         Initialize the score.
 
-        :param similar_type: method to calculate the similarity between two molecule structures.
+        :param similar_type: method to calculate the similarity between two molecule structures,
+            including RMSD, TM, GDT-HA, GDT-TS and lDDT (superposition-free).
         :type similar_type: str
 
         :param model_type: model used by structures (N-CA-C-O / CA for proteins, 3SPN / C3 for DNA and RNA sequences).
         :type model_type: str
+
+        :param precision: floating-point precision of the calculation, including float64 and float32.
+        :type precision: str
+
+        :param backend: calculation backend of the superposition and scoring kernels, including numpy and numba.
+        :type backend: str
+
+        :param coarse_step: unit step to subsample the structures with different lengths in the coarse search,
+            the offsets are searched exhaustively at full resolution if it is 1.
+        :type coarse_step: int
+
+        :param refine_number: number of the most promising offsets (by the sequences or by the coarse search)
+            refined at full resolution, larger number brings higher recall of the exhaustive result.
+        :type refine_number: int
+
+        :param kmer_length: length of the k-mers to anchor the offsets when the sequences are provided.
+        :type kmer_length: int
+
+        :param cache_size: maximum number of the cached call results (least recently used ones are evicted),
+            the cache is disabled if it is 0.
+        :type cache_size: int
+
+        .. note::
+            The float32 precision halves the memory footprint and bandwidth of large ensembles,
+            the deviation of scores from float64 can be checked by the "validate" method.
+
+            The numba backend compiles the superposition and scoring kernels, its scores match the numpy backend
+            within 1e-6. If Numba is not installed, the numpy backend is used instead.
+
+            The cache keys on the hash of the structure contents, so the repeated comparisons of the same arrays
+            (e.g. by "similar", "cluster" and "align") return the cached results directly.
+            Only the score and the transform of each result are cached, not the structures.
         """
+        if precision not in ["float64", "float32"]:
+            raise ValueError("No such precision type!")
+
+        if backend not in ["numpy", "numba"]:
+            raise ValueError("No such backend type!")
+
         self.similar_type = similar_type
         self.model_type = model_type
-
-    def __call__(self, structure_1: ndarray, structure_2: ndarray, use_center: bool = True) -> tuple:
+        self.precision = precision
+        self.backend = backend if njit is not None else "numpy"
+        self.coarse_step = coarse_step
+        self.refine_number = refine_number
+        self.kmer_length = kmer_length
+        self.neighbors = {}
+        self.cache_size = cache_size
+        self.cache, self.hits, self.misses = OrderedDict(), 0, 0
+
+    def __call__(self, structure_1: ndarray, structure_2: ndarray, use_center: bool = True,
+                 threshold: float = None, sequences: tuple = None) -> Superposition:
         """
         Calculate the score.
 
@@ -121,14 +283,91 @@ class Score:
         :param use_center: use the structure center as the rotation center.
         :type use_center: bool
 
-        :return: score, rotated candidate structure, original reference structure, start location.
-        :rtype: float, numpy.ndarray, numpy.ndarray, int
+        :param threshold: stop as soon as one superposition satisfies the threshold (score <= threshold for RMSD,
+            otherwise score >= threshold).
+        :type threshold: float or None
+
+        :param sequences: sequences of the structure 1 and the structure 2, which anchor the offsets.
+        :type sequences: tuple or None
+
+        :return: superposition result, which can be unpacked as score, rotated candidate structure,
+            original reference structure, start location (in atoms) and reverse flag.
+        :rtype: molpub.handles.Superposition
+
+        .. note::
+            With the threshold, the result is the first found superposition satisfying the threshold,
+            which is not necessarily the best one. If no superposition satisfies the threshold,
+            the score is only guaranteed not to satisfy it.
+
+            For the structures with different lengths, only the offsets anchored by the shared k-mers of the
+            sequences (see the "anchor" method) are refined if the sequences are provided. If no offset is anchored,
+            only the offsets selected by the coarse search are refined if the coarse step is larger than 1
+            (see the "search" method).
+
+            The start location counts atoms, not units. For the models with several atom types in one unit
+            (such as "N-CA-C-O" and "3SPN"), it is the unit offset multiplied by the number of atom types.
+        """
+        structure_1 = asarray(structure_1, dtype=self.precision)
+        structure_2 = asarray(structure_2, dtype=self.precision)
+
+        if self.cache_size > 0:
+            # the best superposition also answers any threshold, so it is looked up first.
+            keys = [self.get_key(structure_1, structure_2, use_center, None, sequences)]
+            if threshold is not None:
+                keys.append(self.get_key(structure_1, structure_2, use_center, threshold, sequences))
+            for key in keys:
+                if key in self.cache:
+                    self.hits += 1
+                    self.cache.move_to_end(key)
+                    # only the transform is cached, the result is bound to the structures of this call.
+                    score, rotation, translation, start, reverse = self.cache[key]
+                    if reverse:
+                        candidate, reference = structure_2, structure_1
+                    else:
+                        candidate, reference = structure_1, structure_2
+                    return Superposition(score=score, rotation=rotation.copy(), translation=translation.copy(),
+                                         start=start, reverse=reverse, structure=candidate, reference=reference)
+
+            self.misses += 1
+            result = self.calculate(structure_1, structure_2, use_center, threshold, sequences)
+            self.cache[key] = (result.score, result.rotation.copy(), result.translation.copy(), result.start,
+                               result.reverse)
+            if len(self.cache) > self.cache_size:  # evict the least recently used result.
+                self.cache.popitem(last=False)
+            return result
+
+        return self.calculate(structure_1, structure_2, use_center, threshold, sequences)
+
+    def calculate(self, structure_1: ndarray, structure_2: ndarray, use_center: bool = True,
+                  threshold: float = None, sequences: tuple = None) -> Superposition:
+        """
+        Calculate the score without the cache, the parameters are described in the "__call__" method.
+
+        :param structure_1: molecule structure 1.
+        :type structure_1: numpy.ndarray
+
+        :param structure_2: molecule structure 2.
+        :type structure_2: numpy.ndarray
+
+        :param use_center: use the structure center as the rotation center.
+        :type use_center: bool
+
+        :param threshold: stop as soon as one superposition satisfies the threshold.
+        :type threshold: float or None
+
+        :param sequences: sequences of the structure 1 and the structure 2, which anchor the offsets.
+        :type sequences: tuple or None
+
+        :return: superposition result, whose start location is in atoms.
+        :rtype: molpub.handles.Superposition
         """
         if structure_1.shape != structure_2.shape:
             use_center = False
             if len(structure_1) > len(structure_2):
                 original_candidate, original_reference = structure_2, structure_1
                 reverse = True
+                if sequences is not None:
+                    sequences = (sequences[1], sequences[0])
             else:
                 original_candidate, original_reference = structure_1, structure_2
                 reverse = False
@@ -136,228 +375,95 @@ class Score:
             original_candidate, original_reference = structure_1, structure_2
             reverse = False
 
-        scores, saved_candidates = [], []
-        if self.similar_type == "RMSD":
-            for _, _, candidate, reference, start in self.kabsch(original_candidate, original_reference, use_center):
-                # calculate the value of root-mean-square deviation.
-                value = linalg.norm((candidate - reference).reshape(-1), ord=2) / len(original_candidate)
-                saved_candidates.append((candidate, start))
-                scores.append(value)
+        unit_number, factor = self.get_unit_number(structure_1, structure_2), self.get_factor(len(original_candidate))
 
-            saved_candidate, saved_start = saved_candidates[argmin(scores)]
+        if self.similar_type == "lDDT":
+            # the scores are free of superposition, only the best window is superposed for the rotated structure.
+            length = len(original_candidate)
+            scores, starts = self.compare_windows(original_candidate, original_reference, unit_number)
+            location = argmax(scores)
+            window = original_reference[starts[location]: starts[location] + length]
+            rotations, translations, _ = self.superpose(original_candidate, window, True, [0])
 
-            return min(scores), saved_candidate, original_reference, saved_start, reverse
+            return Superposition(score=scores[location], rotation=rotations[0], translation=translations[0],
+                                 start=starts[location], reverse=reverse,
+                                 structure=original_candidate, reference=original_reference)
 
-        elif self.similar_type == "TM":
-            if self.model_type == "N-CA-C-O":  # protein consists of skeleton comprised of N, C-alpha, C, and O atoms.
-                if len(structure_1) % 4 != 0:
-                    raise ValueError("The structure 1 of length (" + str(len(structure_1))
-                                     + ") does not conform to N-CA-C-O protein model!")
-                if len(structure_2) % 4 != 0:
-                    raise ValueError("The structure 2 of length (" + str(len(structure_2))
-                                     + ") does not conform to N-CA-C-O protein model!")
-
-                chain_length = len(original_candidate) / 4
-                if chain_length > 21:
-                    factor = 1.24 * (chain_length - 15) ** (1.0 / 3.0) - 1.8
-                else:
-                    factor = 0.50
-
-                samples = arange(0, len(original_candidate), 4)
-                for bias in range(4):
-                    c, r = original_candidate[samples + bias], original_reference[samples + bias]
-                    for _, _, candidate, reference, start in self.kabsch(c, r, use_center):
-                        value = linalg.norm((candidate - reference), ord=2, axis=1)
-                        value = sum(1.0 / (1.0 + (value / factor) ** 2)) / len(original_candidate[samples + bias])
-                        saved_candidates.append((candidate, start))
-                        scores.append(value)
-
-                screen = len(original_reference) - len(original_candidate) + 1
-                number = 1 if use_center else len(original_candidate)
-                scores = sum(array(scores).reshape((4, screen, number)), axis=0).reshape(-1)
-                location = argmax(scores)
-                saved_candidate, start = zeros(shape=(len(original_candidate), 3)), None
-                for bias in range(4):
-                    saved_candidate[samples + bias], start = saved_candidates[location]
-                    location += screen * number
-
-            elif self.model_type == "CA":  # protein consists of skeleton comprised of C-alpha.
-                if len(original_candidate) > 21:
-                    factor = 1.24 * (len(original_candidate) - 15) ** (1.0 / 3.0) - 1.8
-                else:
-                    factor = 0.50
-
-                for _, _, candidate, reference, start in self.kabsch(original_candidate, original_reference,
-                                                                     use_center):
-                    value = linalg.norm((candidate - reference), ord=2, axis=1)
-                    value = sum(1.0 / (1.0 + (value / factor) ** 2)) / len(original_candidate)
-                    saved_candidates.append((candidate, start))
-                    scores.append(value)
-
-                saved_candidate, start = saved_candidates[argmax(scores)]
-
-            elif self.model_type == "3SPN":  # 3SPN model (three sites per nucleotide).
-                if len(structure_1) % 3 != 0:
-                    raise ValueError("The structure 1 of length (" + str(len(structure_1))
-                                     + ") does not conform to 3SPN nucleotide sequence model!")
-                if len(structure_2) % 3 != 0:
-                    raise ValueError("The structure 2 of length (" + str(len(structure_2))
-                                     + ") does not conform to 3SPN nucleotide sequence model!")
-
-                chain_length = len(original_candidate) / 3
-                if chain_length > 30:
-                    factor = 0.6 * sqrt(len(original_candidate) - 0.5) - 2.5
-                elif 24 <= chain_length <= 30:
-                    factor = 0.7
-                elif 20 <= chain_length <= 23:
-                    factor = 0.6
-                elif 16 <= chain_length <= 19:
-                    factor = 0.5
-                elif 12 <= chain_length <= 15:
-                    factor = 0.4
-                else:
-                    factor = 0.3
-
-                samples = arange(0, len(original_candidate), 3)
-                for bias in range(3):
-                    c, r = original_candidate[samples + bias], original_reference[samples + bias]
-                    for _, _, candidate, reference, start in self.kabsch(c, r, use_center):
-                        value = linalg.norm((candidate - reference), ord=2, axis=1)
-                        value = sum(1.0 / (1.0 + (value / factor) ** 2)) / len(original_candidate[samples + bias])
-                        saved_candidates.append((candidate, start))
-                        scores.append(value)
-
-                screen = len(original_reference) - len(original_candidate) + 1
-                number = 1 if use_center else len(original_candidate)
-                scores = sum(array(scores).reshape((3, screen, number)), axis=0).reshape(-1)
-                location = argmax(scores)
-                saved_candidate, start = zeros(shape=(len(original_candidate), 3)), None
-                for bias in range(3):
-                    saved_candidate[samples + bias], start = saved_candidates[location]
-                    location += screen * number
-
-            elif self.model_type == "C3'":  # single atom in nucleic acid structures (e.g. C3').
-                if len(original_candidate) > 30:
-                    factor = 0.6 * sqrt(len(original_candidate) - 0.5) - 2.5
-                elif 24 <= len(original_candidate) <= 30:
-                    factor = 0.7
-                elif 20 <= len(original_candidate) <= 23:
-                    factor = 0.6
-                elif 16 <= len(original_candidate) <= 19:
-                    factor = 0.5
-                elif 12 <= len(original_candidate) <= 15:
-                    factor = 0.4
-                else:
-                    factor = 0.3
+        if structure_1.shape != structure_2.shape:
+            starts = []
+            if sequences is not None:
+                starts = self.anchor(original_candidate, original_reference, sequences[0], sequences[1])
+            if len(starts) == 0 and self.coarse_step > 1 \
+                    and len(original_candidate) // unit_number >= 3 * self.coarse_step:
+                starts = self.search(original_candidate, original_reference, factor, unit_number) * unit_number
+
+            if len(starts) > 0:
+                score, rotation, translation, start = self.refine(original_candidate, original_reference, starts,
+                                                                  factor, unit_number, threshold)
+                return Superposition(score=score, rotation=rotation, translation=translation, start=start,
+                                     reverse=reverse, structure=original_candidate, reference=original_reference)
+
+        # all the atom types are superposed in one pass, and the scores of all atom types are accumulated.
+        scores, starts = self.scan(original_candidate, original_reference, use_center, factor, prune=True,
+                                   unit_number=unit_number, threshold=threshold)
 
-                for _, _, candidate, reference, start in self.kabsch(original_candidate, original_reference,
-                                                                     use_center):
-                    value = linalg.norm((candidate - reference), ord=2, axis=1)
-                    value = sum(1.0 / (1.0 + (value / factor) ** 2)) / len(original_candidate)
-                    saved_candidates.append((candidate, start))
-                    scores.append(value)
+        if self.similar_type == "RMSD":
+            location = argmin(scores)
+        else:
+            location = argmax(scores)
 
-                saved_candidate, start = saved_candidates[argmax(scores)]
+        # only the best superposition needs to be rebuilt, the rotated candidate structure is produced on request.
+        rotations, translations, _ = self.superpose(original_candidate, original_reference, use_center,
+                                                    [location], unit_number)
 
-            else:
-                raise ValueError("No such model type!")
-
-            return max(scores), saved_candidate, original_reference, start, reverse
-
-        elif self.similar_type == "GDT-HA":
-            if self.model_type == "N-CA-C-O":
-                samples = arange(0, len(original_candidate), 4)
-                for bias in range(4):
-                    c, r = original_candidate[samples + bias], original_reference[samples + bias]
-                    for _, _, candidate, reference, start in self.kabsch(c, r, use_center):
-                        cutoffs = {0.5: 0, 1.0: 0, 2.0: 0, 4.0: 0}
-                        values = linalg.norm(candidate - reference, ord=2, axis=1)
-                        for cutoff, threshold in cutoffs.items():
-                            cutoffs[cutoff] = len(where(values < cutoff)[0])
-                        saved_candidates.append((candidate, start))
-                        scores.append(sum(list(cutoffs.values())) / (4.0 * len(original_candidate) / 4) * 100.0)
-
-                screen = len(original_reference) - len(original_candidate) + 1
-                number = 1 if use_center else len(original_candidate)
-                scores = sum(array(scores).reshape((4, screen, number)), axis=0).reshape(-1)
-                location = argmax(scores)
-                saved_candidate, start = zeros(shape=(len(original_candidate), 3)), None
-                for bias in range(4):
-                    saved_candidate[samples + bias], start = saved_candidates[location]
-                    location += screen * number
-
-            elif self.model_type == "CA":
-                for _, _, candidate, reference, start in self.kabsch(original_candidate, original_reference,
-                                                                     use_center):
-                    cutoffs = {0.5: 0, 1.0: 0, 2.0: 0, 4.0: 0}
-                    values = linalg.norm(candidate - reference, ord=2, axis=1)
-                    for cutoff, threshold in cutoffs.items():
-                        cutoffs[cutoff] = len(where(values < cutoff)[0])
-                    saved_candidates.append((candidate, start))
-                    scores.append(sum(list(cutoffs.values())) / (4.0 * len(original_candidate)) * 100.0)
-
-                saved_candidate, start = saved_candidates[argmax(scores)]
+        return Superposition(score=scores[location], rotation=rotations[0], translation=translations[0],
+                             start=starts[location], reverse=reverse,
+                             structure=original_candidate, reference=original_reference)
 
-            else:
-                raise ValueError("No such model type!")
+    def get_key(self, structure_1: ndarray, structure_2: ndarray, use_center: bool = True, threshold: float = None,
+                sequences: tuple = None) -> str:
+        """
+        Get the cache key of one call from the structure contents and the score parameters.
 
-            return max(scores), saved_candidate, original_reference, start, reverse
+        :param structure_1: molecule structure 1.
+        :type structure_1: numpy.ndarray
 
-        elif self.similar_type == "GDT-TS":
-            if self.model_type == "N-CA-C-O":
-                samples = arange(0, len(original_candidate), 4)
-                for bias in range(4):
-                    c, r = original_candidate[samples + bias], original_reference[samples + bias]
-                    for _, _, candidate, reference, start in self.kabsch(c, r, use_center):
-                        cutoffs = {1.0: 0, 2.0: 0, 4.0: 0, 8.0: 0}
-                        values = linalg.norm(candidate - reference, ord=2, axis=1)
-                        for cutoff, threshold in cutoffs.items():
-                            cutoffs[cutoff] = len(where(values < cutoff)[0])
-                        saved_candidates.append((candidate, start))
-                        scores.append(sum(list(cutoffs.values())) / (4.0 * len(original_candidate) / 4) * 100.0)
-
-                screen = len(original_reference) - len(original_candidate) + 1
-                number = 1 if use_center else len(original_candidate)
-                scores = sum(array(scores).reshape((4, screen, number)), axis=0).reshape(-1)
-                location = argmax(scores)
-                saved_candidate, start = zeros(shape=(len(original_candidate), 3)), None
-                for bias in range(4):
-                    saved_candidate[samples + bias], start = saved_candidates[location]
-                    location += screen * number
-
-            elif self.model_type == "CA":
-                for _, _, candidate, reference, start in self.kabsch(original_candidate, original_reference,
-                                                                     use_center):
-                    cutoffs = {1.0: 0, 2.0: 0, 4.0: 0, 8.0: 0}
-                    values = linalg.norm(candidate - reference, ord=2, axis=1)
-                    for cutoff, threshold in cutoffs.items():
-                        cutoffs[cutoff] = len(where(values < cutoff)[0])
-                    saved_candidates.append((candidate, start))
-                    scores.append(sum(list(cutoffs.values())) / (4.0 * len(original_candidate)) * 100.0)
-
-                saved_candidate, start = saved_candidates[argmax(scores)]
+        :param structure_2: molecule structure 2.
+        :type structure_2: numpy.ndarray
 
-            else:
-                raise ValueError("No such model type!")
+        :param use_center: use the structure center as the rotation center.
+        :type use_center: bool
 
-            return max(scores), saved_candidate, original_reference, start, reverse
+        :param threshold: stop as soon as one superposition satisfies the threshold.
+        :type threshold: float or None
 
-        else:
-            raise ValueError("No such distance type!")
+        :param sequences: sequences of the structure 1 and the structure 2.
+        :type sequences: tuple or None
 
-    def get_params(self):
+        :return: cache key.
+        :rtype: str
         """
-        Get the distance type and model type.
+        hasher = blake2b(digest_size=16)
+        for structure in [structure_1, structure_2]:
+            hasher.update(str((structure.shape, structure.dtype.str)).encode())
+            hasher.update(structure.tobytes())
+        hasher.update(str((use_center, threshold, sequences, self.similar_type, self.model_type, self.precision,
+                           self.backend, self.coarse_step, self.refine_number, self.kmer_length)).encode())
+        return hasher.hexdigest()
+
+    def cache_info(self) -> dict:
+        """
+        Get the statistics of the cache.
 
-        :return: distance type and model type.
-        :rtype: str, str
+        :return: hit number, miss number, current size and maximum size of the cache.
+        :rtype: dict
         """
-        return self.similar_type, self.model_type
+        return {"hits": self.hits, "misses": self.misses, "size": len(self.cache), "maximum size": self.cache_size}
 
-    @staticmethod
-    def kabsch(candidate_structure: ndarray, reference_structure: ndarray, use_center: bool = True) -> Iterator[tuple]:
+    def refine(self, candidate_structure: ndarray, reference_structure: ndarray, starts: ndarray,
+               factor: float = None, unit_number: int = 1, threshold: float = None) -> tuple:
         """
-        Rotate candidate structure unto reference structure using Kabsch algorithm based on each position.
+        Superpose the candidate structure onto the given windows of the reference structure at full resolution.
 
         :param candidate_structure: candidate structure represented by three-dimension position list.
         :type candidate_structure: numpy.ndarray
@@ -365,41 +471,91 @@ class Score:
         :param reference_structure: reference structure represented by three-dimension position list.
         :type reference_structure: numpy.ndarray
 
-        :param use_center: use center location.
-        :type use_center: bool
+        :param starts: start locations (in atoms) of the windows, from the most promising one.
+        :type starts: numpy.ndarray
 
-        :return: current index, total index, final candidate structure and reference structure.
-        :rtype: int, int, numpy.ndarray, numpy.ndarray
+        :param factor: distance scale of TM-score.
+        :type factor: float or None
+
+        :param unit_number: number of atom types in one unit (residue or nucleotide) of the structures.
+        :type unit_number: int
+
+        :param threshold: stop as soon as one superposition satisfies the threshold.
+        :type threshold: float or None
+
+        :return: best score, rotation matrix, translation vector and start location.
+        :rtype: float, numpy.ndarray, numpy.ndarray, int
         """
-        # Yang Zhang and Jeffrey Skolnick (2004) Proteins
-        # Wolfgang Kabsch (1976) Acta Crystallogr. D.
+        length, best_result = len(candidate_structure), None
+        for start in starts:
+            window = reference_structure[start: start + length]
+            scores, _ = self.scan(candidate_structure, window, False, factor, prune=True, unit_number=unit_number,
+                                  threshold=threshold)
+            location = argmin(scores) if self.similar_type == "RMSD" else argmax(scores)
+            if best_result is None or (self.similar_type == "RMSD" and scores[location] < best_result[0]) \
+                    or (self.similar_type != "RMSD" and scores[location] > best_result[0]):
+                best_result = (scores[location], start, location)
+            if threshold is not None and ((self.similar_type == "RMSD" and best_result[0] <= threshold)
+                                          or (self.similar_type != "RMSD" and best_result[0] >= threshold)):
+                break
+
+        score, start, location = best_result
+        window = reference_structure[start: start + length]
+        rotations, translations, _ = self.superpose(candidate_structure, window, False, [location], unit_number)
+
+        return score, rotations[0], translations[0], start
+
+    def anchor(self, candidate_structure: ndarray, reference_structure: ndarray, candidate_sequence: str,
+               reference_sequence: str) -> ndarray:
+        """
+        Propose the plausible register offsets of the candidate structure by the k-mer index of the reference sequence.
 
-        if len(candidate_structure) > len(reference_structure):
-            raise ValueError("The length of candidate structure needs to be less than or equal to "
-                             + "that of reference structure!")
+        :param candidate_structure: candidate structure represented by three-dimension position list.
+        :type candidate_structure: numpy.ndarray
 
-        align_number = len(reference_structure) - len(candidate_structure) + 1
-        for align_location in range(align_number):
-            c = candidate_structure.copy()
-            r = reference_structure[align_location: len(candidate_structure) + align_location]
-            if use_center:
-                used_c = c - mean(c, axis=0)
-                used_r = r - mean(r, axis=0)
-                rotation = Rotation.align_vectors(used_c, used_r)[0].as_matrix()
-                final_c, final_r = dot(used_c, rotation) + mean(r, axis=0), used_r + mean(r, axis=0)
-                yield 0, 1, final_c, final_r, align_location
-            else:
-                for center_location in range(len(candidate_structure)):
-                    used_c = c - c[center_location]
-                    used_r = r - r[center_location]
-                    rotation = Rotation.align_vectors(used_c, used_r)[0].as_matrix()
-                    final_c, final_r = dot(used_c, rotation) + r[center_location], used_r + r[center_location]
-                    yield center_location, len(candidate_structure), final_c, final_r, align_location
+        :param reference_structure: reference structure represented by three-dimension position list.
+        :type reference_structure: numpy.ndarray
 
-    @staticmethod
-    def get_rotation(candidate_structure, reference_structure):
+        :param candidate_sequence: sequence of the candidate structure.
+        :type candidate_sequence: str
+
+        :param reference_sequence: sequence of the reference structure.
+        :type reference_sequence: str
+
+        :return: start locations (in atoms) of the proposed offsets, from the most voted one.
+        :rtype: numpy.ndarray
+
+        .. note::
+            Each shared k-mer votes for the offset aligning its two occurrences,
+            the offsets without any vote are not proposed.
         """
-        Get the rotation matrix.
+        if len(candidate_structure) % len(candidate_sequence) != 0:
+            raise ValueError("The candidate sequence does not match the candidate structure!")
+        if len(reference_structure) % len(reference_sequence) != 0:
+            raise ValueError("The reference sequence does not match the reference structure!")
+
+        atom_number = len(reference_structure) // len(reference_sequence)
+        offset_number = len(reference_sequence) - len(candidate_sequence) + 1
+
+        # index the k-mers of the reference sequence by their locations.
+        positions = {}
+        for location, (sub_chain, _) in enumerate(kmer(reference_sequence, reference_structure, self.kmer_length)):
+            positions.setdefault(sub_chain, []).append(location)
+
+        votes = zeros(shape=(max([offset_number, 0]),), dtype=int)
+        for location, (sub_chain, _) in enumerate(kmer(candidate_sequence, candidate_structure, self.kmer_length)):
+            for position in positions.get(sub_chain, []):
+                if 0 <= position - location < offset_number:
+                    votes[position - location] += 1
+
+        offsets = argsort(-votes, kind="stable")[:self.refine_number]
+        return offsets[votes[offsets] > 0] * atom_number
+
+    def search(self, candidate_structure: ndarray, reference_structure: ndarray, factor: float = None,
+               unit_number: int = 1) -> ndarray:
+        """
+        Search the promising offsets of the shorter candidate structure along the reference structure,
+        using the structures subsampled by the coarse step.
 
         :param candidate_structure: candidate structure represented by three-dimension position list.
         :type candidate_structure: numpy.ndarray
@@ -407,121 +563,2140 @@ class Score:
         :param reference_structure: reference structure represented by three-dimension position list.
         :type reference_structure: numpy.ndarray
 
-        :return: rotation matrix.
+        :param factor: distance scale of TM-score.
+        :type factor: float or None
+
+        :param unit_number: number of atom types in one unit (residue or nucleotide) of the structures.
+        :type unit_number: int
+
+        :return: offsets (in units) of the refined superpositions, from the most promising one.
         :rtype: numpy.ndarray
+
+        .. note::
+            The offsets sharing the same remainder by the coarse step share one subsampled reference structure.
+            Each offset is scored by one superposition of the subsampled structures around their centers.
         """
-        # unify the center point.
-        center = dot(transpose(candidate_structure), reference_structure)
+        candidate_units = candidate_structure.reshape(-1, unit_number, 3)
+        reference_units = reference_structure.reshape(-1, unit_number, 3)
+        offset_number = len(reference_units) - len(candidate_units) + 1
+        coarse_candidate = candidate_units[::self.coarse_step].reshape(-1, 3)
+
+        coarse_scores = full(offset_number, inf if self.similar_type == "RMSD" else -inf)
+        for remainder in range(min([self.coarse_step, offset_number])):
+            coarse_reference = reference_units[remainder::self.coarse_step].reshape(-1, 3)
+            if len(coarse_reference) < len(coarse_candidate):
+                continue
+
+            # each window is superposed by the structure centers only.
+            scores, _ = self.scan(coarse_candidate, coarse_reference, True, factor, unit_number=unit_number)
+            offsets = remainder + arange(len(scores)) * self.coarse_step
+            coarse_scores[offsets[offsets < offset_number]] = scores[offsets < offset_number]
 
-        # decompose the singular value for rotation matrix.
-        translation, _, unitary = linalg.svd(center)
-        if (linalg.det(translation) * linalg.det(unitary)) < 0.0:
-            translation[:, -1] = -translation[:, -1]
+        if self.similar_type == "RMSD":
+            order = argsort(coarse_scores, kind="stable")
+        else:
+            order = argsort(-coarse_scores, kind="stable")
 
-        # create rotation matrix and rotate candidate structure.
-        return dot(translation, unitary)
+        return order[:self.refine_number]
 
+    def many_to_one(self, structures: ndarray, reference: ndarray, use_center: bool = True,
+                    block_size: int = 64) -> ndarray:
+        """
+        Calculate the scores of many structures against one reference structure.
 
-def similar(structure_1, structure_2, score_method, use_center: bool = True, metrics: float = None) -> tuple:
-    """
-    Judge whether two structures are similar.
+        :param structures: structures, format of which is (structure number, structure length, 3).
+        :type structures: numpy.ndarray
 
-    :param structure_1: molecule structure 1.
-    :type structure_1: numpy.ndarray
+        :param reference: reference structure.
+        :type reference: numpy.ndarray
 
-    :param structure_2: molecule structure 2.
-    :type structure_2: numpy.ndarray
+        :param use_center: use the structure center as the rotation center.
+        :type use_center: bool
 
-    :param score_method: method to calculate the similarity score.
-    :type score_method: molpub.handles.Score
+        :param block_size: number of structures calculated together, which bounds the memory.
+        :type block_size: int
 
-    :param use_center: use center location.
-    :type use_center: bool
+        :return: scores of the structures.
+        :rtype: numpy.ndarray
 
-    :param metrics: score metrics to determine whether any two structures are similarity.
-    :type metrics: float or None
+        .. note::
+            The structures sharing the shape of the reference structure are calculated block by block
+            with the structure centers as the rotation centers. Otherwise, each structure is calculated by itself.
+        """
+        scores = zeros(shape=(len(structures),), dtype=self.precision)
+        reference = asarray(reference, dtype=self.precision)
+        if not use_center or len(structures) == 0 or structures[0].shape != reference.shape:
+            for index, structure in enumerate(structures):
+                scores[index] = self(structure, reference, use_center).score
+            return scores
+
+        unit_number, factor = self.get_unit_number(reference, reference), self.get_factor(len(reference))
+        centered_reference = (reference - mean(reference, axis=0))[None]
+        for location in range(0, len(structures), block_size):
+            block = asarray(structures[location: location + block_size], dtype=self.precision)
+            centered_block = block - mean(block, axis=1)[:, None]
+            scores[location: location + len(block)] = self.stack(centered_block, centered_reference,
+                                                                 unit_number, factor)[:, 0]
+
+        return scores
+
+    def many_to_many(self, structures_1: ndarray, structures_2: ndarray = None, use_center: bool = True,
+                     block_size: int = 64) -> ndarray:
+        """
+        Calculate the score matrix between two groups of structures.
 
-    :return: flag, rotated candidate structure, original reference structure, start location, structure is reversed.
-    :rtype: tuple[bool, numpy.ndarray, numpy.ndarray, int, bool]
-    """
-    score_value, candidate, reference, start_location, reverse = score_method(structure_1, structure_2, use_center)
-    distance_type, model_type = score_method.get_params()
+        :param structures_1: structures as the candidates, format of which is (structure number, structure length, 3).
+        :type structures_1: numpy.ndarray
 
-    if distance_type == "RMSD":
-        if metrics is None:
-            raise ValueError("The metrics for RMSD method should be declared!")
+        :param structures_2: structures as the references, the structures 1 are used if None.
+        :type structures_2: numpy.ndarray or None
+
+        :param use_center: use the structure center as the rotation center.
+        :type use_center: bool
+
+        :param block_size: number of structures in one block, the memory is bounded by (block size)^2 superpositions.
+        :type block_size: int
+
+        :return: score matrix, format of which is (number of structures 1, number of structures 2).
+        :rtype: numpy.ndarray
+
+        .. note::
+            Without the structures 2, only the upper triangle blocks are calculated and mirrored,
+            except for lDDT, which is asymmetric (the candidate is scored against the reference).
+        """
+        symmetric = structures_2 is None and self.similar_type != "lDDT"
+        if structures_2 is None:
+            structures_2 = structures_1
+
+        scores = zeros(shape=(len(structures_1), len(structures_2)), dtype=self.precision)
+        for location_1 in range(0, len(structures_1), block_size):
+            block_1 = asarray(structures_1[location_1: location_1 + block_size], dtype=self.precision)
+            for location_2 in range(location_1 if symmetric else 0, len(structures_2), block_size):
+                block_2 = asarray(structures_2[location_2: location_2 + block_size], dtype=self.precision)
+                rows = slice(location_1, location_1 + len(block_1))
+                columns = slice(location_2, location_2 + len(block_2))
+                if use_center and block_1.shape[1:] == block_2.shape[1:]:
+                    unit_number = self.get_unit_number(block_1[0], block_2[0])
+                    scores[rows, columns] = self.stack(block_1 - mean(block_1, axis=1)[:, None],
+                                                       block_2 - mean(block_2, axis=1)[:, None],
+                                                       unit_number, self.get_factor(block_1.shape[1]))
+                else:
+                    for index_1, structure_1 in enumerate(block_1):
+                        for index_2, structure_2 in enumerate(block_2):
+                            result = self(structure_1, structure_2, use_center)
+                            scores[location_1 + index_1, location_2 + index_2] = result.score
+
+                if symmetric and location_2 > location_1:
+                    scores[columns, rows] = scores[rows, columns].T
+
+        return scores
+
+    def validate(self, structures: ndarray, reference: ndarray, use_center: bool = True) -> float:
+        """
+        Validate the scores of the current precision by the scores of float64 precision.
+
+        :param structures: structures, format of which is (structure number, structure length, 3).
+        :type structures: numpy.ndarray
+
+        :param reference: reference structure.
+        :type reference: numpy.ndarray
+
+        :param use_center: use the structure center as the rotation center.
+        :type use_center: bool
+
+        :return: maximum absolute deviation of the scores from float64 precision.
+        :rtype: float
+        """
+        if self.precision == "float64":
+            return 0.0
+
+        scores = self.many_to_one(structures, reference, use_center)
+        expected_method = Score(self.similar_type, self.model_type, "float64", self.backend)
+        expected_scores = expected_method.many_to_one(structures, reference, use_center)
+        return float(max(abs(scores.astype("float64") - expected_scores), initial=0.0))
+
+    def stack(self, candidates: ndarray, references: ndarray, unit_number: int = 1, factor: float = None) -> ndarray:
+        """
+        Calculate the scores between two stacks of centered structures, rotating around the structure centers.
+
+        :param candidates: centered candidate structures, format of which is (candidate number, structure length, 3).
+        :type candidates: numpy.ndarray
+
+        :param references: centered reference structures, format of which is (reference number, structure length, 3).
+        :type references: numpy.ndarray
+
+        :param unit_number: number of atom types in one unit (residue or nucleotide) of the structures.
+        :type unit_number: int
+
+        :param factor: distance scale of TM-score.
+        :type factor: float or None
+
+        :return: scores, format of which is (candidate number, reference number).
+        :rtype: numpy.ndarray
+        """
+        candidate_number, reference_number, length = len(candidates), len(references), candidates.shape[1]
+
+        if self.similar_type == "lDDT":
+            scores = zeros(shape=(candidate_number, reference_number), dtype=candidates.dtype)
+            for index, reference in enumerate(references):
+                pairs, distances = self.get_neighbors(reference, unit_number)
+                scores[:, index] = self.compare(candidates, pairs, distances)
+            return scores
+
+        # all the cross-covariance matrices come from one matrix product.
+        covariances = dot(transpose(candidates, (0, 2, 1)).reshape(-1, length),
+                          transpose(references, (1, 0, 2)).reshape(length, -1))
+        covariances = transpose(covariances.reshape(candidate_number, 3, reference_number, 3), (0, 2, 1, 3))
+        covariances = covariances.reshape(-1, 3, 3)
+
+        if self.similar_type == "RMSD":
+            candidate_inners = sum(candidates ** 2, axis=(1, 2)).repeat(reference_number)
+            reference_inners = tile(sum(references ** 2, axis=(1, 2)), candidate_number)
+            deviations = self.qcp(covariances, candidate_inners, reference_inners, self.backend)
+            return (sqrt(deviations) / length).reshape(candidate_number, reference_number)
+
+        rotations = self.get_rotations(covariances).reshape(candidate_number, reference_number, 3, 3)
+        scores = zeros(shape=(candidate_number, reference_number), dtype=candidates.dtype)
+        if self.backend == "numba":  # the reference structures are scanned as one structure without translation.
+            translations = zeros(shape=(reference_number, 3), dtype=candidates.dtype)
+            flattened_references, starts = references.reshape(-1, 3), arange(reference_number) * length
+            for index, candidate in enumerate(candidates):
+                scores[index] = self.evaluate(candidate, rotations[index], translations, flattened_references, starts,
+                                              factor, unit_number)
+        else:
+            for index, candidate in enumerate(candidates):
+                deltas = matmul(candidate, rotations[index]) - references
+                scores[index] = self.measure(einsum("klj,klj->kl", deltas, deltas), factor, unit_number)
+
+        return scores
+
+    def get_params(self):
+        """
+        Get the distance type and model type.
+
+        :return: distance type and model type.
+        :rtype: str, str
+        """
+        return self.similar_type, self.model_type
+
+    def get_unit_number(self, structure_1: ndarray, structure_2: ndarray) -> int:
+        """
+        Check the structures with the model type and get the number of atom types in one unit.
+
+        :param structure_1: molecule structure 1.
+        :type structure_1: numpy.ndarray
+
+        :param structure_2: molecule structure 2.
+        :type structure_2: numpy.ndarray
+
+        :return: number of atom types in one unit (residue or nucleotide).
+        :rtype: int
+        """
+        if self.similar_type not in ["RMSD", "TM", "GDT-HA", "GDT-TS", "lDDT"]:
+            raise ValueError("No such distance type!")
+
+        if self.similar_type == "RMSD":
+            return 1  # root-mean-square deviation is calculated on all the atoms together.
+
+        elif self.model_type == "N-CA-C-O":  # protein consists of skeleton comprised of N, C-alpha, C, and O atoms.
+            if len(structure_1) % 4 != 0:
+                raise ValueError("The structure 1 of length (" + str(len(structure_1))
+                                 + ") does not conform to N-CA-C-O protein model!")
+            if len(structure_2) % 4 != 0:
+                raise ValueError("The structure 2 of length (" + str(len(structure_2))
+                                 + ") does not conform to N-CA-C-O protein model!")
+            return 4
+
+        elif self.model_type == "CA":  # protein consists of skeleton comprised of C-alpha.
+            return 1
+
+        elif self.model_type == "3SPN" and self.similar_type in ["TM", "lDDT"]:  # 3SPN model (three sites per nucleotide).
+            if len(structure_1) % 3 != 0:
+                raise ValueError("The structure 1 of length (" + str(len(structure_1))
+                                 + ") does not conform to 3SPN nucleotide sequence model!")
+            if len(structure_2) % 3 != 0:
+                raise ValueError("The structure 2 of length (" + str(len(structure_2))
+                                 + ") does not conform to 3SPN nucleotide sequence model!")
+            return 3
+
+        elif self.model_type == "C3'" and self.similar_type in ["TM", "lDDT"]:  # single atom in nucleic acid structures.
+            return 1
+
+        else:
+            raise ValueError("No such model type!")
+
+    def get_factor(self, length: int) -> float:
+        """
+        Get the distance scale of TM-score for the candidate structure.
+
+        :param length: length of the candidate structure.
+        :type length: int
+
+        :return: distance scale.
+        :rtype: float
+        """
+        if self.similar_type != "TM":
+            return None
+
+        if self.model_type in ["N-CA-C-O", "CA"]:
+            chain_length = length / 4 if self.model_type == "N-CA-C-O" else length
+            if chain_length > 21:
+                return 1.24 * (chain_length - 15) ** (1.0 / 3.0) - 1.8
+            else:
+                return 0.50
+
+        elif self.model_type in ["3SPN", "C3'"]:
+            chain_length = length / 3 if self.model_type == "3SPN" else length
+            if chain_length > 30:
+                return 0.6 * sqrt(length - 0.5) - 2.5
+            elif 24 <= chain_length <= 30:
+                return 0.7
+            elif 20 <= chain_length <= 23:
+                return 0.6
+            elif 16 <= chain_length <= 19:
+                return 0.5
+            elif 12 <= chain_length <= 15:
+                return 0.4
+            else:
+                return 0.3
+
+        else:
+            raise ValueError("No such model type!")
+
+    def get_cutoffs(self) -> ndarray:
+        """
+        Get the distance cutoffs of GDT (or the distance difference cutoffs of lDDT).
+
+        :return: distance cutoffs.
+        :rtype: numpy.ndarray
+        """
+        if self.similar_type in ["GDT-HA", "lDDT"]:
+            return array([0.5, 1.0, 2.0, 4.0])
+        elif self.similar_type == "GDT-TS":
+            return array([1.0, 2.0, 4.0, 8.0])
+        else:
+            raise ValueError("No such distance type!")
+
+    def scan(self, candidate_structure: ndarray, reference_structure: ndarray, use_center: bool = True,
+             factor: float = None, prune: bool = False, unit_number: int = 1, threshold: float = None) -> tuple:
+        """
+        Calculate the scores of all the superpositions between candidate structure and reference structure.
+
+        :param candidate_structure: candidate structure represented by three-dimension position list.
+        :type candidate_structure: numpy.ndarray
+
+        :param reference_structure: reference structure represented by three-dimension position list.
+        :type reference_structure: numpy.ndarray
+
+        :param use_center: use center location.
+        :type use_center: bool
+
+        :param factor: distance scale of TM-score.
+        :type factor: float or None
+
+        :param prune: skip the superpositions whose upper bound scores cannot beat the current best score.
+        :type prune: bool
+
+        :param unit_number: number of atom types in one unit (residue or nucleotide) of the structures.
+        :type unit_number: int
+
+        :param threshold: stop as soon as one superposition satisfies the threshold.
+        :type threshold: float or None
+
+        :return: scores and start locations (in atoms) of all the superpositions.
+        :rtype: numpy.ndarray, numpy.ndarray
+
+        .. note::
+            The pruned or skipped superpositions are scored as negative infinity (positive infinity for RMSD).
+        """
+        if self.similar_type == "RMSD":
+            # the minimum deviations are obtained without building any rotation matrix.
+            covariances, candidate_inners, reference_inners, candidate_centers, reference_centers, starts = \
+                self.correlate(candidate_structure, reference_structure, use_center, unit_number)
+            length, number = len(candidate_structure), len(covariances)
+            if threshold is None:
+                deviations = self.qcp(covariances, candidate_inners, reference_inners, self.backend)
+                return sqrt(deviations) / length, starts
+
+            # lower bounds from the difference of gyration radii and the distance of the rotated centroids.
+            prefix_sums = concatenate((zeros(shape=(1, 3), dtype=reference_structure.dtype),
+                                       cumsum(reference_structure, axis=0)))
+            reference_centroids = (prefix_sums[starts + length] - prefix_sums[starts]) / length
+            candidate_offsets = linalg.norm(mean(candidate_structure, axis=0) - candidate_centers, ord=2, axis=1)
+            reference_offsets = linalg.norm(reference_centroids - reference_centers, ord=2, axis=1)
+            bounds = maximum((sqrt(candidate_inners) - sqrt(reference_inners)) ** 2,
+                             length * (candidate_offsets - reference_offsets) ** 2)
+            bounds, order = sqrt(bounds) / length, argsort(bounds, kind="stable")
+
+            block_size, scores = 1024, full(number, inf, dtype=covariances.dtype)
+            for location in range(0, number, block_size):
+                block = order[location: location + block_size]
+                if bounds[block[0]] > threshold:
+                    break  # the remaining superpositions cannot satisfy the threshold.
+
+                deviations = self.qcp(covariances[block], candidate_inners[block], reference_inners[block],
+                                      self.backend)
+                scores[block] = sqrt(deviations) / length
+                if min(scores[block]) <= threshold:
+                    break
+
+            return scores, starts
+
+        covariances, _, _, candidate_centers, reference_centers, starts = self.correlate(candidate_structure,
+                                                                                         reference_structure,
+                                                                                         use_center, unit_number)
+        length, number = len(candidate_structure), len(covariances)
+
+        if (prune or threshold is not None) and number > 1:
+            # visit the superpositions from the most promising one.
+            bounds = self.bound(candidate_structure, reference_structure, use_center, factor, unit_number)
+            order = argsort(-bounds, kind="stable")
+        else:
+            bounds, order = None, arange(number)
+
+        # rotate the candidate structure block by block, the memory is bounded by the block size.
+        block_size, scores, best_score = max([1, 2 ** 20 // length]), full(number, -inf, dtype=covariances.dtype), -inf
+        for location in range(0, number, block_size):
+            block = order[location: location + block_size]
+            if prune and bounds is not None and bounds[block[0]] <= best_score:
+                break  # the remaining superpositions cannot beat the best one.
+            if threshold is not None and bounds is not None and bounds[block[0]] < threshold:
+                break  # the remaining superpositions cannot satisfy the threshold.
+
+            rotations = self.get_rotations(covariances[block])
+            translations = reference_centers[block] - einsum("ki,kij->kj", candidate_centers[block], rotations)
+            scores[block] = self.evaluate(candidate_structure, rotations, translations, reference_structure,
+                                          starts[block], factor, unit_number)
+            best_score = max([best_score, max(scores[block])])
+            if threshold is not None and best_score >= threshold:
+                break
+
+        return scores, starts
+
+    def bound(self, candidate_structure: ndarray, reference_structure: ndarray, use_center: bool = True,
+              factor: float = None, unit_number: int = 1) -> ndarray:
+        """
+        Calculate the upper bound scores of all the superpositions without any rotation.
+
+        :param candidate_structure: candidate structure represented by three-dimension position list.
+        :type candidate_structure: numpy.ndarray
+
+        :param reference_structure: reference structure represented by three-dimension position list.
+        :type reference_structure: numpy.ndarray
+
+        :param use_center: use center location.
+        :type use_center: bool
+
+        :param factor: distance scale of TM-score.
+        :type factor: float or None
+
+        :param unit_number: number of atom types in one unit (residue or nucleotide) of the structures.
+        :type unit_number: int
+
+        :return: upper bound scores, ordered as the superpositions.
+        :rtype: numpy.ndarray
+
+        .. note::
+            A rotation keeps the distance from each atom to the rotation center, so the distance between
+            two matched atoms is at least the difference of their distances to the rotation centers.
+            The TM-score and GDT scores decrease with the distances, which gives the upper bounds.
+        """
+        if self.similar_type == "RMSD":
+            raise ValueError("The upper bound is only available for the similarity scores!")
+
+        length = len(candidate_structure)
+        windows = sliding_window_view(reference_structure, (length, 3))[::unit_number, 0]
+        if use_center:
+            candidate_radii = linalg.norm(candidate_structure - mean(candidate_structure, axis=0), ord=2, axis=1)
+            reference_radii = linalg.norm(windows - mean(windows, axis=1)[:, None], ord=2, axis=2)
+            return self.measure((candidate_radii - reference_radii) ** 2, factor, unit_number)
+
+        else:
+            # each position is the rotation center, the radii are the intra-structure distances.
+            candidate_radii, bounds = cdist(candidate_structure, candidate_structure), []
+            if len(reference_structure) <= 4096:  # the distance matrix of reference structure is affordable.
+                reference_radii = cdist(reference_structure, reference_structure)
+                if self.backend == "numba":
+                    starts = arange(0, len(reference_structure) - length + 1, unit_number)
+                    if self.similar_type == "TM":
+                        return tm_bound_kernel(candidate_radii, reference_radii, starts, factor, unit_number)
+                    else:
+                        return gdt_bound_kernel(candidate_radii, reference_radii, starts, self.get_cutoffs(),
+                                                unit_number)
+
+                for start in range(0, len(reference_structure) - length + 1, unit_number):
+                    window_radii = reference_radii[start: start + length, start: start + length]
+                    bounds.append(self.measure((candidate_radii - window_radii) ** 2, factor, unit_number))
+            else:
+                for window in windows:
+                    bounds.append(self.measure((candidate_radii - cdist(window, window)) ** 2, factor, unit_number))
+            return concatenate(bounds)
+
+    def get_neighbors(self, reference_structure: ndarray, unit_number: int = 1, radius: float = 15.0) -> tuple:
+        """
+        Get the neighbor atom pairs of the reference structure within the inclusion radius of lDDT.
+
+        :param reference_structure: reference structure represented by three-dimension position list.
+        :type reference_structure: numpy.ndarray
+
+        :param unit_number: number of atom types in one unit (residue or nucleotide) of the structure.
+        :type unit_number: int
+
+        :param radius: inclusion radius of the neighbor atoms.
+        :type radius: float
+
+        :return: neighbor atom pairs (ordered as i < j), format of which is (pair number, 2), and their distances.
+        :rtype: numpy.ndarray, numpy.ndarray
+
+        .. note::
+            The neighbor list is built by KD-tree once for each reference structure and reused by the later calls.
+            The atom pairs in the same unit are excluded.
+        """
+        key = blake2b(reference_structure.tobytes(), digest_size=16).hexdigest() + str(unit_number) + str(radius)
+        if key not in self.neighbors:
+            pairs = cKDTree(reference_structure).query_pairs(r=radius, output_type="ndarray")
+            pairs = pairs[pairs[:, 0] // unit_number != pairs[:, 1] // unit_number]
+            pairs = pairs[argsort(pairs[:, 0], kind="stable")]
+            deltas = reference_structure[pairs[:, 0]] - reference_structure[pairs[:, 1]]
+            if len(self.neighbors) >= 64:  # keep the neighbor lists of the latest reference structures.
+                del self.neighbors[next(iter(self.neighbors))]
+            self.neighbors[key] = (pairs, sqrt(einsum("kj,kj->k", deltas, deltas)))
+
+        return self.neighbors[key]
+
+    def compare(self, candidates: ndarray, pairs: ndarray, distances: ndarray) -> ndarray:
+        """
+        Calculate the lDDT scores of the candidate structures by the preserved distances of the neighbor pairs.
+
+        :param candidates: candidate structures, format of which is (candidate number, structure length, 3).
+        :type candidates: numpy.ndarray
+
+        :param pairs: neighbor atom pairs in the reference structure, format of which is (pair number, 2).
+        :type pairs: numpy.ndarray
+
+        :param distances: distances of the neighbor atom pairs in the reference structure.
+        :type distances: numpy.ndarray
+
+        :return: scores of the candidate structures, range from 0 to 1.
+        :rtype: numpy.ndarray
+
+        .. note::
+            Mariani V, Biasini M, Barbato A and Schwede T (2013) Bioinformatics.
+            The score is the fraction of the neighbor distances preserved within 0.5, 1, 2 and 4 angstroms,
+            averaged over the four cutoffs. The candidate structures without any neighbor pair are scored as 0.
+        """
+        if len(pairs) == 0:
+            return zeros(shape=(len(candidates),), dtype=candidates.dtype)
+
+        deltas = candidates[:, pairs[:, 0]] - candidates[:, pairs[:, 1]]
+        differences = abs(sqrt(einsum("kpj,kpj->kp", deltas, deltas)) - distances)
+        counts = zeros(shape=(len(candidates),), dtype=int)
+        for cutoff in self.get_cutoffs():
+            counts += count_nonzero(differences < cutoff, axis=1)
+
+        return counts / (4.0 * len(pairs))
+
+    def compare_windows(self, candidate_structure: ndarray, reference_structure: ndarray, unit_number: int = 1,
+                        memory_size: float = 64.0) -> tuple:
+        """
+        Calculate the lDDT scores of the candidate structure against all the windows of the reference structure.
+
+        :param candidate_structure: candidate structure represented by three-dimension position list.
+        :type candidate_structure: numpy.ndarray
+
+        :param reference_structure: longer reference structure represented by three-dimension position list.
+        :type reference_structure: numpy.ndarray
+
+        :param unit_number: number of atom types in one unit, the windows slide unit by unit.
+        :type unit_number: int
+
+        :param memory_size: maximum memory (in MB) of the intermediate pair arrays of one batch of windows.
+        :type memory_size: float
+
+        :return: scores and start locations (in atoms) of all the windows.
+        :rtype: numpy.ndarray, numpy.ndarray
+
+        .. note::
+            The neighbor pairs are sorted by their first atoms, so the pairs starting inside each window are
+            one slice found by binary search, and only the pairs ending inside the window are kept.
+            The pairs of a batch of windows are gathered and compared together,
+            so the work grows with the pairs inside the windows instead of all the pairs for each window.
+        """
+        length = len(candidate_structure)
+        pairs, distances = self.get_neighbors(reference_structure, unit_number)
+        starts = arange(0, len(reference_structure) - length + 1, unit_number)
+        scores = zeros(shape=(len(starts),), dtype=self.precision)
+        lowers = pairs[:, 0].searchsorted(starts, side="left")
+        uppers = pairs[:, 0].searchsorted(starts + length, side="left")
+
+        # about twelve values (of 8 bytes) of each gathered pair are kept by the comparison of one batch.
+        batch_size = int(max([memory_size * 2 ** 20 // (12 * 8), 1]))
+        sizes = uppers - lowers
+        ends = cumsum(sizes)
+        location = 0
+        while location < len(starts):
+            stop = max([int(ends.searchsorted(ends[location] - sizes[location] + batch_size, side="right")),
+                        location + 1])
+            batch_sizes = sizes[location: stop]
+            if batch_sizes.sum() > 0:
+                # the pair indices of each window in the batch, which are consecutive from its lower bound.
+                windows = arange(stop - location).repeat(batch_sizes)
+                offsets = arange(len(windows)) - (cumsum(batch_sizes) - batch_sizes).repeat(batch_sizes)
+                indices = lowers[location: stop].repeat(batch_sizes) + offsets
+                window_starts = starts[location: stop][windows]
+                inside = pairs[indices, 1] < window_starts + length
+                windows, indices, window_starts = windows[inside], indices[inside], window_starts[inside]
+
+                deltas = candidate_structure[pairs[indices, 0] - window_starts] \
+                    - candidate_structure[pairs[indices, 1] - window_starts]
+                differences = abs(sqrt(einsum("pj,pj->p", deltas, deltas)) - distances[indices])
+                counts = zeros(shape=(len(indices),), dtype=int)
+                for cutoff in self.get_cutoffs():
+                    counts += differences < cutoff
+
+                totals = bincount(windows, minlength=stop - location)
+                preserved = bincount(windows, weights=counts, minlength=stop - location)
+                valid = totals > 0  # the windows without any neighbor pair are scored as 0.
+                scores[location: stop][valid] = preserved[valid] / (4.0 * totals[valid])
+            location = stop
+
+        return scores, starts
+
+    def evaluate(self, candidate_structure: ndarray, rotations: ndarray, translations: ndarray,
+                 reference_structure: ndarray, starts: ndarray, factor: float = None, unit_number: int = 1) -> ndarray:
+        """
+        Move the candidate structure by the superpositions and calculate their scores (except RMSD).
+
+        :param candidate_structure: candidate structure represented by three-dimension position list.
+        :type candidate_structure: numpy.ndarray
+
+        :param rotations: rotation matrices, format of which is (superposition number, 3, 3).
+        :type rotations: numpy.ndarray
+
+        :param translations: translation vectors, format of which is (superposition number, 3).
+        :type translations: numpy.ndarray
+
+        :param reference_structure: reference structure represented by three-dimension position list.
+        :type reference_structure: numpy.ndarray
+
+        :param starts: start locations (in atoms) of the superpositions in the reference structure.
+        :type starts: numpy.ndarray
+
+        :param factor: distance scale of TM-score.
+        :type factor: float or None
+
+        :param unit_number: number of atom types in one unit (residue or nucleotide) of the structures.
+        :type unit_number: int
+
+        :return: scores of the superpositions.
+        :rtype: numpy.ndarray
+        """
+        if self.backend == "numba":
+            # the moved structures and the distances are never stored in the compiled kernels.
+            if self.similar_type == "TM":
+                scores = tm_kernel(candidate_structure, rotations, translations, reference_structure, starts,
+                                   factor, unit_number)
+            elif self.similar_type in ["GDT-HA", "GDT-TS"]:
+                scores = gdt_kernel(candidate_structure, rotations, translations, reference_structure, starts,
+                                    self.get_cutoffs(), unit_number)
+            else:
+                raise ValueError("No such distance type!")
+
+            return scores.astype(candidate_structure.dtype)
+
+        windows = sliding_window_view(reference_structure, (len(candidate_structure), 3))[:, 0]
+        deltas = matmul(candidate_structure, rotations) + translations[:, None] - windows[starts]
+        return self.measure(einsum("klj,klj->kl", deltas, deltas), factor, unit_number)
+
+    def measure(self, squares: ndarray, factor: float = None, unit_number: int = 1) -> ndarray:
+        """
+        Measure the scores from the squared atom distances of superpositions.
+
+        :param squares: squared atom distances, format of which is (superposition number, structure length).
+        :type squares: numpy.ndarray
+
+        :param factor: distance scale of TM-score.
+        :type factor: float or None
+
+        :param unit_number: number of atom types in one unit (residue or nucleotide) of the structures.
+        :type unit_number: int
+
+        :return: scores of superpositions.
+        :rtype: numpy.ndarray
+
+        .. note::
+            The contribution of each atom type is normalized by its own atom number,
+            and the contributions of all the atom types are accumulated as the score.
+            The squared distances are used directly, so no square root is taken for every atom.
+        """
+        # distances of each atom type, format of which is (superposition number, unit number, atom type number).
+        squares = squares.reshape(len(squares), -1, unit_number)
+
+        if self.similar_type == "RMSD":
+            # calculate the value of root-mean-square deviation on all the atoms together.
+            return sqrt(sum(squares, axis=(1, 2))) / (squares.shape[1] * unit_number)
+
+        elif self.similar_type == "TM":
+            contributions = sum(1.0 / (1.0 + squares / factor ** 2), axis=1) / squares.shape[1]
+
+        elif self.similar_type in ["GDT-HA", "GDT-TS"]:
+            cutoffs = self.get_cutoffs()
+
+            # compare the squared distances with the squared cutoff vector and count them in NumPy.
+            counts = zeros(shape=(len(squares), unit_number), dtype=int)
+            for cutoff in cutoffs ** 2:
+                counts += count_nonzero(squares < cutoff, axis=1)
+            contributions = counts / (len(cutoffs) * squares.shape[1]) * 100.0
+
+        else:
+            raise ValueError("No such distance type!")
+
+        return sum(contributions, axis=1)
+
+    @staticmethod
+    def superpose(candidate_structure: ndarray, reference_structure: ndarray, use_center: bool = True,
+                  locations: list = None, unit_number: int = 1) -> tuple:
+        """
+        Superpose candidate structure onto every window of reference structure by the batched Kabsch algorithm.
+
+        :param candidate_structure: candidate structure represented by three-dimension position list.
+        :type candidate_structure: numpy.ndarray
+
+        :param reference_structure: reference structure represented by three-dimension position list.
+        :type reference_structure: numpy.ndarray
+
+        :param use_center: use center location, otherwise each position is used as the rotation center.
+        :type use_center: bool
+
+        :param locations: indices of the required superpositions, all the superpositions are built if None.
+        :type locations: list or None
+
+        :param unit_number: number of atom types in one unit, the windows slide unit by unit.
+        :type unit_number: int
+
+        :return: rotation matrices, translation vectors and start locations (in atoms) of the superpositions.
+        :rtype: numpy.ndarray, numpy.ndarray, numpy.ndarray
+
+        .. note::
+            The superposition k rotates the candidate structure by "dot(candidate, rotations[k]) + translations[k]",
+            which matches the reference window started from "starts[k]".
+            Without center location, the superpositions are ordered by window first and rotation center second.
+        """
+        # Yang Zhang and Jeffrey Skolnick (2004) Proteins
+        # Wolfgang Kabsch (1976) Acta Crystallogr. D.
+        covariances, _, _, candidate_centers, reference_centers, starts = Score.correlate(candidate_structure,
+                                                                                          reference_structure,
+                                                                                          use_center, unit_number)
+        if locations is not None:
+            covariances, starts = covariances[locations], starts[locations]
+            candidate_centers, reference_centers = candidate_centers[locations], reference_centers[locations]
+
+        # decompose the singular values of the stacked matrices for the rotation matrices.
+        rotations = Score.get_rotations(covariances)
+        translations = reference_centers - einsum("ki,kij->kj", candidate_centers, rotations)
+
+        return rotations, translations, starts
+
+    @staticmethod
+    def correlate(candidate_structure: ndarray, reference_structure: ndarray, use_center: bool = True,
+                  unit_number: int = 1) -> tuple:
+        """
+        Calculate the centered cross-covariance matrices and inner products of all the superpositions.
+
+        :param candidate_structure: candidate structure represented by three-dimension position list.
+        :type candidate_structure: numpy.ndarray
+
+        :param reference_structure: reference structure represented by three-dimension position list.
+        :type reference_structure: numpy.ndarray
+
+        :param use_center: use center location, otherwise each position is used as the rotation center.
+        :type use_center: bool
+
+        :param unit_number: number of atom types in one unit, the windows slide unit by unit.
+        :type unit_number: int
+
+        :return: cross-covariance matrices, inner products of candidate and reference structure,
+            rotation centers of candidate and reference structure, and start locations.
+        :rtype: numpy.ndarray, numpy.ndarray, numpy.ndarray, numpy.ndarray, numpy.ndarray, numpy.ndarray
+        """
+        if len(candidate_structure) > len(reference_structure):
+            raise ValueError("The length of candidate structure needs to be less than or equal to "
+                             + "that of reference structure!")
+
+        # move both structures near the origin, keeping the sliding statistics well-conditioned.
+        candidate_origin, reference_origin = mean(candidate_structure, axis=0), mean(reference_structure, axis=0)
+        candidate_structure = candidate_structure - candidate_origin
+        reference_structure = reference_structure - reference_origin
+
+        length = len(candidate_structure)
+        covariances, candidate_sum, reference_sums, reference_squares = Score.slide(candidate_structure,
+                                                                                    reference_structure)
+        covariances, reference_sums = covariances[::unit_number], reference_sums[::unit_number]
+        reference_squares = reference_squares[::unit_number]
+        candidate_square, number = sum(candidate_structure ** 2), len(covariances)
+
+        if use_center:
+            candidate_centers = (candidate_sum / length)[None].repeat(number, axis=0)
+            reference_centers = reference_sums / length
+            covariances -= einsum("i,wj->wij", candidate_sum, reference_centers)
+            candidate_inners = (candidate_square - dot(candidate_sum, candidate_sum) / length).repeat(number)
+            reference_inners = reference_squares - sum(reference_sums ** 2, axis=1) / length
+            starts = arange(number) * unit_number
+        else:
+            # move the rotation center to each position: sum((c - c[k]) * (r - r[k])^T).
+            candidate_centers = candidate_structure[None].repeat(number, axis=0).reshape(-1, 3)
+            reference_centers = sliding_window_view(reference_structure, (length, 3))[::unit_number, 0].reshape(-1, 3)
+            reference_sums, reference_squares = reference_sums.repeat(length, axis=0), reference_squares.repeat(length)
+            covariances = covariances.repeat(length, axis=0)
+            covariances -= einsum("ki,kj->kij", candidate_centers, reference_sums)
+            covariances -= einsum("i,kj->kij", candidate_sum, reference_centers)
+            covariances += length * einsum("ki,kj->kij", candidate_centers, reference_centers)
+            candidate_inners = candidate_square - 2.0 * dot(candidate_centers, candidate_sum)
+            candidate_inners += length * sum(candidate_centers ** 2, axis=1)
+            reference_inners = reference_squares - 2.0 * sum(reference_centers * reference_sums, axis=1)
+            reference_inners += length * sum(reference_centers ** 2, axis=1)
+            starts = (arange(number) * unit_number).repeat(length)
+
+        candidate_centers += candidate_origin
+        reference_centers = reference_centers + reference_origin
+
+        return covariances, candidate_inners, reference_inners, candidate_centers, reference_centers, starts
+
+    @staticmethod
+    def slide(candidate_structure: ndarray, reference_structure: ndarray) -> tuple:
+        """
+        Slide candidate structure along reference structure to obtain the statistics of each window.
+
+        :param candidate_structure: candidate structure represented by three-dimension position list.
+        :type candidate_structure: numpy.ndarray
+
+        :param reference_structure: reference structure represented by three-dimension position list.
+        :type reference_structure: numpy.ndarray
+
+        :return: cross-covariance matrices (without centering), candidate coordinate sum,
+            window coordinate sums and window squared norms.
+        :rtype: numpy.ndarray, numpy.ndarray, numpy.ndarray, numpy.ndarray
+        """
+        length = len(candidate_structure)
+        number = len(reference_structure) - length + 1
+
+        # prefix sums of coordinates and squared norms (traces of outer products) make each window shift cost O(1).
+        dtype = reference_structure.dtype
+        prefix_sums = concatenate((zeros(shape=(1, 3), dtype=dtype), cumsum(reference_structure, axis=0)))
+        reference_sums = prefix_sums[length:] - prefix_sums[:number]
+        prefix_squares = concatenate((zeros(shape=(1,), dtype=dtype), cumsum(sum(reference_structure ** 2, axis=1))))
+        reference_squares = prefix_squares[length:] - prefix_squares[:number]
+
+        if number * length <= 2 ** 16:  # small scan, calculate the matrices directly.
+            windows = sliding_window_view(reference_structure, (length, 3))[:, 0]
+            covariances = einsum("li,wlj->wij", candidate_structure, windows)
+        else:
+            # cross-correlation theorem: sum(c[l] * r[s + l]^T) of all the shifts s in O(N log N).
+            size = 2 ** int(ceil(log2(len(reference_structure))))
+            candidate_spectrum = rfft(candidate_structure, n=size, axis=0)
+            reference_spectrum = rfft(reference_structure, n=size, axis=0)
+            spectrums = einsum("fi,fj->fij", conj(candidate_spectrum), reference_spectrum)
+            covariances = irfft(spectrums, n=size, axis=0)[:number].astype(dtype, copy=False)
+
+        return covariances, sum(candidate_structure, axis=0), reference_sums, reference_squares
+
+    @staticmethod
+    def qcp(covariances: ndarray, candidate_inners: ndarray, reference_inners: ndarray,
+            backend: str = "numpy") -> ndarray:
+        """
+        Calculate the minimum squared deviations by the quaternion characteristic polynomial (QCP) method.
+
+        :param covariances: centered cross-covariance matrices, format of which is (matrix number, 3, 3).
+        :type covariances: numpy.ndarray
+
+        :param candidate_inners: inner products of the centered candidate structures.
+        :type candidate_inners: numpy.ndarray
+
+        :param reference_inners: inner products of the centered reference structures.
+        :type reference_inners: numpy.ndarray
+
+        :param backend: calculation backend, including numpy and numba.
+        :type backend: str
+
+        :return: minimum sums of squared deviations after the optimal rotations.
+        :rtype: numpy.ndarray
+        """
+        tolerance = max([1e-11, 100.0 * finfo(covariances.dtype).eps])
+        if backend == "numba":
+            return qcp_kernel(covariances, candidate_inners, reference_inners, tolerance).astype(covariances.dtype)
+
+        # Douglas L. Theobald (2005) Acta Crystallogr. A.
+        # Pu Liu, Dimitris K. Agrafiotis and Douglas L. Theobald (2010) J. Comput. Chem.
+        (sxx, sxy, sxz), (syx, syy, syz), (szx, szy, szz) = transpose(covariances, (1, 2, 0))
+        keys = array([[sxx + syy + szz, syz - szy, szx - sxz, sxy - syx],
+                      [syz - szy, sxx - syy - szz, sxy + syx, szx + sxz],
+                      [szx - sxz, sxy + syx, -sxx + syy - szz, syz + szy],
+                      [sxy - syx, szx + sxz, syz + szy, -sxx - syy + szz]])
+
+        # characteristic polynomial of the key matrix: x^4 + c2 * x^2 + c1 * x + c0.
+        c2 = -2.0 * sum(covariances ** 2, axis=(1, 2))
+        c1 = -8.0 * linalg.det(covariances)
+        c0 = linalg.det(transpose(keys, (2, 0, 1)))
+
+        # the largest eigenvalue is found by the Newton-Raphson method from the upper bound.
+        inners = (candidate_inners + reference_inners) / 2.0
+        values = inners.copy()
+        for _ in range(50):
+            previous = values
+            numerators = ((values ** 2 + c2) * values + c1) * values + c0
+            denominators = (4.0 * values ** 2 + 2.0 * c2) * values + c1
+            denominators[denominators == 0.0] = 1.0  # the degenerate structures have converged.
+            values = values - numerators / denominators
+            if max(abs(values - previous), initial=0.0) <= tolerance * max(abs(values), initial=1.0):
+                break
+
+        return clip(2.0 * (inners - values), 0.0, None)
+
+    @staticmethod
+    def kabsch(candidate_structure: ndarray, reference_structure: ndarray, use_center: bool = True) -> Iterator[tuple]:
+        """
+        Rotate candidate structure unto reference structure using Kabsch algorithm based on each position.
+
+        :param candidate_structure: candidate structure represented by three-dimension position list.
+        :type candidate_structure: numpy.ndarray
+
+        :param reference_structure: reference structure represented by three-dimension position list.
+        :type reference_structure: numpy.ndarray
+
+        :param use_center: use center location.
+        :type use_center: bool
+
+        :return: current index, total index, final candidate structure and reference structure.
+        :rtype: int, int, numpy.ndarray, numpy.ndarray
+        """
+        rotations, translations, starts = Score.superpose(candidate_structure, reference_structure, use_center)
+        total = 1 if use_center else len(candidate_structure)
+        for index, (rotation, translation, align_location) in enumerate(zip(rotations, translations, starts)):
+            final_c = dot(candidate_structure, rotation) + translation
+            final_r = reference_structure[align_location: len(candidate_structure) + align_location]
+            yield index % total, total, final_c, final_r, align_location
+
+    @staticmethod
+    def get_rotation(candidate_structure, reference_structure):
+        """
+        Get the rotation matrix.
+
+        :param candidate_structure: candidate structure represented by three-dimension position list.
+        :type candidate_structure: numpy.ndarray
+
+        :param reference_structure: reference structure represented by three-dimension position list.
+        :type reference_structure: numpy.ndarray
+
+        :return: rotation matrix.
+        :rtype: numpy.ndarray
+        """
+        # unify the center point.
+        center = dot(transpose(candidate_structure), reference_structure)
+
+        # decompose the singular value for rotation matrix.
+        translation, _, unitary = linalg.svd(center)
+        if (linalg.det(translation) * linalg.det(unitary)) < 0.0:
+            translation[:, -1] = -translation[:, -1]
+
+        # create rotation matrix and rotate candidate structure.
+        return dot(translation, unitary)
+
+    @staticmethod
+    def get_rotations(covariances: ndarray) -> ndarray:
+        """
+        Get the rotation matrices from the stacked cross-covariance matrices.
+
+        :param covariances: cross-covariance matrices, format of which is (matrix number, 3, 3).
+        :type covariances: numpy.ndarray
+
+        :return: rotation matrices.
+        :rtype: numpy.ndarray
+        """
+        # decompose the singular values for all the matrices in one call.
+        translations, _, unitaries = linalg.svd(covariances)
+        signs = linalg.det(translations) * linalg.det(unitaries)
+        translations[signs < 0.0, :, -1] = -translations[signs < 0.0, :, -1]
+
+        return matmul(translations, unitaries)
+
+
+class ScoreMatrix:
+
+    def __init__(self, structure_number: int, similar_type: str = "RMSD", model_type: str = "CA",
+                 use_center: bool = True, keep_transforms: bool = True):
+        """
+        Initialize the score matrix, which stores the score and the transform of each unordered structure pair once.
+
+        :param structure_number: number of the structures.
+        :type structure_number: int
+
+        :param similar_type: method to calculate the similarity between two molecule structures.
+        :type similar_type: str
+
+        :param model_type: model used by structures (N-CA-C-O / CA for proteins, 3SPN / C3 for DNA and RNA sequences).
+        :type model_type: str
+
+        :param use_center: use center location.
+        :type use_center: bool
+
+        :param keep_transforms: store the rotation matrix, translation vector, start location and reverse flag
+            of each pair, otherwise only the scores are stored.
+        :type keep_transforms: bool
+
+        .. note::
+            The pairs (index 1 <= index 2) are stored in the row-major order of the upper triangle (with diagonal),
+            the score and the transform of pair (index 1, index 2) come from the score method called as
+            (index 2, index 1), the same direction as the "cluster" and "align" functions call it,
+            so the asymmetric lDDT score is only kept in this direction.
+        """
+        pair_number = structure_number * (structure_number + 1) // 2
+        self.structure_number = structure_number
+        self.similar_type = similar_type
+        self.model_type = model_type
+        self.use_center = use_center
+        self.keep_transforms = keep_transforms
+        self.scores = zeros(shape=(pair_number,))
+        if keep_transforms:
+            self.starts = zeros(shape=(pair_number,), dtype=int)
+            self.reverses = zeros(shape=(pair_number,), dtype=bool)
+            self.rotations = zeros(shape=(pair_number, 3, 3))
+            self.translations = zeros(shape=(pair_number, 3))
+        else:
+            self.starts, self.reverses, self.rotations, self.translations = None, None, None, None
+        self.finished_number = 0
+
+    def get_indices(self, start: int, stop: int) -> tuple:
+        """
+        Get the structure index pairs stored in the location range.
+
+        :param start: start location.
+        :type start: int
+
+        :param stop: stop location (excluded).
+        :type stop: int
+
+        :return: indices of structure 1 and indices of structure 2 (index 1 <= index 2).
+        :rtype: numpy.ndarray, numpy.ndarray
+
+        .. note::
+            The indices are solved from the row start locations directly,
+            so no index array of all the pairs is created.
+        """
+        locations, number = arange(start, min([stop, len(self.scores)])), self.structure_number
+        # row i starts from location i * (2N - i + 1) / 2, solve the quadratic equation and correct the rounding.
+        indices_1 = floor((2 * number + 1 - sqrt((2 * number + 1) ** 2 - 8.0 * locations)) / 2).astype(int)
+        indices_1[indices_1 * (2 * number - indices_1 + 1) // 2 > locations] -= 1
+        indices_1[(indices_1 + 1) * (2 * number - indices_1) // 2 <= locations] += 1
+        indices_2 = locations - indices_1 * (2 * number - indices_1 + 1) // 2 + indices_1
+
+        return indices_1, indices_2
+
+    def get_distances(self, index: int = None) -> ndarray:
+        """
+        Get the distances (the scores of RMSD, or the maximum scores minus the scores of the other similarity types).
+
+        :param index: index of the structure, or all the structure pairs if None.
+        :type index: int or None
+
+        :return: distances between the structure and all the structures, or the condensed distance matrix
+            (the same format as scipy.spatial.distance.pdist, without the diagonal) of all the structure pairs.
+        :rtype: numpy.ndarray
+        """
+        if self.finished_number < len(self.scores):
+            raise ValueError("The score matrix has not been calculated!")
+
+        if index is None:
+            number = self.structure_number
+            diagonal_locations = arange(number) * (2 * number - arange(number) + 1) // 2
+            scores = delete(self.scores, diagonal_locations)
+        else:
+            indices = arange(self.structure_number)
+            scores = self.scores[where(indices < index, indices * (2 * self.structure_number - indices + 1) // 2
+                                       + index - indices,
+                                       index * (2 * self.structure_number - index + 1) // 2 + indices - index)]
+
+        if self.similar_type == "RMSD":
+            distances = scores.astype(float)
+        else:
+            distances = self.get_maximum() - scores
+
+        if index is not None:
+            distances[index] = 0.0
+
+        return distances
+
+    def get_maximum(self) -> float:
+        """
+        Get the maximum score (of two identical structures) of the similarity type.
+
+        :return: maximum score, which is None for RMSD.
+        :rtype: float or None
+        """
+        if self.similar_type == "RMSD":
+            return None
+
+        if self.model_type == "N-CA-C-O" and self.similar_type != "lDDT":
+            unit_number = 4
+        elif self.model_type == "3SPN" and self.similar_type == "TM":
+            unit_number = 3
+        else:
+            unit_number = 1
+
+        if self.similar_type in ["GDT-HA", "GDT-TS"]:
+            return 100.0 * unit_number
+        else:
+            return 1.0 * unit_number
+
+    def get_location(self, index_1: int, index_2: int) -> int:
+        """
+        Get the location of the structure pair in the stored arrays.
+
+        :param index_1: index of structure 1.
+        :type index_1: int
+
+        :param index_2: index of structure 2.
+        :type index_2: int
+
+        :return: location of the unordered structure pair.
+        :rtype: int
+        """
+        if index_1 > index_2:
+            index_1, index_2 = index_2, index_1
+
+        if index_2 >= self.structure_number or index_1 < 0:
+            raise ValueError("No such structure pair!")
+
+        return index_1 * self.structure_number - index_1 * (index_1 - 1) // 2 + index_2 - index_1
+
+    def get_score(self, index_1: int, index_2: int) -> float:
+        """
+        Get the score of the structure pair.
+
+        :param index_1: index of structure 1.
+        :type index_1: int
+
+        :param index_2: index of structure 2.
+        :type index_2: int
+
+        :return: score of the structure pair.
+        :rtype: float
+        """
+        location = self.get_location(index_1, index_2)
+        if location >= self.finished_number:
+            raise ValueError("The structure pair has not been calculated!")
+
+        return self.scores[location]
+
+    def get_flag(self, index_1: int, index_2: int, metrics: float) -> bool:
+        """
+        Judge whether the structure pair is similar.
+
+        :param index_1: index of structure 1.
+        :type index_1: int
+
+        :param index_2: index of structure 2.
+        :type index_2: int
+
+        :param metrics: score metrics to determine whether two structures are similarity.
+        :type metrics: float
+
+        :return: judgement.
+        :rtype: bool
+        """
+        if self.similar_type == "RMSD":
+            return self.get_score(index_1, index_2) <= metrics
+        else:
+            return self.get_score(index_1, index_2) >= metrics
+
+    def get_transform(self, index_1: int, index_2: int) -> tuple:
+        """
+        Get the transform moving the structure 1 onto the structure 2.
+
+        :param index_1: index of structure 1.
+        :type index_1: int
+
+        :param index_2: index of structure 2.
+        :type index_2: int
+
+        :return: rotation matrix and translation vector, the moved structure is dot(structure, rotation) + translation.
+        :rtype: numpy.ndarray, numpy.ndarray
+        """
+        if not self.keep_transforms:
+            raise ValueError("The transforms are not kept in the score matrix!")
+
+        location = self.get_location(index_1, index_2)
+        if location >= self.finished_number:
+            raise ValueError("The structure pair has not been calculated!")
+
+        # the stored transform moves the candidate (the structure with larger index unless reversed).
+        rotation, translation = self.rotations[location], self.translations[location]
+        if (index_1 >= index_2) != bool(self.reverses[location]):
+            return rotation, translation
+        else:
+            return transpose(rotation), -dot(translation, transpose(rotation))
+
+    def save(self, file_path: str):
+        """
+        Save the score matrix (including the unfinished one) to the npz file.
+
+        :param file_path: path to save file.
+        :type file_path: str
+        """
+        contents = {"parameters": array([self.structure_number, int(self.use_center), int(self.keep_transforms),
+                                         self.finished_number]),
+                    "types": array([self.similar_type, self.model_type]),
+                    "scores": self.scores}
+        if self.keep_transforms:
+            contents["starts"], contents["reverses"] = self.starts, self.reverses
+            contents["rotations"], contents["translations"] = self.rotations, self.translations
+
+        savez(file_path, **contents)
+
+    @staticmethod
+    def load(file_path: str):
+        """
+        Load the score matrix from the npz file.
+
+        :param file_path: path to load file.
+        :type file_path: str
+
+        :return: score matrix.
+        :rtype: molpub.handles.ScoreMatrix
+        """
+        with load(file_path) as contents:
+            structure_number, use_center, keep_transforms, finished_number = contents["parameters"].tolist()
+            similar_type, model_type = contents["types"].tolist()
+            matrix = ScoreMatrix(structure_number, similar_type, model_type, bool(use_center), bool(keep_transforms))
+            matrix.scores = contents["scores"]
+            if matrix.keep_transforms:
+                matrix.starts, matrix.reverses = contents["starts"], contents["reverses"]
+                matrix.rotations, matrix.translations = contents["rotations"], contents["translations"]
+            matrix.finished_number = finished_number
+
+        return matrix
+
+
+class Clusterer:
+
+    def __init__(self, score_method, use_center: bool = True, metrics: float = None, keep_transforms: bool = True):
+        """
+        Initialize the incremental clusterer, which assigns each new structure to the first similar leader
+        (the first structure of a cluster) or makes it the leader of a new cluster.
+
+        :param score_method: method to calculate the similarity score.
+        :type score_method: molpub.handles.Score
+
+        :param use_center: use center location.
+        :type use_center: bool
+
+        :param metrics: score metrics to determine whether two structures are similar.
+        :type metrics: float or None
+
+        :param keep_transforms: store the transform of each structure onto its leader, otherwise only the flags.
+        :type keep_transforms: bool
+
+        .. note::
+            Only the leaders are kept, so appending new structures only compares them with the leaders,
+            and the clusters are the same as the "cluster" function with the "leader" merge type.
+            For RMSD of the centered structures with the same size, the leader-to-leader distances are cached
+            to skip the comparisons by the triangle inequality.
+
+            >>> from numpy import random
+            >>> from molpub import Score, Clusterer
+            >>> structures = random.random(size=(10, 30, 3))
+            >>> clusterer = Clusterer(Score("RMSD", "CA"), metrics=0.5)
+            >>> flags = clusterer.extend(structures[:-1])  # the cluster of each structure.
+            >>> clusterer.save("./archive")  # the arrays in "archive.npz" and the index in "archive.json".
+            >>> clusterer = Clusterer.load("./archive")
+            >>> flag = clusterer.append(structures[-1])
+        """
+        self.score_method = score_method
+        self.use_center = use_center
+        self.metrics = get_metrics(score_method, metrics)
+        self.keep_transforms = keep_transforms
+        self.pruning = score_method.get_params()[0] == "RMSD" and use_center
+        self.leaders, self.leader_indices = [], []
+        # leader-to-leader distances, the capacity of which is doubled when it is full.
+        self.leader_distances = zeros(shape=(0, 0))
+        # cluster flag, transform onto the leader, start location and reverse flag of each structure.
+        self.flags, self.rotations, self.translations, self.starts, self.reverses = [], [], [], [], []
+
+    def append(self, structure: ndarray, first_result: Superposition = None) -> int:
+        """
+        Append one structure to the clusters.
+
+        :param structure: molecule structure.
+        :type structure: numpy.ndarray
+
+        :param first_result: calculated superposition of the structure onto the first leader, which is reused.
+        :type first_result: molpub.handles.Superposition or None
+
+        :return: cluster flag (leader order) of the structure.
+        :rtype: int
+        """
+        structure = asarray(structure, dtype=self.score_method.precision)
+        if len(self.leaders) > 0 and structure.shape != self.leaders[0].shape:
+            self.pruning = False  # the score is not a metric for the structures with different sizes.
+
+        similar_type, _ = self.score_method.get_params()
+        number = len(self.leaders)
+        distances, bounds = full(shape=(number,), fill_value=nan), zeros(shape=(number,))
+        for flag, leader in enumerate(self.leaders):
+            if self.pruning and bounds[flag] > self.metrics + 1e-6:  # keep a margin for the numerical error.
+                continue
+
+            if flag == 0 and first_result is not None:
+                result = first_result
+            else:
+                result = self.score_method(structure, leader, self.use_center)
+            distances[flag] = result.score
+            if self.pruning:
+                # d(structure, leader) >= |d(structure, known leader) - d(known leader, leader)|.
+                bounds = maximum(bounds, abs(result.score - self.leader_distances[flag, :number]))
+
+            if (result.score <= self.metrics) if similar_type == "RMSD" else (result.score >= self.metrics):
+                self.record(flag, result.rotation, result.translation, result.start, result.reverse)
+                return flag
+
+        # the structure becomes a new leader, cache its distances to the other leaders.
+        if self.pruning:
+            for flag, leader in enumerate(self.leaders):
+                if isnan(distances[flag]):
+                    distances[flag] = self.score_method(structure, leader, self.use_center).score
+            if number == len(self.leader_distances):
+                capacity = max([2 * number, 16])
+                leader_distances = zeros(shape=(capacity, capacity))
+                leader_distances[:number, :number] = self.leader_distances
+                self.leader_distances = leader_distances
+            self.leader_distances[number, :number], self.leader_distances[:number, number] = distances, distances
+
+        self.leaders.append(structure)
+        self.leader_indices.append(len(self.flags))
+        self.record(len(self.leaders) - 1, eye(3), zeros(shape=(3,)), 0, False)
+
+        return len(self.leaders) - 1
+
+    def extend(self, structures) -> list:
+        """
+        Append the structures to the clusters in turn.
+
+        :param structures: molecule structures.
+        :type structures: numpy.ndarray or list
+
+        :return: cluster flags (leader order) of the structures.
+        :rtype: list
+        """
+        return [self.append(structure) for structure in structures]
+
+    def record(self, flag: int, rotation: ndarray, translation: ndarray, start: int, reverse: bool):
+        """
+        Record the cluster flag and the transform (if the transforms are kept) of the appended structure.
+
+        :param flag: cluster flag (leader order) of the structure.
+        :type flag: int
+
+        :param rotation: rotation matrix of the structure pair (structure, leader).
+        :type rotation: numpy.ndarray
+
+        :param translation: translation vector of the structure pair (structure, leader).
+        :type translation: numpy.ndarray
+
+        :param start: start location (in atoms) of the structure pair.
+        :type start: int
+
+        :param reverse: the leader is moved instead of the structure.
+        :type reverse: bool
+        """
+        self.flags.append(flag)
+        if self.keep_transforms:
+            self.rotations.append(asarray(rotation))
+            self.translations.append(asarray(translation))
+            self.starts.append(int(start))
+            self.reverses.append(bool(reverse))
+
+    def get_clusters(self) -> list:
+        """
+        Get the structure indices of each cluster.
+
+        :return: structure index cluster flags.
+        :rtype: list
+        """
+        clusters = [[] for _ in range(len(self.leaders))]
+        for structure_index, flag in enumerate(self.flags):
+            clusters[flag].append(structure_index)
+
+        return clusters
+
+    def save(self, file_path: str):
+        """
+        Save the state to the npz file (arrays) and the json file (index) with the same path.
+
+        :param file_path: path to save files (without the extension).
+        :type file_path: str
+        """
+        lengths = [len(leader) for leader in self.leaders]
+        savez(file_path + ".npz",
+              leaders=concatenate(self.leaders) if len(self.leaders) > 0 else zeros(shape=(0, 3)),
+              lengths=array(lengths, dtype=int), leader_indices=array(self.leader_indices, dtype=int),
+              leader_distances=self.leader_distances[:len(self.leaders), :len(self.leaders)],
+              flags=array(self.flags, dtype=int),
+              rotations=array(self.rotations).reshape(-1, 3, 3), translations=array(self.translations).reshape(-1, 3),
+              starts=array(self.starts, dtype=int), reverses=array(self.reverses, dtype=bool))
+
+        index = {"similar type": self.score_method.similar_type, "model type": self.score_method.model_type,
+                 "precision": self.score_method.precision, "backend": self.score_method.backend,
+                 "coarse step": self.score_method.coarse_step, "refine number": self.score_method.refine_number,
+                 "kmer length": self.score_method.kmer_length, "cache size": self.score_method.cache_size,
+                 "use center": self.use_center, "metrics": float(self.metrics), "pruning": self.pruning,
+                 "keep transforms": self.keep_transforms,
+                 "structure number": len(self.flags), "cluster number": len(self.leaders)}
+        with open(file_path + ".json", "w", encoding="utf-8") as file:
+            dump(index, file, indent=4)
+
+    @staticmethod
+    def load(file_path: str):
+        """
+        Load the state from the npz file (arrays) and the json file (index) with the same path.
+
+        :param file_path: path to load files (without the extension).
+        :type file_path: str
+
+        :return: incremental clusterer.
+        :rtype: molpub.handles.Clusterer
+        """
+        with open(file_path + ".json", "r", encoding="utf-8") as file:
+            index = load_json(file)
+
+        score_method = Score(index["similar type"], index["model type"], index["precision"], index["backend"],
+                             index["coarse step"], index["refine number"], index["kmer length"], index["cache size"])
+        clusterer = Clusterer(score_method, index["use center"], index["metrics"], index["keep transforms"])
+        clusterer.pruning = index["pruning"]
+
+        with load(file_path + ".npz") as contents:
+            if len(contents["flags"]) != index["structure number"] or len(contents["lengths"]) != index["cluster number"]:
+                raise ValueError("The saved arrays do not match the saved index!")
+            ends = cumsum(contents["lengths"])
+            clusterer.leaders = [contents["leaders"][end - length: end] for end, length in zip(ends, contents["lengths"])]
+            clusterer.leader_indices = contents["leader_indices"].tolist()
+            clusterer.leader_distances = contents["leader_distances"]
+            clusterer.flags = contents["flags"].tolist()
+            clusterer.rotations, clusterer.translations = list(contents["rotations"]), list(contents["translations"])
+            clusterer.starts, clusterer.reverses = contents["starts"].tolist(), contents["reverses"].tolist()
+
+        return clusterer
+
+
+def get_metrics(score_method, metrics: float = None) -> float:
+    """
+    Get the score metrics to determine whether two structures are similar.
+
+    :param score_method: method to calculate the similarity score.
+    :type score_method: molpub.handles.Score
+
+    :param metrics: declared score metrics, the default metrics of the score method are used if None.
+    :type metrics: float or None
+
+    :return: score metrics.
+    :rtype: float
+    """
+    distance_type, model_type = score_method.get_params()
+
+    if distance_type == "RMSD":
+        if metrics is None:
+            raise ValueError("The metrics for RMSD method should be declared!")
+
+    elif distance_type == "TM":
+        # Based on the extensive statistics of protein and RNA structure families2, 3, it was found that
+        # TM-score ≥ 0.5 or TM-score(RNA) ≥ 0.45 corresponds to a protein or RNA pair
+        # with similar global structural topology.
+
+        if model_type == "N-CA-C-O":  # protein consists of skeleton comprised of N, C-alpha, C, and O atoms.
+            if metrics is None:
+                metrics = 0.50 * 4
+
+        elif model_type == "CA":  # protein consists of skeleton comprised of C-alpha.
+            if metrics is None:
+                metrics = 0.50
+
+        elif model_type == "3SPN":  # 3SPN model (three sites per nucleotide).
+            if metrics is None:
+                metrics = 0.45 * 3
+
+        elif model_type == "C3'":  # single atom in nucleic acid structures (e.g. C3').
+            if metrics is None:
+                metrics = 0.45
+        else:
+            raise ValueError("No such model type!")
+
+    elif distance_type == "GDT-HA":
+        # AlphaFold was the top-ranked method, with a median GDT score of 92.4 across all targets.
+        # https://alphafold.ebi.ac.uk/faq
+
+        if model_type == "N-CA-C-O":
+            if metrics is None:
+                metrics = 92.4 * 4
+
+        elif model_type == "CA":
+            if metrics is None:
+                metrics = 92.4
+
+        else:
+            raise ValueError("No such model type!")
+
+    elif distance_type == "GDT-TS":
+        # AlphaFold was the top-ranked method, with a median GDT score of 92.4 across all targets.
+        # https://alphafold.ebi.ac.uk/faq
+
+        if model_type == "N-CA-C-O":
+            if metrics is None:
+                metrics = 92.4 * 4
+
+        elif model_type == "CA":
+            if metrics is None:
+                metrics = 92.4
+
+        else:
+            raise ValueError("No such model type!")
+
+    elif distance_type == "lDDT":
+        # AlphaFold regards the predicted lDDT above 70 as a generally good backbone prediction.
+        # https://alphafold.ebi.ac.uk/faq
+
+        if model_type in ["N-CA-C-O", "CA", "3SPN", "C3'"]:
+            if metrics is None:
+                metrics = 0.70
+
+        else:
+            raise ValueError("No such model type!")
+
+    else:
+        raise ValueError("No such distance type!")
+
+    return metrics
+
+
+def similar(structure_1, structure_2, score_method, use_center: bool = True, metrics: float = None,
+            early_stop: bool = False) -> tuple:
+    """
+    Judge whether two structures are similar.
+
+    :param structure_1: molecule structure 1.
+    :type structure_1: numpy.ndarray
+
+    :param structure_2: molecule structure 2.
+    :type structure_2: numpy.ndarray
+
+    :param score_method: method to calculate the similarity score.
+    :type score_method: molpub.handles.Score
+
+    :param use_center: use center location.
+    :type use_center: bool
+
+    :param metrics: score metrics to determine whether any two structures are similarity.
+    :type metrics: float or None
+
+    :param early_stop: stop scoring as soon as one superposition satisfies the metrics.
+    :type early_stop: bool
+
+    :return: flag, rotated candidate structure, original reference structure, start location, structure is reversed.
+    :rtype: tuple[bool, numpy.ndarray, numpy.ndarray, int, bool]
+
+    .. note::
+        With early stop, the returned structures come from the first superposition satisfying the metrics
+        instead of the best one, which is enough when only the flag is required.
+    """
+    distance_type, _ = score_method.get_params()
+    metrics = get_metrics(score_method, metrics)
+
+    if early_stop:
+        result = score_method(structure_1, structure_2, use_center, threshold=metrics)
+    else:
+        result = score_method(structure_1, structure_2, use_center)
+    score_value, candidate, reference, start_location, reverse = result
+
+    if distance_type == "RMSD":
+        return score_value <= metrics, candidate, reference, start_location, reverse
+    else:
+        return score_value >= metrics, candidate, reference, start_location, reverse
+
+
+def get_shapes(structures, indices: ndarray = None) -> set:
+    """
+    Get the shapes of the structures without loading a structure stack.
+
+    :param structures: structures.
+    :type structures: numpy.ndarray or list
+
+    :param indices: indices of the structures to check, all the structures are checked if None.
+    :type indices: numpy.ndarray or None
+
+    :return: shapes of the structures.
+    :rtype: set
+    """
+    if isinstance(structures, ndarray) and len(structures.shape) == 3:
+        return {structures.shape[1:]}  # one (memory-mapped) stack of the structures with the same size.
+
+    if indices is None:
+        indices = range(len(structures))
+
+    return set([asarray(structures[index]).shape for index in indices])
+
+
+def get_stack_location(structures) -> tuple:
+    """
+    Get the file path and the byte offset of the memory-mapped structure stack.
+
+    :param structures: structures.
+    :type structures: numpy.ndarray or list
+
+    :return: file path and byte offset of the stack, or None if the structures are not one contiguous stack
+        mapped from a file.
+    :rtype: tuple or None
+    """
+    if not isinstance(structures, memmap) or structures.filename is None or len(structures.shape) != 3 \
+            or not structures.flags.c_contiguous:
+        return None
+
+    mapped_stack = structures
+    while isinstance(mapped_stack.base, memmap):  # the sliced views keep the offset of the whole mapping.
+        mapped_stack = mapped_stack.base
+
+    return mapped_stack.filename, mapped_stack.offset + structures.ctypes.data - mapped_stack.ctypes.data
+
+
+def get_descriptors(structures, quantiles: tuple = (0.1, 0.25, 0.5, 0.75, 0.9)) -> ndarray:
+    """
+    Calculate the rotation-invariant descriptors of the structures.
+
+    :param structures: structures.
+    :type structures: numpy.ndarray or list
+
+    :param quantiles: quantiles of the intra-structure distances in the descriptors.
+    :type quantiles: tuple
+
+    :return: descriptors, which are three principal radii (the square roots of the inertia tensor eigenvalues
+        per atom, in descending order) and the intra-structure distance quantiles of each structure.
+    :rtype: numpy.ndarray
+    """
+    descriptors = zeros(shape=(len(structures), 3 + len(quantiles)))
+    for index, structure in enumerate(structures):
+        structure = asarray(structure, dtype=float)
+        structure = structure - mean(structure, axis=0)
+        descriptors[index, :3] = linalg.svd(structure, compute_uv=False) / sqrt(len(structure))
+        descriptors[index, 3:] = quantile(pdist(structure), quantiles)
+
+    return descriptors
+
+
+def prefilter(structures, score_method, use_center: bool = True, metrics: float = None,
+              radius: float = None) -> tuple:
+    """
+    Rule out the structure pairs by the rotation-invariant descriptors before any superposition.
+
+    :param structures: structures.
+    :type structures: numpy.ndarray or list
+
+    :param score_method: method to calculate the similarity score.
+    :type score_method: molpub.handles.Score
+
+    :param use_center: use center location.
+    :type use_center: bool
+
+    :param metrics: score metrics to determine whether two structures are similar (for the provable bound).
+    :type metrics: float or None
+
+    :param radius: maximum descriptor distance of the candidate pairs, which uses the provable bound if None.
+    :type radius: float or None
+
+    :return: candidate pairs (index 1 < index 2) and pruning statistics.
+    :rtype: numpy.ndarray, dict
+
+    .. note::
+        For RMSD of the centered structures with the same size, the score of two structures is never less than
+        the distance of their principal radii divided by the square root of the atom number
+        (von Neumann trace inequality), so the pairs ruled out provably cannot meet the metrics.
+        For the other cases, the radius of all the descriptors (in angstroms) should be declared,
+        which rules out the pairs very likely (but not provably) dissimilar.
+    """
+    distance_type, _ = score_method.get_params()
+    shapes = get_shapes(structures)
+    descriptors = get_descriptors(structures)
+
+    if radius is None:
+        if distance_type == "RMSD" and use_center and len(shapes) == 1:
+            metrics = get_metrics(score_method, metrics)
+            descriptors, radius = descriptors[:, :3], metrics * sqrt(len(structures[0]))
+            radius += 1e-6  # keep a margin for the numerical error of the scores.
+            provable = True
+        else:
+            raise ValueError("The radius should be declared without the provable bound!")
+    else:
+        provable = False
+
+    pairs = cKDTree(descriptors).query_pairs(radius, output_type="ndarray")
+    pairs = pairs[argsort(pairs[:, 0] * len(structures) + pairs[:, 1])]
+
+    pair_number = len(structures) * (len(structures) - 1) // 2
+    statistics = {"pair number": pair_number, "candidate number": len(pairs),
+                  "pruned ratio": float(1.0 - len(pairs) / max([pair_number, 1])), "provable": provable}
+
+    return pairs, statistics
+
+
+def pairwise(structures, score_method, use_center: bool = True, chunk_size: int = 1024, file_path: str = None,
+             keep_transforms: bool = True, workers: int = 1, candidate_pairs: ndarray = None,
+             memory_size: float = 256.0, save_interval: float = 60.0) -> ScoreMatrix:
+    """
+    Calculate the score and the transform of each unordered structure pair once.
+
+    :param structures: structures.
+    :type structures: numpy.ndarray or list
+
+    :param score_method: method to calculate the similarity score.
+    :type score_method: molpub.handles.Score
+
+    :param use_center: use center location.
+    :type use_center: bool
+
+    :param chunk_size: number of structure pairs calculated together.
+    :type chunk_size: int
+
+    :param file_path: path (npz file) to save the score matrix during the calculation and to resume it from.
+    :type file_path: str or None
+
+    :param keep_transforms: store the rotation matrix and translation vector of each pair.
+    :type keep_transforms: bool
+
+    :param workers: number of worker processes, each of which calculates one chunk at a time
+        (the structures in the memory are shared by the workers with Python 3.8 or newer,
+        or written into a temporary stack file mapped by the workers otherwise).
+    :type workers: int
+
+    :param candidate_pairs: structure index pairs to calculate (see the "prefilter" function), or all pairs if None.
+    :type candidate_pairs: numpy.ndarray or None
+
+    :param memory_size: maximum memory (in MB) of the intermediate structure arrays of one chunk.
+    :type memory_size: float
+
+    :param save_interval: minimum interval (in seconds) between two saves of the unfinished score matrix,
+        the finished score matrix is always saved.
+    :type save_interval: float
+
+    :return: score matrix.
+    :rtype: molpub.handles.ScoreMatrix
+
+    .. note::
+        If the structures of one chunk share the same shape and the structure centers are used as the rotation
+        centers, the superpositions of the chunk are calculated together (except lDDT).
+        The chunks are the same for any number of workers, so the score matrix does not depend on it.
+        The structure pairs out of the candidate pairs are stored with the worst score
+        (infinity for RMSD and zero for the others) and the identity transform.
+        The chunk size is reduced to meet the memory size, and the pair indices are created chunk by chunk,
+        so the memory beyond the score matrix itself is bounded.
+        For the memory-mapped structure stack (see the "save_structures_to_stack" function), only the structures
+        of one chunk are read at a time, and the worker processes map the same file instead of the shared memory.
+    """
+    if workers < 1:
+        raise ValueError("The number of workers should be positive!")
+
+    similar_type, model_type = score_method.get_params()
+    if file_path is not None and path.exists(file_path):
+        matrix = ScoreMatrix.load(file_path)
+        if matrix.structure_number != len(structures) or matrix.similar_type != similar_type \
+                or matrix.model_type != model_type or matrix.use_center != use_center \
+                or matrix.keep_transforms != keep_transforms:
+            raise ValueError("The saved score matrix does not match the calculation!")
+    else:
+        matrix = ScoreMatrix(len(structures), similar_type, model_type, use_center, keep_transforms)
+
+    # about six structure arrays of each pair are kept by the calculation of one chunk.
+    pair_size = max([shape[0] for shape in get_shapes(structures)]) * 3 * finfo(score_method.precision).bits // 8 * 6
+    chunk_size = int(max([min([chunk_size, memory_size * 2 ** 20 // pair_size]), 1]))
+    locations, saved_time = range(matrix.finished_number, len(matrix.scores), chunk_size), time()
+    if candidate_pairs is not None:
+        pairs = sort(asarray(candidate_pairs, dtype=int).reshape(-1, 2), axis=1)
+        selections = zeros(shape=(len(matrix.scores),), dtype=bool)
+        # the structures are always compared with themselves.
+        selections[arange(len(structures)) * (2 * len(structures) - arange(len(structures)) + 1) // 2] = True
+        selections[pairs[:, 0] * (2 * len(structures) - pairs[:, 0] + 1) // 2 + pairs[:, 1] - pairs[:, 0]] = True
+    else:
+        selections = None
+
+    if workers > 1:
+        stack_location, memory, folder = get_stack_location(structures), None, None
+        if stack_location is not None:
+            # the workers map the same file, so the structure stack is never loaded into the memory.
+            initializer = attach_stack
+            initargs = (stack_location[0], stack_location[1], structures.shape, structures.dtype.str, score_method,
+                        use_center, keep_transforms)
+        else:
+            lengths = array([len(structure) for structure in structures])
+            stack = concatenate([asarray(structure, dtype=score_method.precision) for structure in structures])
+            try:
+                from multiprocessing.shared_memory import SharedMemory  # Python 3.8 or newer.
+            except ImportError:
+                SharedMemory = None
+            if SharedMemory is not None:
+                # the structures are placed in the shared memory once, only the pair indices are sent to the workers.
+                memory = SharedMemory(create=True, size=stack.nbytes)
+                ndarray(shape=stack.shape, dtype=stack.dtype, buffer=memory.buf)[:] = stack
+                initializer = attach_structures
+                initargs = (memory.name, lengths, score_method, use_center, keep_transforms)
+            else:
+                # the structures are written into a temporary stack file once, which the workers map instead.
+                folder = TemporaryDirectory()
+                stack_path = path.join(folder.name, "structures.npy")
+                mapped_stack = open_memmap(stack_path, mode="w+", dtype=stack.dtype, shape=stack.shape)
+                mapped_stack[:] = stack
+                mapped_stack.flush()
+                initializer = attach_stack
+                initargs = (stack_path, mapped_stack.offset, stack.shape, stack.dtype.str, score_method, use_center,
+                            keep_transforms, lengths)
+                del mapped_stack
+            del stack
+        try:
+            # the workers are spawned instead of forked, which is safe with the threads of the compiled kernels.
+            with ProcessPoolExecutor(max_workers=workers, mp_context=get_context("spawn"),
+                                     initializer=initializer, initargs=initargs) as executor:
+                # only a few chunks are submitted ahead, and the results are recorded in order.
+                submissions = []
+                for location in locations:
+                    indices_1, indices_2 = matrix.get_indices(location, location + chunk_size)
+                    if selections is not None:
+                        chunk_selections = selections[location: location + chunk_size]
+                    else:
+                        chunk_selections = None
+                    submissions.append((location, executor.submit(calculate_shared_pairs, indices_2, indices_1,
+                                                                  chunk_selections)))
+                    if len(submissions) >= 2 * workers:
+                        location, future = submissions.pop(0)
+                        saved_time = record_pairs(matrix, location, future.result(), file_path, save_interval,
+                                                  saved_time)
+                for location, future in submissions:
+                    saved_time = record_pairs(matrix, location, future.result(), file_path, save_interval,
+                                              saved_time)
+        finally:
+            if memory is not None:
+                memory.close()
+                memory.unlink()
+            if folder is not None:
+                folder.cleanup()
+    else:
+        for location in locations:
+            indices_1, indices_2 = matrix.get_indices(location, location + chunk_size)
+            if selections is not None:
+                chunk_selections = selections[location: location + chunk_size]
+            else:
+                chunk_selections = None
+            result = calculate_pairs(structures, score_method, use_center, indices_2, indices_1, keep_transforms,
+                                     chunk_selections)
+            saved_time = record_pairs(matrix, location, result, file_path, save_interval, saved_time)
+
+    return matrix
+
+
+def calculate_pairs(structures, score_method, use_center: bool, candidate_indices: ndarray,
+                    reference_indices: ndarray, keep_transforms: bool = True, selections: ndarray = None) -> tuple:
+    """
+    Calculate the scores and the transforms of one chunk of structure pairs.
+
+    :param structures: structures.
+    :type structures: numpy.ndarray or list
+
+    :param score_method: method to calculate the similarity score.
+    :type score_method: molpub.handles.Score
+
+    :param use_center: use center location.
+    :type use_center: bool
+
+    :param candidate_indices: indices of the candidate structures.
+    :type candidate_indices: numpy.ndarray
+
+    :param reference_indices: indices of the reference structures.
+    :type reference_indices: numpy.ndarray
+
+    :param keep_transforms: calculate the rotation matrix and translation vector of each pair.
+    :type keep_transforms: bool
+
+    :param selections: flags of the structure pairs to calculate, all the structure pairs are calculated if None.
+    :type selections: numpy.ndarray or None
+
+    :return: scores, starts, reverses, rotations and translations of the structure pairs.
+    :rtype: tuple
+
+    .. note::
+        The unselected structure pairs get the worst score (infinity for RMSD and zero for the others)
+        and the identity transform.
+    """
+    similar_type, _ = score_method.get_params()
+    number = len(candidate_indices)
+    if similar_type == "RMSD":
+        scores = full(shape=(number,), fill_value=inf)
+    else:
+        scores = zeros(shape=(number,))
+    starts, reverses = zeros(shape=(number,), dtype=int), zeros(shape=(number,), dtype=bool)
+    if keep_transforms:
+        rotations, translations = tile(eye(3), (number, 1, 1)), zeros(shape=(number, 3))
+    else:
+        rotations, translations = None, None
+
+    if selections is None:
+        locations = arange(number)
+    else:
+        locations = flatnonzero(selections)
+    if len(locations) == 0:
+        return scores, starts, reverses, rotations, translations
+
+    candidate_indices, reference_indices = candidate_indices[locations], reference_indices[locations]
+    shapes = get_shapes(structures, concatenate((candidate_indices, reference_indices)))
+    if use_center and len(shapes) == 1 and similar_type in ["RMSD", "TM", "GDT-HA", "GDT-TS"]:
+        if isinstance(structures, ndarray):  # only the rows of the chunk are read from the (memory-mapped) stack.
+            candidates = asarray(structures[candidate_indices], dtype=score_method.precision)
+            references = asarray(structures[reference_indices], dtype=score_method.precision)
+        else:
+            candidates = asarray([structures[index] for index in candidate_indices], dtype=score_method.precision)
+            references = asarray([structures[index] for index in reference_indices], dtype=score_method.precision)
+        unit_number = score_method.get_unit_number(candidates[0], references[0])
+        factor = score_method.get_factor(len(candidates[0]))
+        candidate_centers, reference_centers = mean(candidates, axis=1), mean(references, axis=1)
+        candidates, references = candidates - candidate_centers[:, None], references - reference_centers[:, None]
+        chunk_rotations = score_method.get_rotations(einsum("kli,klj->kij", candidates, references))
+        deltas = matmul(candidates, chunk_rotations) - references
+        scores[locations] = score_method.measure(einsum("klj,klj->kl", deltas, deltas), factor, unit_number)
+        if keep_transforms:
+            rotations[locations] = chunk_rotations
+            translations[locations] = reference_centers - einsum("ki,kij->kj", candidate_centers, chunk_rotations)
+    else:
+        for location, candidate_index, reference_index in zip(locations, candidate_indices, reference_indices):
+            result = score_method(structures[candidate_index], structures[reference_index], use_center)
+            scores[location], starts[location], reverses[location] = result.score, result.start, result.reverse
+            if keep_transforms:
+                rotations[location], translations[location] = result.rotation, result.translation
+
+    return scores, starts, reverses, rotations, translations
+
+
+def record_pairs(score_matrix: ScoreMatrix, location: int, result: tuple, file_path: str = None,
+                 save_interval: float = 0.0, saved_time: float = 0.0) -> float:
+    """
+    Record one calculated chunk of structure pairs into the score matrix.
+
+    :param score_matrix: score matrix.
+    :type score_matrix: molpub.handles.ScoreMatrix
+
+    :param location: location of the first structure pair of the chunk.
+    :type location: int
+
+    :param result: scores, starts, reverses, rotations and translations of the structure pairs.
+    :type result: tuple
+
+    :param file_path: path (npz file) to save the score matrix.
+    :type file_path: str or None
+
+    :param save_interval: minimum interval (in seconds) between two saves of the unfinished score matrix.
+    :type save_interval: float
+
+    :param saved_time: time of the last save.
+    :type saved_time: float
+
+    :return: time of the last save.
+    :rtype: float
+    """
+    scores, starts, reverses, rotations, translations = result
+    chunk = slice(location, location + len(scores))
+    score_matrix.scores[chunk] = scores
+    if score_matrix.keep_transforms:
+        score_matrix.starts[chunk], score_matrix.reverses[chunk] = starts, reverses
+        score_matrix.rotations[chunk], score_matrix.translations[chunk] = rotations, translations
+
+    score_matrix.finished_number = location + len(scores)
+    if file_path is not None:
+        # the whole matrix is written in each save, so the unfinished one is only saved once in a while.
+        if score_matrix.finished_number == len(score_matrix.scores) or time() - saved_time >= save_interval:
+            score_matrix.save(file_path)
+            saved_time = time()
+
+    return saved_time
+
+
+# contents of the worker process: shared memory, structure views and calculation parameters.
+worker_contents = {}
+
+
+def attach_structures(memory_name: str, lengths: ndarray, score_method, use_center: bool, keep_transforms: bool):
+    """
+    Attach the worker process to the structure stack in the shared memory.
+
+    :param memory_name: name of the shared memory.
+    :type memory_name: str
+
+    :param lengths: atom numbers of the structures.
+    :type lengths: numpy.ndarray
+
+    :param score_method: method to calculate the similarity score.
+    :type score_method: molpub.handles.Score
+
+    :param use_center: use center location.
+    :type use_center: bool
+
+    :param keep_transforms: calculate the rotation matrix and translation vector of each pair.
+    :type keep_transforms: bool
+    """
+    from multiprocessing.shared_memory import SharedMemory  # Python 3.8 or newer.
+    memory = SharedMemory(name=memory_name)
+    stack = ndarray(shape=(int(sum(lengths)), 3), dtype=score_method.precision, buffer=memory.buf)
+    ends = cumsum(lengths)
+    worker_contents["memory"] = memory
+    worker_contents["structures"] = [stack[end - length: end] for end, length in zip(ends, lengths)]
+    worker_contents["parameters"] = (score_method, use_center, keep_transforms)
+
+
+def attach_stack(file_path: str, offset: int, shape: tuple, dtype: str, score_method, use_center: bool,
+                 keep_transforms: bool, lengths: ndarray = None):
+    """
+    Attach the worker process to the memory-mapped structure stack.
+
+    :param file_path: path of the file containing the structure stack.
+    :type file_path: str
 
-        return score_value <= metrics, candidate, reference, start_location, reverse
+    :param offset: byte offset of the structure stack in the file.
+    :type offset: int
 
-    elif distance_type == "TM":
-        # Based on the extensive statistics of protein and RNA structure families2, 3, it was found that
-        # TM-score ≥ 0.5 or TM-score(RNA) ≥ 0.45 corresponds to a protein or RNA pair
-        # with similar global structural topology.
+    :param shape: shape of the structure stack, format of which is (structure number, atom number, 3),
+        or (total atom number, 3) with the lengths.
+    :type shape: tuple
 
-        if model_type == "N-CA-C-O":  # protein consists of skeleton comprised of N, C-alpha, C, and O atoms.
-            if metrics is None:
-                metrics = 0.50 * 4
+    :param dtype: data type of the structure stack.
+    :type dtype: str
 
-        elif model_type == "CA":  # protein consists of skeleton comprised of C-alpha.
-            if metrics is None:
-                metrics = 0.50
+    :param score_method: method to calculate the similarity score.
+    :type score_method: molpub.handles.Score
 
-        elif model_type == "3SPN":  # 3SPN model (three sites per nucleotide).
-            if metrics is None:
-                metrics = 0.45 * 3
+    :param use_center: use center location.
+    :type use_center: bool
 
-        elif model_type == "C3'":  # single atom in nucleic acid structures (e.g. C3').
-            if metrics is None:
-                metrics = 0.45
-        else:
-            raise ValueError("No such model type!")
+    :param keep_transforms: calculate the rotation matrix and translation vector of each pair.
+    :type keep_transforms: bool
 
-        return score_value >= metrics, candidate, reference, start_location, reverse
+    :param lengths: atom numbers of the concatenated structures, or None if the stack is three-dimensional.
+    :type lengths: numpy.ndarray or None
+    """
+    stack = memmap(file_path, dtype=dtype, mode="r", offset=offset, shape=shape)
+    if lengths is not None:
+        ends = cumsum(lengths)
+        worker_contents["structures"] = [stack[end - length: end] for end, length in zip(ends, lengths)]
+    else:
+        worker_contents["structures"] = stack
+    worker_contents["parameters"] = (score_method, use_center, keep_transforms)
 
-    elif distance_type == "GDT-HA":
-        # AlphaFold was the top-ranked method, with a median GDT score of 92.4 across all targets.
-        # https://alphafold.ebi.ac.uk/faq
 
-        if model_type == "N-CA-C-O":
-            if metrics is None:
-                metrics = 92.4 * 4
+def calculate_shared_pairs(candidate_indices: ndarray, reference_indices: ndarray, selections: ndarray) -> tuple:
+    """
+    Calculate one chunk of structure pairs from the structure stack in the shared memory or the mapped file.
 
-        elif model_type == "CA":
-            if metrics is None:
-                metrics = 92.4
+    :param candidate_indices: indices of the candidate structures.
+    :type candidate_indices: numpy.ndarray
 
-        else:
-            raise ValueError("No such model type!")
+    :param reference_indices: indices of the reference structures.
+    :type reference_indices: numpy.ndarray
 
-        return score_value >= metrics, candidate, reference, start_location, reverse
+    :param selections: flags of the structure pairs to calculate, all the structure pairs are calculated if None.
+    :type selections: numpy.ndarray or None
 
-    elif distance_type == "GDT-TS":
-        # AlphaFold was the top-ranked method, with a median GDT score of 92.4 across all targets.
-        # https://alphafold.ebi.ac.uk/faq
+    :return: scores, starts, reverses, rotations and translations of the structure pairs.
+    :rtype: tuple
+    """
+    score_method, use_center, keep_transforms = worker_contents["parameters"]
+    return calculate_pairs(worker_contents["structures"], score_method, use_center, candidate_indices,
+                           reference_indices, keep_transforms, selections)
 
-        if model_type == "N-CA-C-O":
-            if metrics is None:
-                metrics = 92.4 * 4
 
-        elif model_type == "CA":
-            if metrics is None:
-                metrics = 92.4
+def medoids(score_matrix: ScoreMatrix, cluster_number: int, iteration_number: int = 100) -> tuple:
+    """
+    Partition the structures around the medoids by the distances of the score matrix.
 
-        else:
-            raise ValueError("No such model type!")
+    :param score_matrix: calculated score matrix of the structures.
+    :type score_matrix: molpub.handles.ScoreMatrix
 
-        return score_value >= metrics, candidate, reference, start_location, reverse
+    :param cluster_number: number of the clusters (medoids).
+    :type cluster_number: int
 
-    else:
-        raise ValueError("No such distance type!")
+    :param iteration_number: maximum number of the swap passes.
+    :type iteration_number: int
 
+    :return: medoid indices and the cluster (medoid location) of each structure.
+    :rtype: list, numpy.ndarray
 
-def cluster(structures, score_method, use_center: bool = True, metrics: float = None, merge_type: str = "all") -> list:
+    .. note::
+        The first medoid has the minimum total distance and the others are the farthest structures in turn.
+        Then each non-medoid structure is swapped eagerly with the medoid which reduces the total deviation most
+        (FasterPAM, Erich Schubert and Peter J. Rousseeuw (2021) Information Systems),
+        in which the change of all the medoids is evaluated together from the nearest and the second nearest
+        distances of each structure. Only the distance rows of the medoids are kept.
+    """
+    number = score_matrix.structure_number
+    if cluster_number < 1 or cluster_number > number:
+        raise ValueError("The cluster number should be between 1 and the structure number!")
+
+    totals = array([sum(score_matrix.get_distances(index)) for index in range(number)])
+    medoid_indices = [int(argmin(totals))]
+    rows = [score_matrix.get_distances(medoid_indices[0])]
+    nearest_distances = rows[0].copy()
+    while len(medoid_indices) < cluster_number:
+        # the chosen medoids are excluded, which could still be the farthest among identical structures.
+        nearest_distances[medoid_indices] = -inf
+        medoid_indices.append(int(argmax(nearest_distances)))
+        rows.append(score_matrix.get_distances(medoid_indices[-1]))
+        nearest_distances = minimum(nearest_distances, rows[-1])
+    rows, locations, updated = array(rows), arange(number), True
+
+    for _ in range(iteration_number):
+        swapped = False
+        for index in range(number):
+            if index in medoid_indices:
+                continue
+
+            if updated:  # nearest and second nearest medoids of each structure.
+                orders = argsort(rows, axis=0, kind="stable")
+                nearest, nearest_distances = orders[0], rows[orders[0], locations]
+                if cluster_number > 1:
+                    second_distances = rows[orders[1], locations]
+                else:
+                    second_distances = full(shape=(number,), fill_value=inf)
+                updated = False
+
+            distances = score_matrix.get_distances(index)
+            closer = distances < nearest_distances
+            # the structures closer to the new medoid move to it whichever medoid is removed,
+            # the other structures move to the nearest of the new medoid and the second nearest one
+            # only if their nearest medoid is removed.
+            changes = sum(distances[closer] - nearest_distances[closer])
+            changes += bincount(nearest[~closer], minlength=cluster_number,
+                                weights=minimum(distances, second_distances)[~closer] - nearest_distances[~closer])
+            location = int(argmin(changes))
+            if changes[location] < -1e-12:
+                medoid_indices[location], rows[location] = index, distances
+                swapped, updated = True, True
+
+        if not swapped:
+            break
+
+    # each medoid belongs to its own cluster even if it is as close to another medoid.
+    labels = argmin(rows, axis=0)
+    labels[medoid_indices] = arange(cluster_number)
+
+    return medoid_indices, labels
+
+
+def cluster(structures, score_method, use_center: bool = True, metrics: float = None, merge_type: str = "all",
+            score_matrix: ScoreMatrix = None, workers: int = 1, candidate_pairs: ndarray = None,
+            cluster_number: int = None, return_transforms: bool = False):
     """
     Cluster the molecule structures.
 
-    :param structures: structures (with the same size).
-    :type structures: numpy.ndarray
+    :param structures: structures (with the same size), which could be a generator (e.g. "load_models_from_file"),
+        only the "leader" merge type consumes the generator in constant memory, the others collect it into a list.
+    :type structures: numpy.ndarray, list or Iterator
 
     :param score_method: method to calculate the similarity score.
     :type score_method: molpub.handles.Score
@@ -532,12 +2707,119 @@ def cluster(structures, score_method, use_center: bool = True, metrics: float =
     :param metrics: score metrics to determine whether any two structures are similarity.
     :type metrics: float or None
 
-    :param merge_type: the type to determine one structure can merge into a structure group.
+    :param merge_type: the type to determine one structure can merge into a structure group
+        ("all", "any", "leader", "average", "complete" or "medoids").
     :type merge_type: str
 
-    :return: structure index cluster flags.
-    :rtype: list
+    :param score_matrix: precomputed score matrix of the structures (see the "pairwise" function).
+    :type score_matrix: molpub.handles.ScoreMatrix or None
+
+    :param workers: number of worker processes to calculate the score matrix if it is not provided
+        (not supported by the "leader" merge type).
+    :type workers: int
+
+    :param candidate_pairs: structure index pairs possible to be similar (see the "prefilter" function).
+    :type candidate_pairs: numpy.ndarray or None
+
+    :param cluster_number: number of the clusters for the "medoids" merge type.
+    :type cluster_number: int or None
+
+    :param return_transforms: also return the superpositions of the structures onto the first structure,
+        which are found during clustering.
+    :type return_transforms: bool
+
+    :return: structure index cluster flags (and the superpositions keyed by structure index if return_transforms).
+    :rtype: list or (list, dict)
+
+    .. note::
+        The structures are compared in the precision of the score method.
+        With the score matrix, the flags are judged from the stored scores without any superposition.
+        With more than one worker, all the structure pairs are scored in parallel before clustering,
+        which the "leader" merge type does not support since it only compares the structures with the leaders.
+        With the candidate pairs, the other structure pairs are regarded as dissimilar without any superposition.
+
+        With the "leader" merge type, one structure is only compared with the leaders (first structures) of the
+        clusters and joins the first similar one, otherwise it becomes the leader of a new cluster.
+        For RMSD of the centered structures with the same size, which is a metric, the comparisons are skipped
+        if the triangle inequality bound from the cached leader-to-leader distances already exceeds the metrics.
+
+        The "average" and "complete" merge types cut the average or complete linkage tree (by SciPy) of the distances
+        (see the "get_distances" method of the score matrix) at the metrics, and the "medoids" merge type partitions
+        the structures around the medoids of the given cluster number (see the "medoids" function).
+        Their results do not depend on the order of the structures and are calculated from the score matrix,
+        which is calculated (without the transforms) if it is not provided.
+
+        Each structure is compared with the first structure before the others in the "all", "any" and "leader"
+        merge types, so the superposition onto the first structure is calculated fully (without early stop)
+        and kept if return_transforms. No superposition is kept if the flags come from the score matrix.
+
+        The generator of the structures is consumed once. With the "leader" merge type (and without the score
+        matrix, the candidate pairs or the transforms), the structures are clustered one by one
+        (see the "Clusterer" class) and only the leaders are kept, so the memory does not grow with the number
+        of structures. Otherwise, the structures are collected before clustering.
     """
+    if merge_type == "leader" and workers > 1:
+        raise ValueError("The leader merge type does not support multiple workers!")
+
+    if not hasattr(structures, "__len__"):  # the structures are streamed by a generator.
+        if merge_type == "leader" and score_matrix is None and candidate_pairs is None \
+                and not return_transforms:
+            clusterer = Clusterer(score_method, use_center, metrics, keep_transforms=False)
+            for structure in structures:
+                clusterer.append(structure)
+            return clusterer.get_clusters()
+
+        structures = list(structures)
+
+    distance_type, transforms = score_method.get_params()[0], {}
+    if return_transforms or merge_type in ["average", "complete"]:
+        metrics = get_metrics(score_method, metrics)
+
+    if score_matrix is None and (merge_type in ["average", "complete", "medoids"]
+                                 or (workers > 1 and merge_type in ["all", "any"])):
+        score_matrix = pairwise(structures, score_method, use_center, keep_transforms=False, workers=workers,
+                                candidate_pairs=candidate_pairs)
+
+    if merge_type in ["average", "complete", "medoids"]:
+        if len(structures) == 1:
+            return ([[0]], transforms) if return_transforms else [[0]]
+
+        if merge_type == "medoids":
+            if cluster_number is None:
+                raise ValueError("The cluster number should be declared for the medoids merge type!")
+            _, flags = medoids(score_matrix, cluster_number)
+        else:
+            distances = score_matrix.get_distances()
+            if score_matrix.similar_type == "RMSD":
+                threshold = metrics
+            else:
+                threshold = score_matrix.get_maximum() - metrics
+            # the structure pairs ruled out by the prefilter are placed beyond the threshold.
+            distances[~isfinite(distances)] = 2.0 * max([max(distances[isfinite(distances)], initial=0.0), threshold])
+            flags = fcluster(linkage(distances, method=merge_type), threshold, criterion="distance")
+
+        cluster_flags = {}
+        for structure_index, flag in enumerate(flags):
+            if flag not in cluster_flags:
+                cluster_flags[flag] = []
+            cluster_flags[flag].append(structure_index)
+
+        return (list(cluster_flags.values()), transforms) if return_transforms else list(cluster_flags.values())
+
+    if candidate_pairs is not None:
+        candidate_pairs = set([(int(index_1), int(index_2)) for index_1, index_2 in sort(candidate_pairs, axis=1)])
+
+    if score_matrix is not None:
+        if (score_matrix.similar_type, score_matrix.model_type) != score_method.get_params():
+            raise ValueError("The score matrix does not match the score method!")
+        metrics = get_metrics(score_method, metrics)
+
+    if merge_type == "leader":
+        metrics = get_metrics(score_method, metrics)
+        shapes = get_shapes(structures)
+        pruning = distance_type == "RMSD" and use_center and len(shapes) == 1
+        leader_distances = {}  # cached distances between the leaders.
+
     cluster_flags = {}
     for structure_index, candidate in enumerate(structures):
         selected_indices = []
@@ -545,7 +2827,19 @@ def cluster(structures, score_method, use_center: bool = True, metrics: float =
             for cluster_index, reference_indices in cluster_flags.items():
                 count = 0
                 for reference_index in reference_indices:
-                    if similar(candidate, structures[reference_index], score_method, use_center, metrics)[0]:
+                    if candidate_pairs is not None and (reference_index, structure_index) not in candidate_pairs:
+                        flag = False  # the structure pair is ruled out by the prefilter.
+                    elif score_matrix is not None:
+                        flag = score_matrix.get_flag(structure_index, reference_index, metrics)
+                    elif return_transforms and reference_index == 0:
+                        # the superposition onto the first structure is kept for the alignment.
+                        result = score_method(candidate, structures[0], use_center)
+                        transforms[structure_index] = result
+                        flag = (result.score <= metrics) if distance_type == "RMSD" else (result.score >= metrics)
+                    else:
+                        flag = similar(candidate, structures[reference_index], score_method, use_center, metrics,
+                                       True)[0]
+                    if flag:
                         count += 1
                 if count == len(reference_indices):
                     selected_indices.append(cluster_index)
@@ -554,10 +2848,66 @@ def cluster(structures, score_method, use_center: bool = True, metrics: float =
         elif merge_type == "any":
             for cluster_index, reference_indices in cluster_flags.items():
                 for reference_index in reference_indices:
-                    if similar(candidate, structures[reference_index], score_method, use_center, metrics)[0]:
+                    if candidate_pairs is not None and (reference_index, structure_index) not in candidate_pairs:
+                        flag = False  # the structure pair is ruled out by the prefilter.
+                    elif score_matrix is not None:
+                        flag = score_matrix.get_flag(structure_index, reference_index, metrics)
+                    elif return_transforms and reference_index == 0:
+                        # the superposition onto the first structure is kept for the alignment.
+                        result = score_method(candidate, structures[0], use_center)
+                        transforms[structure_index] = result
+                        flag = (result.score <= metrics) if distance_type == "RMSD" else (result.score >= metrics)
+                    else:
+                        flag = similar(candidate, structures[reference_index], score_method, use_center, metrics,
+                                       True)[0]
+                    if flag:
                         selected_indices.append(cluster_index)
                         break
 
+        elif merge_type == "leader":
+            distances = {}  # distances between the structure and the compared leaders.
+            for cluster_index, reference_indices in cluster_flags.items():
+                leader_index = reference_indices[0]
+                if pruning and len(distances) > 0:
+                    # d(structure, leader) >= |d(structure, known leader) - d(known leader, leader)|.
+                    bound = max([abs(distance - leader_distances[known_index][leader_index])
+                                 for known_index, distance in distances.items()])
+                    if bound > metrics + 1e-6:  # keep a margin for the numerical error of the scores.
+                        continue
+
+                if candidate_pairs is not None and (leader_index, structure_index) not in candidate_pairs:
+                    continue  # the structure pair is ruled out by the prefilter.
+
+                if score_matrix is not None:
+                    distances[leader_index] = score_matrix.get_score(structure_index, leader_index)
+                else:
+                    result = score_method(candidate, structures[leader_index], use_center)
+                    distances[leader_index] = result.score
+                    if return_transforms and leader_index == 0:
+                        transforms[structure_index] = result
+
+                if distance_type == "RMSD":
+                    flag = distances[leader_index] <= metrics
+                else:
+                    flag = distances[leader_index] >= metrics
+                if flag:
+                    selected_indices.append(cluster_index)
+                    break
+
+            if len(selected_indices) == 0 and pruning:
+                # the structure becomes a new leader, cache its distances to the other leaders.
+                leader_distances[structure_index] = {}
+                for leader_index in leader_distances.keys():
+                    if leader_index not in distances and leader_index != structure_index:
+                        if score_matrix is not None:
+                            distances[leader_index] = score_matrix.get_score(structure_index, leader_index)
+                        else:
+                            distances[leader_index] = score_method(candidate, structures[leader_index],
+                                                                   use_center).score
+                for leader_index, distance in distances.items():
+                    leader_distances[structure_index][leader_index] = distance
+                    leader_distances[leader_index][structure_index] = distance
+
         else:
             raise ValueError("No such merge type!")
 
@@ -575,15 +2925,118 @@ def cluster(structures, score_method, use_center: bool = True, metrics: float =
             # noinspection PyUnresolvedReferences
             cluster_flags[selected_indices[0]] = [structure_index]
 
-    return list(cluster_flags.values())
+    return (list(cluster_flags.values()), transforms) if return_transforms else list(cluster_flags.values())
+
+
+def stream_alignment(structures, score_method, use_center: bool = True, metrics: float = None,
+                     file_path: str = None) -> tuple:
+    """
+    Superpose the streamed structures onto the first structure and cluster them by the leaders one by one.
+
+    :param structures: generator of the structures.
+    :type structures: Iterator
+
+    :param score_method: method to calculate the similarity score.
+    :type score_method: molpub.handles.Score
+
+    :param use_center: use center location.
+    :type use_center: bool
+
+    :param metrics: score metrics to determine whether two structures are similar.
+    :type metrics: float or None
+
+    :param file_path: path (npy file) to write the aligned structure stack, the results are kept in the memory if None.
+    :type file_path: str or None
+
+    :return: aligned structures (the memory-mapped stack with the file path) and structure index cluster flags.
+    :rtype: list or numpy.memmap, list
+
+    .. note::
+        With the file path, each aligned structure is appended to the stack file as it arrives, and the structure
+        number in the header (see the "write_stack_header" function) is filled in at the end,
+        so the memory does not grow with the number of the structures. The structures should share the same size.
+    """
+    precision, shape = score_method.precision, None
+    clusterer, aligned_structures = Clusterer(score_method, use_center, metrics, keep_transforms=False), []
+    stack_file = open(file_path, "wb") if file_path is not None else None
+    try:
+        for structure in structures:
+            if len(clusterer.leaders) == 0:
+                clusterer.append(structure)
+                candidate = clusterer.leaders[0]
+            else:
+                # the superposition onto the first structure is reused by the clustering.
+                result = score_method(structure, clusterer.leaders[0], use_center)
+                clusterer.append(structure, result)
+                candidate = result.candidate
+
+            if stack_file is None:
+                aligned_structures.append(candidate)
+            else:
+                if shape is None:
+                    shape = candidate.shape
+                    write_stack_header(stack_file, 0, shape, precision)
+                elif candidate.shape != shape:
+                    raise ValueError("The structures should share the same size to be written into one stack!")
+                stack_file.write(asarray(candidate, dtype=precision).tobytes())
+
+        if stack_file is not None and shape is not None:
+            write_stack_header(stack_file, len(clusterer.flags), shape, precision)
+    finally:
+        if stack_file is not None:
+            stack_file.close()
+
+    if len(clusterer.flags) == 0:
+        if file_path is not None:
+            remove(file_path)
+        raise ValueError("No structure is streamed!")
+
+    if file_path is None:
+        return aligned_structures, clusterer.get_clusters()
+
+    return open_memmap(file_path, mode="r+"), clusterer.get_clusters()
+
+
+def write_stack_header(stack_file, structure_number: int, shape: tuple, precision: str):
+    """
+    Write (or rewrite in place) the npy header of the structure stack at the beginning of the file.
 
+    :param stack_file: stack file opened in the binary mode.
+    :type stack_file: io.BufferedWriter
 
-def align(structures, score_method, use_center: bool = True, metrics: float = None, merge_type: str = "all") -> dict:
+    :param structure_number: number of the structures in the stack.
+    :type structure_number: int
+
+    :param shape: shape of one structure.
+    :type shape: tuple
+
+    :param precision: floating-point precision of the structures.
+    :type precision: str
+
+    .. note::
+        The structure number is padded to a fixed width, so the header keeps its length when it is rewritten
+        with the final number after the structures are appended.
+    """
+    sizes = ", ".join([str(structure_number).rjust(20)] + [str(size) for size in shape])
+    header = "{'descr': %r, 'fortran_order': False, 'shape': (%s), }" % (finfo(precision).dtype.str, sizes)
+    header += " " * (63 - (len(header) + 10) % 64) + "\n"  # the data is aligned to 64 bytes.
+    location = stack_file.tell()
+    stack_file.seek(0)
+    stack_file.write(magic(1, 0) + len(header).to_bytes(2, "little") + header.encode("latin1"))
+    if location > 0:
+        stack_file.seek(location)
+
+
+def align(structures, score_method, use_center: bool = True, metrics: float = None, merge_type: str = "all",
+          score_matrix: ScoreMatrix = None, workers: int = 1, cluster_number: int = None,
+          use_consensus: bool = False, tolerance: float = 1e-6, iteration_number: int = 100,
+          chunk_size: int = 1024, file_path: str = None) -> dict:
     """
     Align the molecule structures.
 
-    :param structures: structures (with the same size).
-    :type structures: numpy.ndarray
+    :param structures: structures (with the same size), which could be a generator (e.g. "load_models_from_file"),
+        only the "leader" merge type consumes the generator in constant memory, the others collect it into a list.
+    :type structures: numpy.ndarray, list or Iterator
 
     :param score_method: method to calculate the similarity score.
     :type score_method: molpub.handles.Score
@@ -594,27 +3047,200 @@ def align(structures, score_method, use_center: bool = True, metrics: float = No
     :param metrics: score metrics to determine whether any two structures are similarity.
     :type metrics: float or None
 
-    :param merge_type: the type to determine one structure can merge into a structure group.
+    :param merge_type: the type to determine one structure can merge into a structure group
+        ("all", "any", "leader", "average", "complete" or "medoids").
     :type merge_type: str
 
+    :param score_matrix: precomputed score matrix (with transforms) of the structures (see the "pairwise" function).
+    :type score_matrix: molpub.handles.ScoreMatrix or None
+
+    :param workers: number of worker processes to calculate the score matrix if it is not provided
+        (not supported by the "leader" merge type).
+    :type workers: int
+
+    :param cluster_number: number of the clusters for the "medoids" merge type.
+    :type cluster_number: int or None
+
+    :param use_consensus: align the structures of each cluster onto their consensus structure
+        (see the "procrustes" function), otherwise onto the first structure.
+    :type use_consensus: bool
+
+    :param tolerance: convergence tolerance of the consensus structure.
+    :type tolerance: float
+
+    :param iteration_number: maximum number of the iterations to find the consensus structure.
+    :type iteration_number: int
+
+    :param chunk_size: number of the remaining structures superposed together.
+    :type chunk_size: int
+
+    :param file_path: path (npy file) to write the aligned structure stack, the results are kept in the memory if None.
+    :type file_path: str or None
+
     :return: alignment structure results.
     :rtype: dict
+
+    .. note::
+        The aligned structures are returned in the precision of the score method.
+        With the score matrix, the structures are moved by the stored transforms without any superposition.
+        Otherwise, the superpositions onto the first structure found during clustering are reused,
+        and the remaining structures (e.g. clustered by the score matrix) are superposed in one batch.
+        With more than one worker, all the structure pairs are scored (with the transforms) in parallel,
+        then the structures are clustered and moved by the score matrix,
+        which the "leader" merge type does not support since it only compares the structures with the leaders.
+        With the consensus structure, the structures in one cluster should share the same shape.
+        With the file path, the structures should share the same size, and the aligned structures are written into
+        the memory-mapped stack (in the order of the structures), of which the rows are returned as the results.
+
+        The generator of the structures is consumed once. With the "leader" merge type (and without the score
+        matrix), each structure is superposed onto the first structure and clustered as it arrives
+        (see the "stream_alignment" function), only the leaders are kept and the aligned structures are written
+        into the file if the file path is given. Otherwise, the structures are collected first.
     """
-    cluster_flags = cluster(structures, score_method, use_center, metrics, merge_type)
+    if merge_type == "leader" and workers > 1:
+        raise ValueError("The leader merge type does not support multiple workers!")
+
+    streamed, aligned_stack = False, None
+    if not hasattr(structures, "__len__"):  # the structures are streamed by a generator.
+        if merge_type == "leader" and score_matrix is None:
+            structures, cluster_flags = stream_alignment(structures, score_method, use_center, metrics, file_path)
+            aligned_stack = structures if file_path is not None else None
+            transforms, streamed = {}, True
+        else:
+            structures = list(structures)
+
+    if not streamed:
+        if score_matrix is None and workers > 1:
+            score_matrix = pairwise(structures, score_method, use_center, workers=workers)
+
+        cluster_flags, transforms = cluster(structures, score_method, use_center, metrics, merge_type, score_matrix,
+                                            cluster_number=cluster_number, return_transforms=True)
 
     indices, alignment_results = zeros(shape=(len(structures, )), dtype=int), {}
     for cluster_index, structure_indices in enumerate(cluster_flags):
         indices[structure_indices] = cluster_index
         alignment_results[cluster_index] = []
 
-    alignment_results[indices[0]].append(structures[0])
-    for cluster_index, structure in zip(indices[1:], structures[1:]):
-        _, candidate, _, _, _ = score_method(structure, structures[0], use_center)
-        alignment_results[cluster_index].append(candidate)
+    if file_path is not None and not streamed:
+        shapes = get_shapes(structures)
+        if len(shapes) > 1:
+            raise ValueError("The structures should share the same size to be written into one stack!")
+        aligned_stack = open_memmap(file_path, mode="w+", dtype=score_method.precision,
+                                    shape=(len(structures),) + list(shapes)[0])
+
+    candidates = {}
+    for structure_index in range(len(structures)):
+        structure = structures[structure_index]
+        if structure_index == 0 or streamed:  # the streamed structures have been superposed as they arrived.
+            candidate = asarray(structure, dtype=score_method.precision)
+        elif score_matrix is not None:
+            # the shorter structure is moved, as the score method does.
+            if len(structure) > len(structures[0]):
+                rotation, translation = score_matrix.get_transform(0, structure_index)
+                structure = structures[0]
+            else:
+                rotation, translation = score_matrix.get_transform(structure_index, 0)
+            candidate = dot(asarray(structure, dtype=score_method.precision), rotation) + translation
+        elif structure_index in transforms:  # the superposition found during clustering.
+            candidate = transforms[structure_index].candidate
+        else:
+            continue
+        if aligned_stack is not None and not streamed:  # the aligned structure is kept in the file.
+            aligned_stack[structure_index] = candidate
+            candidate = aligned_stack[structure_index]
+        candidates[structure_index] = candidate
+
+    # the other structures are superposed onto the first structure chunk by chunk (if they share the same shape).
+    remaining_indices = array([index for index in range(1, len(structures)) if index not in candidates], dtype=int)
+    for start in range(0, len(remaining_indices), chunk_size):
+        chunk_indices = remaining_indices[start: start + chunk_size]
+        result = calculate_pairs(structures, score_method, use_center, chunk_indices,
+                                 zeros(shape=(len(chunk_indices),), dtype=int))
+        for structure_index, reverse, rotation, translation in zip(chunk_indices, *result[2:]):
+            structure = structures[0] if reverse else structures[structure_index]
+            candidate = dot(asarray(structure, dtype=score_method.precision), rotation) + translation
+            if aligned_stack is not None:
+                aligned_stack[structure_index] = candidate
+                candidate = aligned_stack[structure_index]
+            candidates[structure_index] = candidate
+
+    for structure_index in range(len(structures)):
+        alignment_results[indices[structure_index]].append(candidates[structure_index])
+
+    if use_consensus:
+        for cluster_index, cluster_structures in alignment_results.items():
+            if len(set([structure.shape for structure in cluster_structures])) > 1:
+                raise ValueError("The structures in one cluster should share the same shape in the consensus mode!")
+
+            aligned_structures, _ = procrustes(array(cluster_structures), tolerance, iteration_number,
+                                               score_method.precision)
+            if aligned_stack is not None:
+                aligned_stack[cluster_flags[cluster_index]] = aligned_structures
+                aligned_structures = [aligned_stack[structure_index] for structure_index in cluster_flags[cluster_index]]
+            alignment_results[cluster_index] = list(aligned_structures)
+
+    if aligned_stack is not None:
+        aligned_stack.flush()
 
     return alignment_results
 
 
+def procrustes(structures, tolerance: float = 1e-6, iteration_number: int = 100, precision: str = "float64") -> tuple:
+    """
+    Align the structures onto their consensus (mean) structure by the generalized Procrustes analysis.
+
+    :param structures: structures (with the same size), format of which is (structure number, atom number, 3).
+    :type structures: numpy.ndarray
+
+    :param tolerance: convergence tolerance (in angstroms) of the root mean squared change of the consensus structure.
+    :type tolerance: float
+
+    :param iteration_number: maximum number of the iterations.
+    :type iteration_number: int
+
+    :param precision: floating-point precision of the calculation, including float64 and float32.
+    :type precision: str
+
+    :return: aligned structures and the consensus structure.
+    :rtype: numpy.ndarray, numpy.ndarray
+
+    .. note::
+        In each iteration, all the centered structures are rotated onto the running consensus structure
+        by the batched Kabsch algorithm, and the consensus structure is updated by their average.
+        The consensus structure is kept in the frame of the first structure (to which it is superposed
+        in each iteration), so that the results are comparable with those of the "align" function.
+        The aligned structures can be used by the "set_difference" function directly.
+    """
+    if precision not in ["float64", "float32"]:
+        raise ValueError("No such precision type!")
+
+    structures = asarray(structures, dtype=precision)
+    if len(structures.shape) != 3 or structures.shape[2] != 3:
+        raise ValueError("The structures should share the same shape!")
+
+    centers = mean(structures, axis=1, keepdims=True)
+    centered_structures = structures - centers
+    first_structure = centered_structures[0]
+    consensus, aligned_structures = first_structure.copy(), centered_structures
+
+    for _ in range(iteration_number):
+        # rotate all the structures onto the consensus structure in one decomposition call.
+        rotations = Score.get_rotations(matmul(transpose(centered_structures, (0, 2, 1)), consensus))
+        aligned_structures = matmul(centered_structures, rotations)
+
+        # superpose the new consensus structure onto the first structure to fix the frame.
+        updated_consensus = mean(aligned_structures, axis=0)
+        rotation = Score.get_rotation(updated_consensus, first_structure)
+        updated_consensus, aligned_structures = dot(updated_consensus, rotation), matmul(aligned_structures, rotation)
+
+        change = sqrt(mean(sum((updated_consensus - consensus) ** 2, axis=1)))
+        consensus = updated_consensus
+        if change < tolerance:
+            break
+
+    return aligned_structures + centers[0], consensus + centers[0]
+
+
 def set_properties(structure_paths: list, molecule_type: str, property_type: str = None, targets: list = None,
                    unit_values: dict = None) -> list:
     """
@@ -939,7 +3565,8 @@ def set_properties(structure_paths: list, molecule_type: str, property_type: str
     return properties
 
 
-def set_difference(alignment_data: ndarray, model_type: str, calculation_type: str = "average") -> ndarray:
+def set_difference(alignment_data: ndarray, model_type: str, calculation_type: str = "average",
+                   precision: str = "float64", chunk_size: int = 64, memory_size: float = 256.0) -> ndarray:
     """
     Set difference information for a known chain.
 
@@ -952,6 +3579,15 @@ def set_difference(alignment_data: ndarray, model_type: str, calculation_type: s
     :param calculation_type: difference calculation, including average and maximum.
     :type calculation_type: str
 
+    :param precision: floating-point precision of the calculation, including float64 and float32.
+    :type precision: str
+
+    :param chunk_size: number of the chains loaded together, the chain pairs are calculated block by block.
+    :type chunk_size: int
+
+    :param memory_size: maximum memory (in MB) of the intermediate arrays of one block of chain pairs.
+    :type memory_size: float
+
     :return: difference values.
     :rtype: numpy.ndarray
 
@@ -959,9 +3595,15 @@ def set_difference(alignment_data: ndarray, model_type: str, calculation_type: s
         If chain number is 2, the parameter 'calculation_type' is invalid.
         We provide the root mean squared error of each unit.
         Otherwise, we provide the average and maximum value of the root mean squared error of each unit.
+        The alignment data could be a memory-mapped stack, of which only two chunks are loaded at a time.
+        The chunk size is reduced to meet the memory size, so the block of chain pairs does not grow
+        with the chain length.
     """
     assert len(alignment_data.shape) == 3 and alignment_data.shape[2] == 3
 
+    if precision not in ["float64", "float32"]:
+        raise ValueError("No such precision type!")
+
     if model_type == "N-CA-C-O":
         merge_number = 4
 
@@ -974,33 +3616,30 @@ def set_difference(alignment_data: ndarray, model_type: str, calculation_type: s
     else:
         raise ValueError("No such model type!")
 
-    differences = []
-    if merge_number == 1:
-        for index_1 in range(alignment_data.shape[0] - 1):
-            for index_2 in range(index_1 + 1, alignment_data.shape[0]):
-                case_1, case_2 = alignment_data[index_1], alignment_data[index_2]
-                normalized_values = linalg.norm((case_1 - case_2), ord=2, axis=1)
-                differences.append(normalized_values)
-
-    else:
-        for index_1 in range(alignment_data.shape[0] - 1):
-            for index_2 in range(index_1 + 1, alignment_data.shape[0]):
-                case_1, case_2 = alignment_data[index_1], alignment_data[index_2]
-                normalized_values = linalg.norm((case_1 - case_2), ord=2, axis=1)
-                normalized_values = normalized_values.reshape(len(normalized_values) // merge_number, merge_number)
-                normalized_values = linalg.norm(normalized_values, ord=2, axis=1)
-                differences.append(normalized_values)
+    if calculation_type not in ["average", "maximum"]:
+        raise ValueError("No such calculate type!")
 
-    differences = array(differences)
+    # the differences of the chain pairs are accumulated block by block instead of being kept.
+    chain_number, unit_number = alignment_data.shape[0], alignment_data.shape[1] // merge_number
+    differences = zeros(shape=(unit_number,), dtype=precision)
+
+    # about five values of each atom are kept for each chain pair of one block (chunk size by chunk size).
+    pair_size = alignment_data.shape[1] * 5 * finfo(precision).bits // 8
+    chunk_size = int(max([min([chunk_size, sqrt(memory_size * 2 ** 20 // pair_size)]), 1]))
+    for start_1 in range(0, chain_number, chunk_size):
+        cases_1 = asarray(alignment_data[start_1: start_1 + chunk_size], dtype=precision)
+        for start_2 in range(start_1, chain_number, chunk_size):
+            cases_2 = asarray(alignment_data[start_2: start_2 + chunk_size], dtype=precision)
+            normalized_values = linalg.norm(cases_1[:, None] - cases_2[None], ord=2, axis=3)
+            if merge_number > 1:
+                normalized_values = normalized_values.reshape(len(cases_1), len(cases_2), unit_number, merge_number)
+                normalized_values = linalg.norm(normalized_values, ord=2, axis=3)
+            if start_1 == start_2:  # each pair of different chains is counted once.
+                normalized_values = normalized_values[triu_indices(len(cases_1), k=1)]
+            differences += sum(normalized_values.reshape(-1, unit_number), axis=0, dtype=precision)
 
     if calculation_type == "average":
-        differences = mean(differences, axis=0)
-
-    elif calculation_type == "maximum":
-        differences = sum(differences, axis=0)
-
-    else:
-        raise ValueError("No such calculate type!")
+        differences = differences / (chain_number * (chain_number - 1) // 2)
 
     return differences
 
@@ -1026,7 +3665,7 @@ def kmer(chain: str, structure: ndarray, sub_length: int) -> Iterator[tuple]:
         yield chain[index: index + sub_length], structure[index * number: (index + sub_length) * number]
 
 
-def load_structure_from_file(file_path: str, molecule_type: str = "AA") -> tuple:
+def load_structure_from_file(file_path: str, molecule_type: str = "AA", precision: str = "float64") -> tuple:
     """
     Load structure data from file.
 
@@ -1036,13 +3675,23 @@ def load_structure_from_file(file_path: str, molecule_type: str = "AA") -> tuple
     :param molecule_type: type of molecule data, which could be DNA, RNA or AA (amino acid).
     :type molecule_type: str
 
+    :param precision: floating-point precision of the loaded structures, including float64 and float32.
+    :type precision: str
+
     :return: chains and their corresponding structures.
     :rtype: dict, dict
+
+    .. note::
+        The chains are keyed by their ids, so only the last model of a multi-model file is kept.
+        The models can be loaded one by one by the "load_models_from_file" function.
     """
     letters = {"ALA": "A", "CYS": "C", "ASP": "D", "GLU": "E", "PHE": "F", "GLY": "G", "HIS": "H", "ILE": "I",
                "LYS": "K", "LEU": "L", "MET": "M", "ASN": "N", "PRO": "P", "GLN": "Q", "ARG": "R", "SER": "S",
                "THR": "T", "VAL": "V", "TRP": "W", "TYR": "Y"}
 
+    if precision not in ["float64", "float32"]:
+        raise ValueError("No such precision type!")
+
     if file_path[-4:].lower() == ".pdb":
         data = PDBParser(PERMISSIVE=1).get_structure("temp", file_path)
     elif file_path[-4:].lower() == ".cif":
@@ -1067,7 +3716,8 @@ def load_structure_from_file(file_path: str, molecule_type: str = "AA") -> tuple
                             location = (location + 1) % 4
                     sequence += letters[residue.get_resname()]
                 chains[chain.id] = sequence
-                structure_data[chain.id] = {"CA": array(core_positions), "N-CA-C-O": array(skeleton_positions)}
+                structure_data[chain.id] = {"CA": array(core_positions, dtype=precision),
+                                            "N-CA-C-O": array(skeleton_positions, dtype=precision)}
 
     elif molecule_type in ["DNA", "RNA"]:
         for model in data:
@@ -1088,7 +3738,8 @@ def load_structure_from_file(file_path: str, molecule_type: str = "AA") -> tuple
                         skeleton_positions.append(mean(array(value), axis=0))
                     sequence += residue.get_resname()[1:]
                 chains[chain.id] = sequence
-                structure_data[chain.id] = {"C3'": array(core_positions), "3SPN": array(skeleton_positions)}
+                structure_data[chain.id] = {"C3'": array(core_positions, dtype=precision),
+                                            "3SPN": array(skeleton_positions, dtype=precision)}
 
     else:
         raise ValueError("This structure type is not supported!")
@@ -1096,6 +3747,183 @@ def load_structure_from_file(file_path: str, molecule_type: str = "AA") -> tuple
     return chains, structure_data
 
 
+def read_atoms(file_path: str) -> Iterator[tuple]:
+    """
+    Read the atom records of the structure file line by line.
+
+    :param file_path: path to load file.
+    :type file_path: str
+
+    :return: model number, chain id, residue id, residue name, atom name and position of each atom.
+    :rtype: int, str, tuple, str, str, list
+
+    .. note::
+        Only the first alternate location of each atom is read.
+        The chain ids and the residue ids of the cif files follow the author records, as Biopython does.
+    """
+    if file_path[-4:].lower() == ".pdb":
+        model_number = 0
+        with open(file_path, "r") as file:
+            for line in file:
+                if line[:6] == "MODEL ":
+                    model_number += 1  # the models are counted in turn, whatever their serial numbers are.
+                elif line[:6] in ["ATOM  ", "HETATM"] and line[16] in [" ", "A"]:
+                    yield model_number, line[21], (line[22:26].strip(), line[26].strip()), line[17:20].strip(), \
+                        line[12:16].strip(), [float(line[30:38]), float(line[38:46]), float(line[46:54])]
+
+    elif file_path[-4:].lower() == ".cif":
+        fields, locations = [], None
+        with open(file_path, "r") as file:
+            for line in file:
+                if line.startswith("_atom_site."):
+                    fields.append(line.strip()[11:])
+                    continue
+
+                if len(fields) == 0 or line.startswith("loop_"):
+                    fields, locations = [], None
+                    continue
+
+                if line.startswith("#") or line.startswith("_"):
+                    fields, locations = [], None  # the end of the atom site table.
+                    continue
+
+                if line.strip() == "":
+                    continue
+
+                if locations is None:
+                    names = ["group_PDB", "label_alt_id", "auth_asym_id", "auth_seq_id", "pdbx_PDB_ins_code",
+                             "auth_comp_id", "auth_atom_id", "Cartn_x", "Cartn_y", "Cartn_z", "pdbx_PDB_model_num"]
+                    # the label records are used without the author records.
+                    names = [name if name in fields else name.replace("auth_", "label_") for name in names]
+                    # the missing fields are located at the unknown value appended to each row.
+                    locations = [fields.index(name) if name in fields else -1 for name in names]
+                    if -1 in locations[6:10]:
+                        raise ValueError("The atom site table lacks the atom names or the positions!")
+
+                values = [value[1:-1] if value[:1] in ["'", "\""] else value for value in line.split()] + ["?"]
+                group, alternate_location, chain_id, residue_number, insertion_code, residue_name, atom_name, \
+                    x, y, z, model_number = [values[location] for location in locations]
+                if group in ["ATOM", "HETATM", "?"] and alternate_location in [".", "?", "A"]:
+                    yield int(model_number) if model_number != "?" else 1, chain_id, \
+                        (residue_number, insertion_code if insertion_code not in [".", "?"] else ""), \
+                        residue_name, atom_name, [float(x), float(y), float(z)]
+
+    else:
+        raise ValueError("No such load type! Only structure file with \"pdb\" or \"cif\" format can be loaded!")
+
+
+def build_model(atoms: list, model_type: str, chain_id: str = None, precision: str = "float64") -> ndarray:
+    """
+    Build the structure of one chain from the atom records of one model.
+
+    :param atoms: chain id, residue id, residue name, atom name and position of each atom.
+    :type atoms: list
+
+    :param model_type: model used by structures (N-CA-C-O / CA for proteins, 3SPN / C3' for DNA and RNA sequences).
+    :type model_type: str
+
+    :param chain_id: chain to build, the first chain is built if None.
+    :type chain_id: str or None
+
+    :param precision: floating-point precision of the structure, including float64 and float32.
+    :type precision: str
+
+    :return: structure represented by three-dimension position list.
+    :rtype: numpy.ndarray
+    """
+    if chain_id is None:
+        chain_id = atoms[0][0] if len(atoms) > 0 else None
+
+    positions, location, residue_id, groups = [], 0, None, None
+    for current_id, current_residue_id, residue_name, atom_name, position in atoms:
+        if current_id != chain_id or residue_name == "HOH":
+            continue
+
+        if model_type in ["CA", "C3'"]:
+            if atom_name == model_type:
+                positions.append(position)
+
+        elif model_type == "N-CA-C-O":
+            if atom_name == ["N", "CA", "C", "O"][location]:
+                positions.append(position)
+                location = (location + 1) % 4
+
+        else:  # the sugar, the base and the phosphate sites of each nucleotide.
+            if current_residue_id != residue_id:
+                if groups is not None:
+                    positions += [mean(array(group), axis=0) for group in groups]
+                residue_id, groups = current_residue_id, [[], [], []]
+            if atom_name in ["P", "O5", "O3'"] or (atom_name[:2] == "OP" and atom_name[2:3] in "1234567890"):
+                groups[2].append(position)
+            elif atom_name in ["C5'", "C4'", "C3'", "C2'", "C1'", "O4'", "O2'"]:
+                groups[0].append(position)
+            else:
+                groups[1].append(position)
+
+    if groups is not None:
+        positions += [mean(array(group), axis=0) for group in groups]
+
+    return array(positions, dtype=precision).reshape(-1, 3)
+
+
+def load_models_from_file(file_path: str, molecule_type: str = "AA", model_type: str = "CA", chain_id: str = None,
+                          precision: str = "float64") -> Iterator[ndarray]:
+    """
+    Load the structures of one chain from the multi-model (e.g. NMR or trajectory) file model by model.
+
+    :param file_path: path to load file.
+    :type file_path: str
+
+    :param molecule_type: type of molecule data, which could be DNA, RNA or AA (amino acid).
+    :type molecule_type: str
+
+    :param model_type: model used by structures (N-CA-C-O / CA for proteins, 3SPN / C3' for DNA and RNA sequences).
+    :type model_type: str
+
+    :param chain_id: chain loaded from each model, the first chain is loaded if None.
+    :type chain_id: str or None
+
+    :param precision: floating-point precision of the loaded structures, including float64 and float32.
+    :type precision: str
+
+    :return: structure of each model.
+    :rtype: numpy.ndarray
+
+    .. note::
+        The file is read line by line and only the atom records of the current model are kept,
+        so the structures can be consumed by the "cluster" and "align" functions as a generator
+        without loading the whole file (unlike the "load_structure_from_file" function).
+
+        Example
+            >>> from molpub import Score, cluster, load_models_from_file
+            >>> clusters = cluster(load_models_from_file("./trajectory.pdb"), Score("RMSD", "CA"), True, 1.0, "leader")
+    """
+    if precision not in ["float64", "float32"]:
+        raise ValueError("No such precision type!")
+
+    if molecule_type == "AA":
+        if model_type not in ["N-CA-C-O", "CA"]:
+            raise ValueError("The model type does not match the molecule type!")
+
+    elif molecule_type in ["DNA", "RNA"]:
+        if model_type not in ["3SPN", "C3'"]:
+            raise ValueError("The model type does not match the molecule type!")
+
+    else:
+        raise ValueError("This structure type is not supported!")
+
+    model_number, atoms = None, []
+    for atom in read_atoms(file_path):
+        if atom[0] != model_number:
+            if len(atoms) > 0:
+                yield build_model(atoms, model_type, chain_id, precision)
+            model_number, atoms = atom[0], []
+        atoms.append(atom[1:])
+
+    if len(atoms) > 0:
+        yield build_model(atoms, model_type, chain_id, precision)
+
+
 def save_structure_to_file(chains: list, structures: ndarray, file_path: str, model_type: str = "CA"):
     """
     Save temporary structure to file.
@@ -1158,3 +3986,98 @@ def save_structure_to_file(chains: list, structures: ndarray, file_path: str, mo
 
     io.set_structure(structure_data)
     io.save(file_path)
+
+
+def save_structures_to_stack(directory_path: str, file_path: str, molecule_type: str = "AA", model_type: str = "CA",
+                             chain_id: str = None, precision: str = "float32") -> memmap:
+    """
+    Convert the structure files in a directory into one memory-mapped structure stack with its index.
+
+    :param directory_path: path of the directory containing the structure files (pdb or cif format).
+    :type directory_path: str
+
+    :param file_path: path to save the stack (npy file) and the index (json file), without the extension.
+    :type file_path: str
+
+    :param molecule_type: type of molecule data, which could be DNA, RNA or AA (amino acid).
+    :type molecule_type: str
+
+    :param model_type: model used by structures (N-CA-C-O / CA for proteins, 3SPN / C3' for DNA and RNA sequences).
+    :type model_type: str
+
+    :param chain_id: chain kept from each file, the first chain is kept if None.
+    :type chain_id: str or None
+
+    :param precision: floating-point precision of the stack, including float64 and float32.
+    :type precision: str
+
+    :return: structure stack, format of which is (structure number, atom number, 3).
+    :rtype: numpy.memmap
+
+    .. note::
+        The files are loaded one by one in the order of their names and written into the stack on the disk,
+        so the memory does not grow with the number of files. The structures should share the same size.
+        The index records the file names, chain ids and sequences of the structures,
+        as well as the molecule type and the model type.
+    """
+    if precision not in ["float64", "float32"]:
+        raise ValueError("No such precision type!")
+
+    if model_type not in ["N-CA-C-O", "CA", "3SPN", "C3'"]:
+        raise ValueError("No such model type!")
+
+    file_names = sorted([name for name in listdir(directory_path) if name[-4:].lower() in [".pdb", ".cif"]])
+    if len(file_names) == 0:
+        raise ValueError("No structure file is found in the directory!")
+
+    stack = None
+    index = {"molecule type": molecule_type, "model type": model_type, "names": [], "chains": [], "sequences": []}
+    for location, file_name in enumerate(file_names):
+        chains, structure_data = load_structure_from_file(path.join(directory_path, file_name), molecule_type,
+                                                          precision)
+        current_id = list(chains.keys())[0] if chain_id is None else chain_id
+        if current_id not in chains:
+            raise ValueError("No chain " + current_id + " in the file " + file_name + "!")
+        if model_type not in structure_data[current_id]:
+            raise ValueError("The model type does not match the molecule type!")
+
+        structure = structure_data[current_id][model_type]
+        if stack is None:
+            stack = open_memmap(file_path + ".npy", mode="w+", dtype=precision,
+                                shape=(len(file_names),) + structure.shape)
+        elif structure.shape != stack.shape[1:]:
+            raise ValueError("The structures should share the same size!")
+
+        stack[location] = structure
+        index["names"].append(file_name)
+        index["chains"].append(current_id)
+        index["sequences"].append(chains[current_id])
+
+    stack.flush()
+    with open(file_path + ".json", "w", encoding="utf-8") as file:
+        dump(index, file, indent=4)
+
+    return stack
+
+
+def load_structures_from_stack(file_path: str, mode: str = "r") -> tuple:
+    """
+    Load the memory-mapped structure stack and its index.
+
+    :param file_path: path of the stack (npy file) and the index (json file), without the extension.
+    :type file_path: str
+
+    :param mode: mode to map the stack, including "r" (read-only), "r+" (read and write) and "c" (copy-on-write).
+    :type mode: str
+
+    :return: structure stack and its index.
+    :rtype: numpy.memmap, dict
+    """
+    with open(file_path + ".json", "r", encoding="utf-8") as file:
+        index = load_json(file)
+
+    stack = load(file_path + ".npy", mmap_mode=mode)
+    if len(stack) != len(index["names"]):
+        raise ValueError("The saved stack does not match the saved index!")
+
+    return stack, index
@@ -0,0 +1,249 @@
+from numpy import ndarray, empty
+
+try:
+    # noinspection PyPackageRequirements
+    from numba import njit, prange
+except ModuleNotFoundError:  # the NumPy backend of the score is used without Numba.
+    njit, prange = None, range
+
+
+def tm_kernel(candidate_structure: ndarray, rotations: ndarray, translations: ndarray, reference_structure: ndarray,
+              starts: ndarray, factor: float, unit_number: int) -> ndarray:
+    """
+    Move the candidate structure by each superposition and calculate the TM-scores in one pass.
+
+    :param candidate_structure: candidate structure represented by three-dimension position list.
+    :type candidate_structure: numpy.ndarray
+
+    :param rotations: rotation matrices, format of which is (superposition number, 3, 3).
+    :type rotations: numpy.ndarray
+
+    :param translations: translation vectors, format of which is (superposition number, 3).
+    :type translations: numpy.ndarray
+
+    :param reference_structure: reference structure represented by three-dimension position list.
+    :type reference_structure: numpy.ndarray
+
+    :param starts: start locations (in atoms) of the superpositions in the reference structure.
+    :type starts: numpy.ndarray
+
+    :param factor: distance scale of TM-score.
+    :type factor: float
+
+    :param unit_number: number of atom types in one unit (residue or nucleotide) of the structures.
+    :type unit_number: int
+
+    :return: scores of the superpositions.
+    :rtype: numpy.ndarray
+    """
+    number, length = len(rotations), len(candidate_structure)
+    scores, scale = empty(number), factor * factor
+    for index in prange(number):
+        rotation, translation, start, total = rotations[index], translations[index], starts[index], 0.0
+        for location in range(length):
+            x, y, z = candidate_structure[location, 0], candidate_structure[location, 1], \
+                candidate_structure[location, 2]
+            square = 0.0
+            for axis in range(3):
+                delta = x * rotation[0, axis] + y * rotation[1, axis] + z * rotation[2, axis] + translation[axis] \
+                    - reference_structure[start + location, axis]
+                square += delta * delta
+            total += 1.0 / (1.0 + square / scale)
+        scores[index] = total / (length // unit_number)
+
+    return scores
+
+
+def gdt_kernel(candidate_structure: ndarray, rotations: ndarray, translations: ndarray, reference_structure: ndarray,
+               starts: ndarray, cutoffs: ndarray, unit_number: int) -> ndarray:
+    """
+    Move the candidate structure by each superposition and calculate the GDT scores in one pass.
+
+    :param candidate_structure: candidate structure represented by three-dimension position list.
+    :type candidate_structure: numpy.ndarray
+
+    :param rotations: rotation matrices, format of which is (superposition number, 3, 3).
+    :type rotations: numpy.ndarray
+
+    :param translations: translation vectors, format of which is (superposition number, 3).
+    :type translations: numpy.ndarray
+
+    :param reference_structure: reference structure represented by three-dimension position list.
+    :type reference_structure: numpy.ndarray
+
+    :param starts: start locations (in atoms) of the superpositions in the reference structure.
+    :type starts: numpy.ndarray
+
+    :param cutoffs: four distance cutoffs of GDT.
+    :type cutoffs: numpy.ndarray
+
+    :param unit_number: number of atom types in one unit (residue or nucleotide) of the structures.
+    :type unit_number: int
+
+    :return: scores of the superpositions.
+    :rtype: numpy.ndarray
+    """
+    number, length = len(rotations), len(candidate_structure)
+    scores, squared_cutoffs = empty(number), cutoffs * cutoffs
+    first, second, third, fourth = squared_cutoffs[0], squared_cutoffs[1], squared_cutoffs[2], squared_cutoffs[3]
+    for index in prange(number):
+        rotation, translation, start, count = rotations[index], translations[index], starts[index], 0.0
+        for location in range(length):
+            x, y, z = candidate_structure[location, 0], candidate_structure[location, 1], \
+                candidate_structure[location, 2]
+            square = 0.0
+            for axis in range(3):
+                delta = x * rotation[0, axis] + y * rotation[1, axis] + z * rotation[2, axis] + translation[axis] \
+                    - reference_structure[start + location, axis]
+                square += delta * delta
+            count += (square < first) + (square < second) + (square < third) + (square < fourth)
+        scores[index] = count / (len(cutoffs) * (length // unit_number)) * 100
+
+    return scores
+
+
+def qcp_kernel(covariances: ndarray, candidate_inners: ndarray, reference_inners: ndarray,
+               tolerance: float) -> ndarray:
+    """
+    Calculate the minimum squared deviations by the quaternion characteristic polynomial (QCP) method.
+
+    :param covariances: centered cross-covariance matrices, format of which is (matrix number, 3, 3).
+    :type covariances: numpy.ndarray
+
+    :param candidate_inners: inner products of the centered candidate structures.
+    :type candidate_inners: numpy.ndarray
+
+    :param reference_inners: inner products of the centered reference structures.
+    :type reference_inners: numpy.ndarray
+
+    :param tolerance: relative tolerance of the Newton-Raphson method.
+    :type tolerance: float
+
+    :return: minimum sums of squared deviations after the optimal rotations.
+    :rtype: numpy.ndarray
+    """
+    # Pu Liu, Dimitris K. Agrafiotis and Douglas L. Theobald (2010) J. Comput. Chem.
+    number = len(covariances)
+    deviations = empty(number)
+    for index in prange(number):
+        sxx, sxy, sxz = covariances[index, 0, 0], covariances[index, 0, 1], covariances[index, 0, 2]
+        syx, syy, syz = covariances[index, 1, 0], covariances[index, 1, 1], covariances[index, 1, 2]
+        szx, szy, szz = covariances[index, 2, 0], covariances[index, 2, 1], covariances[index, 2, 2]
+        sxx2, syy2, szz2, sxy2, syx2 = sxx * sxx, syy * syy, szz * szz, sxy * sxy, syx * syx
+        sxz2, szx2, syz2, szy2 = sxz * sxz, szx * szx, syz * syz, szy * szy
+
+        # characteristic polynomial of the key matrix: x^4 + c2 * x^2 + c1 * x + c0.
+        c2 = -2.0 * (sxx2 + syy2 + szz2 + sxy2 + syx2 + sxz2 + szx2 + syz2 + szy2)
+        c1 = 8.0 * (sxx * syz * szy + syy * szx * sxz + szz * sxy * syx) \
+            - 8.0 * (sxx * syy * szz + syz * szx * sxy + szy * syx * sxz)
+        sxzpszx, syzpszy, sxypsyx = sxz + szx, syz + szy, sxy + syx
+        syzmszy, sxzmszx, sxymsyx = syz - szy, sxz - szx, sxy - syx
+        sxxpsyy, sxxmsyy = sxx + syy, sxx - syy
+        cross = sxy2 + sxz2 - syx2 - szx2
+        diagonal = syy2 + szz2 - sxx2 + syz2 + szy2
+        mixture = 2.0 * (syz * szy - syy * szz)
+        c0 = cross * cross + (diagonal + mixture) * (diagonal - mixture) \
+            + (-sxzpszx * syzmszy + sxymsyx * (sxxmsyy - szz)) * (-sxzmszx * syzpszy + sxymsyx * (sxxmsyy + szz)) \
+            + (-sxzpszx * syzpszy - sxypsyx * (sxxpsyy - szz)) * (-sxzmszx * syzmszy - sxypsyx * (sxxpsyy + szz)) \
+            + (sxypsyx * syzpszy + sxzpszx * (sxxmsyy + szz)) * (-sxymsyx * syzmszy + sxzpszx * (sxxpsyy + szz)) \
+            + (sxypsyx * syzmszy + sxzmszx * (sxxmsyy - szz)) * (-sxymsyx * syzpszy + sxzmszx * (sxxpsyy - szz))
+
+        # the largest eigenvalue is found by the Newton-Raphson method from the upper bound.
+        inner = (candidate_inners[index] + reference_inners[index]) / 2.0
+        value = inner
+        for _ in range(50):
+            previous = value
+            numerator = ((value * value + c2) * value + c1) * value + c0
+            denominator = (4.0 * value * value + 2.0 * c2) * value + c1
+            if denominator == 0.0:
+                break  # the degenerate structures have converged.
+            value = value - numerator / denominator
+            if abs(value - previous) <= tolerance * max(abs(value), 1.0):
+                break
+
+        deviations[index] = max(2.0 * (inner - value), 0.0)
+
+    return deviations
+
+
+def tm_bound_kernel(candidate_radii: ndarray, reference_radii: ndarray, starts: ndarray, factor: float,
+                    unit_number: int) -> ndarray:
+    """
+    Calculate the upper bound TM-scores of the superpositions rotating around each atom.
+
+    :param candidate_radii: intra-structure distance matrix of the candidate structure.
+    :type candidate_radii: numpy.ndarray
+
+    :param reference_radii: intra-structure distance matrix of the reference structure.
+    :type reference_radii: numpy.ndarray
+
+    :param starts: start locations (in atoms) of the windows in the reference structure.
+    :type starts: numpy.ndarray
+
+    :param factor: distance scale of TM-score.
+    :type factor: float
+
+    :param unit_number: number of atom types in one unit (residue or nucleotide) of the structures.
+    :type unit_number: int
+
+    :return: upper bound scores, ordered by window and then by rotation center.
+    :rtype: numpy.ndarray
+    """
+    number, length = len(starts), len(candidate_radii)
+    bounds, scale = empty(number * length), factor * factor
+    for index in prange(number * length):
+        start, center = starts[index // length], index % length
+        total = 0.0
+        for location in range(length):
+            difference = candidate_radii[center, location] - reference_radii[start + center, start + location]
+            total += 1.0 / (1.0 + difference * difference / scale)
+        bounds[index] = total / (length // unit_number)
+
+    return bounds
+
+
+def gdt_bound_kernel(candidate_radii: ndarray, reference_radii: ndarray, starts: ndarray, cutoffs: ndarray,
+                     unit_number: int) -> ndarray:
+    """
+    Calculate the upper bound GDT scores of the superpositions rotating around each atom.
+
+    :param candidate_radii: intra-structure distance matrix of the candidate structure.
+    :type candidate_radii: numpy.ndarray
+
+    :param reference_radii: intra-structure distance matrix of the reference structure.
+    :type reference_radii: numpy.ndarray
+
+    :param starts: start locations (in atoms) of the windows in the reference structure.
+    :type starts: numpy.ndarray
+
+    :param cutoffs: four distance cutoffs of GDT.
+    :type cutoffs: numpy.ndarray
+
+    :param unit_number: number of atom types in one unit (residue or nucleotide) of the structures.
+    :type unit_number: int
+
+    :return: upper bound scores, ordered by window and then by rotation center.
+    :rtype: numpy.ndarray
+    """
+    number, length = len(starts), len(candidate_radii)
+    bounds, squared_cutoffs = empty(number * length), cutoffs * cutoffs
+    first, second, third, fourth = squared_cutoffs[0], squared_cutoffs[1], squared_cutoffs[2], squared_cutoffs[3]
+    for index in prange(number * length):
+        start, center = starts[index // length], index % length
+        count = 0.0
+        for location in range(length):
+            difference = candidate_radii[center, location] - reference_radii[start + center, start + location]
+            square = difference * difference
+            count += (square < first) + (square < second) + (square < third) + (square < fourth)
+        bounds[index] = count / (len(cutoffs) * (length // unit_number)) * 100
+
+    return bounds
+
+
+if njit is not None:
+    # the accumulations are reordered (fast math) to be vectorized, which keeps the scores within 1e-6.
+    tm_kernel = njit(cache=True, parallel=True, fastmath=True)(tm_kernel)
+    gdt_kernel = njit(cache=True, parallel=True, fastmath=True)(gdt_kernel)
+    qcp_kernel = njit(cache=True, parallel=True)(qcp_kernel)
+    tm_bound_kernel = njit(cache=True, parallel=True, fastmath=True)(tm_bound_kernel)
+    gdt_bound_kernel = njit(cache=True, parallel=True, fastmath=True)(gdt_bound_kernel)
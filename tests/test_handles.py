@@ -1,12 +1,18 @@
-from numpy import random, linalg, vstack
-from unittest import TestCase
+from numpy import random, linalg, vstack, dot, cumsum, allclose, array, load
+from os import path
+from sys import modules
+from tempfile import TemporaryDirectory
+from unittest import TestCase, mock
 
 from molpub.handles import Monitor
+from molpub.handles import Superposition
 from molpub.handles import Score
 from molpub.handles import similar
-from molpub.handles import cluster
-from molpub.handles import align
+from molpub.handles import prefilter, pairwise, ScoreMatrix
+from molpub.handles import cluster, Clusterer, medoids
+from molpub.handles import align, procrustes
 from molpub.handles import set_difference
+from molpub.handles import load_models_from_file, save_structures_to_stack, load_structures_from_stack
 
 
 class TestScore(TestCase):
@@ -34,6 +40,148 @@ class TestScore(TestCase):
                     self.assertEqual(linalg.norm(reference - y, ord=2) < 1e-10, True)
                     self.assertEqual(reverse, False)
 
+    def test_many_to_one(self):
+        for _ in range(self.test_size):
+            # noinspection PyArgumentList
+            x, y = random.random(size=(self.location_length, 3)), random.random(size=(self.location_length, 3))
+            structures = vstack((x, y, x, y)).reshape((4, self.location_length, 3))
+            for similar_type in self.similar_types:
+                score_method = Score(similar_type, "CA")
+                for use_center in [True, False]:
+                    scores = score_method.many_to_one(structures, x, use_center, block_size=3)
+                    for structure, score in zip(structures, scores):
+                        self.assertEqual(abs(score - score_method(structure, x, use_center).score) < 1e-6, True)
+
+    def test_many_to_many(self):
+        for _ in range(self.test_size):
+            # noinspection PyArgumentList
+            structures = random.random(size=(5, self.location_length, 3))
+            for similar_type in self.similar_types:
+                score_method = Score(similar_type, "CA")
+                matrix = score_method.many_to_many(structures, block_size=2)
+                self.assertEqual(linalg.norm(matrix - matrix.T) < 1e-6, True)
+                for index, structure in enumerate(structures):
+                    scores = score_method.many_to_one(structures, structure)
+                    self.assertEqual(linalg.norm(matrix[:, index] - scores) < 1e-6, True)
+
+    def test_precision(self):
+        for _ in range(self.test_size):
+            # noinspection PyArgumentList
+            structures = random.random(size=(5, self.location_length, 3))
+            for similar_type in ["RMSD", "TM"]:
+                score_method = Score(similar_type, "CA", precision="float32")
+                self.assertEqual(score_method(structures[0], structures[1]).candidate.dtype == "float32", True)
+                self.assertEqual(score_method.validate(structures, structures[0]) < 1e-3, True)
+
+    def test_backend(self):
+        for _ in range(self.test_size):
+            # noinspection PyArgumentList
+            x, y = random.random(size=(self.location_length, 3)), random.random(size=(self.location_length * 2, 3))
+            for similar_type in self.similar_types:
+                for model_type in ["CA", "N-CA-C-O"]:
+                    numpy_method = Score(similar_type, model_type, backend="numpy")
+                    numba_method = Score(similar_type, model_type, backend="numba")
+                    for structure in [x, y[:self.location_length], y]:
+                        for use_center in [True, False]:
+                            numpy_score = numpy_method(x, structure, use_center).score
+                            numba_score = numba_method(x, structure, use_center).score
+                            self.assertEqual(abs(numpy_score - numba_score) < 1e-6, True)
+
+    def test_search(self):
+        for _ in range(self.test_size):
+            # noinspection PyArgumentList
+            x, y = random.random(size=(self.location_length, 3)), random.random(size=(self.location_length * 3, 3))
+            x, y = 20.0 * x, 20.0 * y  # the distances should exceed the cutoffs of GDT.
+            y[100: 100 + self.location_length] = x
+            for similar_type in self.similar_types:
+                result = Score(similar_type, "CA", coarse_step=3, refine_number=4)(x, y)
+                self.assertEqual(result.start, 100)
+                self.assertEqual(linalg.norm(result.candidate - x, ord=2) < 1e-6, True)
+
+    def test_anchor(self):
+        for _ in range(self.test_size):
+            # noinspection PyArgumentList
+            x, y = random.random(size=(self.location_length, 3)), random.random(size=(self.location_length * 3, 3))
+            y[100: 100 + self.location_length] = x
+            # noinspection PyArgumentList
+            sequence = "".join(random.choice(list("ACDEFGHIKLMNPQRSTVWY"), size=self.location_length * 3))
+            for similar_type in self.similar_types:
+                result = Score(similar_type, "CA")(y, x, sequences=(sequence, sequence[100: 100 + self.location_length]))
+                self.assertEqual(result.start, 100)
+                self.assertEqual(result.reverse, True)
+                self.assertEqual(linalg.norm(result.candidate - x, ord=2) < 1e-6, True)
+
+    def test_lddt(self):
+        for _ in range(self.test_size):
+            # noinspection PyArgumentList
+            x, y = random.random(size=(self.location_length, 3)), random.random(size=(self.location_length * 3, 3))
+            x, y = 20.0 * x, 20.0 * y
+            y[96: 96 + self.location_length] = x
+            for model_type in self.model_types:
+                score_method = Score("lDDT", model_type)
+                self.assertEqual(abs(score_method(x, x).score - 1.0) < 1e-10, True)
+                result = score_method(x, y)
+                self.assertEqual(result.start, 96)
+                self.assertEqual(linalg.norm(result.candidate - x, ord=2) < 1e-6, True)
+                # the windows compared in small batches score the same as each window compared alone.
+                scores, starts = score_method.compare_windows(x, y, memory_size=0.01)
+                for score, start in zip(scores[::37], starts[::37]):
+                    window = y[start: start + self.location_length]
+                    self.assertEqual(abs(score - score_method.compare(x[None], *score_method.get_neighbors(window))[0])
+                                     < 1e-10, True)
+                structures = vstack((x, y[:self.location_length])).reshape((2, self.location_length, 3))
+                scores = score_method.many_to_one(structures, y[:self.location_length])
+                for structure, score in zip(structures, scores):
+                    self.assertEqual(abs(score - score_method(structure, y[:self.location_length]).score) < 1e-10, True)
+
+                # the lDDT matrix is asymmetric, so it does not depend on the blocks.
+                structures = vstack((x, y[:3 * self.location_length])).reshape((4, self.location_length, 3))
+                expected = score_method.many_to_many(structures, structures.copy())
+                for block_size in [1, 3]:
+                    obtained = score_method.many_to_many(structures, block_size=block_size)
+                    self.assertEqual(linalg.norm(obtained - expected) < 1e-10, True)
+
+    def test_start(self):
+        # the start locations count atoms, so the multi-atom models scale the unit offset.
+        for model_type, unit_number in [("CA", 1), ("N-CA-C-O", 4), ("3SPN", 3), ("C3'", 1)]:
+            # noinspection PyArgumentList
+            x = 20.0 * random.random(size=(12 * unit_number, 3))
+            # noinspection PyArgumentList
+            y = 20.0 * random.random(size=(30 * unit_number, 3))
+            y[7 * unit_number: 19 * unit_number] = x
+            for similar_type in ["RMSD", "TM"]:
+                result = Score(similar_type, model_type)(x, y)
+                self.assertEqual(result.start, 7 * unit_number)
+                self.assertEqual(linalg.norm(result.candidate - x, ord=2) < 1e-6, True)
+
+    def test_cache(self):
+        for _ in range(self.test_size):
+            # noinspection PyArgumentList
+            structures = random.random(size=(4, self.location_length, 3))
+            score_method = Score("TM", "CA", cache_size=3)
+            scores = [score_method(structure, structures[0]).score for structure in structures]
+            self.assertEqual(score_method.cache_info()["misses"], 4)
+            self.assertEqual(score_method.cache_info()["size"], 3)
+            self.assertEqual(score_method(structures[3].copy(), structures[0]).score, scores[3])
+            self.assertEqual(score_method(structures[2], structures[0], threshold=0.5).score, scores[2])
+            self.assertEqual(score_method.cache_info()["hits"], 2)
+            score_method(structures[0], structures[0])
+            self.assertEqual(score_method.cache_info()["misses"], 5)
+
+            # the cached result is bound to the structures of the later call, not to the mutated earlier ones.
+            candidate, reference = structures[1].copy(), structures[0].copy()
+            expected = score_method(candidate, reference).candidate
+            candidate[:], reference[:] = 0.0, 0.0
+            result = score_method(structures[1], structures[0])
+            self.assertEqual(score_method.cache_info()["hits"], 3)
+            self.assertEqual(allclose(result.candidate, expected), True)
+            self.assertEqual(allclose(result.reference, structures[0]), True)
+            longer = vstack((structures[2], structures[3]))
+            expected = score_method(longer, structures[1])
+            result = score_method(longer.copy(), structures[1].copy())
+            self.assertEqual(result.reverse, True)
+            self.assertEqual(allclose(result.candidate, expected.candidate), True)
+
     def test_get_params(self):
         for similar_type in self.similar_types:
             for model_type in self.model_types:
@@ -41,6 +189,60 @@ class TestScore(TestCase):
                 self.assertEqual(s_type, similar_type)
                 self.assertEqual(m_type, model_type)
 
+    def test_superpose(self):
+        for _ in range(self.test_size):
+            # noinspection PyArgumentList
+            x, y = random.random(size=(self.location_length, 3)), random.random(size=(self.location_length, 3))
+            for use_center in [True, False]:
+                rotations, translations, starts = Score.superpose(x, vstack((y, x)), use_center)
+                number = 1 if use_center else self.location_length
+                self.assertEqual(len(rotations), (self.location_length + 1) * number)
+                self.assertEqual(linalg.norm(linalg.det(rotations) - 1.0) < 1e-10, True)
+                for rotation, translation, start in zip(rotations, translations, starts):
+                    if start == self.location_length:
+                        self.assertEqual(linalg.norm(x.dot(rotation) + translation - x, ord=2) < 1e-10, True)
+
+    def test_slide(self):
+        for _ in range(self.test_size):
+            # noinspection PyArgumentList
+            x, y = random.random(size=(self.location_length, 3)), random.random(size=(20 * self.location_length, 3))
+            covariances, candidate_sum, reference_sums, reference_squares = Score.slide(x, y)
+            self.assertEqual(len(covariances), 19 * self.location_length + 1)
+            for start in [0, self.location_length, 19 * self.location_length]:
+                window = y[start: start + self.location_length]
+                self.assertEqual(linalg.norm(covariances[start] - x.T.dot(window)) < 1e-10, True)
+                self.assertEqual(linalg.norm(reference_sums[start] - window.sum(axis=0)) < 1e-10, True)
+                self.assertEqual(abs(reference_squares[start] - (window ** 2).sum()) < 1e-10, True)
+            self.assertEqual(linalg.norm(candidate_sum - x.sum(axis=0)) < 1e-10, True)
+
+    def test_qcp(self):
+        for _ in range(self.test_size):
+            # noinspection PyArgumentList
+            x, y = random.random(size=(self.location_length, 3)), random.random(size=(2 * self.location_length, 3))
+            for use_center in [True, False]:
+                covariances, candidate_inners, reference_inners, _, _, _ = Score.correlate(x, y, use_center)
+                deviations = Score.qcp(covariances, candidate_inners, reference_inners)
+                rotations, translations, starts = Score.superpose(x, y, use_center)
+                results = list(zip(deviations, rotations, translations, starts))
+                for deviation, rotation, translation, start in results[::7]:
+                    window = y[start: start + self.location_length]
+                    expected = ((x.dot(rotation) + translation - window) ** 2).sum()
+                    self.assertEqual(abs(deviation - expected) < 1e-8, True)
+
+    def test_bound(self):
+        for _ in range(self.test_size):
+            # noinspection PyArgumentList
+            x, y = random.random(size=(self.location_length, 3)), random.random(size=(2 * self.location_length, 3))
+            for similar_type in ["TM", "GDT-HA", "GDT-TS"]:
+                score_method = Score(similar_type, "CA")
+                factor = score_method.get_factor(self.location_length)
+                for use_center in [True, False]:
+                    bounds = score_method.bound(x, y, use_center, factor)
+                    scores, _ = score_method.scan(x, y, use_center, factor)
+                    self.assertEqual((bounds >= scores - 1e-10).all(), True)
+                    pruned_scores, _ = score_method.scan(x, y, use_center, factor, prune=True)
+                    self.assertEqual(abs(pruned_scores.max() - scores.max()) < 1e-10, True)
+
     def test_kabsch(self):
         for _ in range(self.test_size):
             # noinspection PyArgumentList
@@ -57,6 +259,28 @@ class TestScore(TestCase):
                     self.assertEqual(linalg.norm(candidate - x, ord=2) < 1e-10, True)
 
 
+class TestSuperposition(TestCase):
+
+    def setUp(self):
+        self.model_types = ["CA", "N-CA-C-O", "3SPN", "C3'"]
+        self.test_size = 20
+        self.location_length = 60
+
+    def test(self):
+        for _ in range(self.test_size):
+            # noinspection PyArgumentList
+            x, y = random.random(size=(self.location_length, 3)), random.random(size=(self.location_length, 3))
+            for model_type in self.model_types:
+                result = Score("TM", model_type)(x, vstack((y, x)))
+                self.assertEqual(isinstance(result, Superposition), True)
+                self.assertEqual(result.start, self.location_length)
+                self.assertEqual(result.reverse, False)
+                score, candidate, reference, start, reverse = result
+                self.assertEqual(score, result.score)
+                self.assertEqual(linalg.norm(candidate - result.transform(x), ord=2) < 1e-10, True)
+                self.assertEqual(linalg.norm(candidate - x, ord=2) < 1e-8, True)
+
+
 class TestSimilar(TestCase):
 
     def setUp(self):
@@ -103,6 +327,123 @@ class TestSimilar(TestCase):
                     self.assertEqual(linalg.norm(reference - y, ord=2) < 1e-10, True)
                     self.assertEqual(similarity, False)
 
+    def test_early_stop(self):
+        for _ in range(self.test_size):
+            # noinspection PyArgumentList
+            x, y = random.random(size=(self.location_length, 3)), random.random(size=(self.location_length, 3))
+            z = vstack((y[:10], x, y[:10]))
+            for similar_type in self.similar_types:
+                score_method = Score(similar_type, "CA")
+                if similar_type == "RMSD":
+                    metrics_group = [1e-10, 0.05, 1.0]
+                elif similar_type == "TM":
+                    metrics_group = [0.3, 0.5, 1.1]
+                else:
+                    metrics_group = [50.0, 90.0, 100.1]
+                for use_center in [True, False]:
+                    for metrics in metrics_group:
+                        expected = similar(x, z, score_method, use_center, metrics)[0]
+                        obtained = similar(x, z, score_method, use_center, metrics, True)[0]
+                        self.assertEqual(obtained, expected)
+
+
+class TestPairwise(TestCase):
+
+    def setUp(self):
+        self.similar_types = ["RMSD", "TM", "GDT-HA", "GDT-TS"]
+        self.test_size = 5
+        self.location_length = 60
+        self.structure_number = 6
+
+    def test(self):
+        for _ in range(self.test_size):
+            # noinspection PyArgumentList
+            x = cumsum(random.normal(scale=2.0, size=(self.location_length, 3)), axis=0)
+            # noinspection PyArgumentList
+            structures = [x + random.normal(scale=0.5, size=x.shape) for _ in range(self.structure_number)]
+            for similar_type in self.similar_types:
+                score_method = Score(similar_type, "CA")
+                for chunk_size in [1, 4]:
+                    score_matrix = pairwise(structures, score_method, True, chunk_size)
+                    for index_1 in range(self.structure_number):
+                        for index_2 in range(self.structure_number):
+                            result = score_method(structures[index_1], structures[index_2])
+                            score = score_matrix.get_score(index_1, index_2)
+                            self.assertEqual(abs(score - result.score) < 1e-6, True)
+                            rotation, translation = score_matrix.get_transform(index_1, index_2)
+                            candidate = dot(structures[index_1], rotation) + translation
+                            self.assertEqual(linalg.norm(candidate - result.candidate, ord=2) < 1e-6, True)
+
+            # structures with different lengths are scored one pair by one pair.
+            structures[0] = structures[0][10:50]
+            score_method = Score("TM", "CA")
+            score_matrix = pairwise(structures, score_method, True, 4)
+            result = score_method(structures[2], structures[0])
+            rotation, translation = score_matrix.get_transform(0, 2)
+            self.assertEqual(abs(score_matrix.get_score(2, 0) - result.score) < 1e-10, True)
+            self.assertEqual(linalg.norm(dot(structures[0], rotation) + translation - result.candidate) < 1e-8, True)
+
+    def test_resume(self):
+        # noinspection PyArgumentList
+        structures = random.random(size=(self.structure_number, self.location_length, 3))
+        score_method = Score("TM", "CA")
+        with TemporaryDirectory() as folder:
+            file_path = path.join(folder, "matrix.npz")
+            expected = pairwise(structures, score_method, True, 4)
+            unfinished = pairwise(structures, score_method, True, 4)
+            unfinished.finished_number = 8
+            unfinished.scores[8:] = 0.0
+            unfinished.save(file_path)
+            obtained = pairwise(structures, score_method, True, 4, file_path)
+            self.assertEqual(allclose(obtained.scores, expected.scores), True)
+            loaded = ScoreMatrix.load(file_path)
+            self.assertEqual(loaded.finished_number, len(expected.scores))
+            self.assertEqual(allclose(loaded.rotations, expected.rotations), True)
+            with self.assertRaises(ValueError):
+                pairwise(structures, Score("RMSD", "CA"), True, 4, file_path)
+
+            # the unfinished score matrix is not saved within the interval, but the finished one is always saved.
+            file_path = path.join(folder, "interval.npz")
+            pairwise(structures, score_method, True, 4, file_path, save_interval=float("inf"))
+            self.assertEqual(ScoreMatrix.load(file_path).finished_number, len(expected.scores))
+
+    def test_workers(self):
+        # noinspection PyArgumentList
+        x = cumsum(random.normal(scale=2.0, size=(self.location_length, 3)), axis=0)
+        # noinspection PyArgumentList
+        structures = [x + random.normal(scale=1.0, size=x.shape) for _ in range(self.structure_number * 2)]
+        structures[1] = structures[1][5:55]
+        score_method = Score("TM", "CA")
+        expected = pairwise(structures, score_method, True, 16)
+        obtained = pairwise(structures, score_method, True, 16, workers=2)
+        self.assertEqual((obtained.scores == expected.scores).all(), True)
+        self.assertEqual((obtained.rotations == expected.rotations).all(), True)
+        self.assertEqual((obtained.translations == expected.translations).all(), True)
+        self.assertEqual(cluster(structures, score_method, True, 0.6, "average", workers=2),
+                         cluster(structures, score_method, True, 0.6, "average"))
+
+        # the structures in the memory are written into a temporary stack file without the shared memory.
+        with mock.patch.dict(modules, {"multiprocessing.shared_memory": None}):
+            obtained = pairwise(structures, score_method, True, 16, workers=2)
+        self.assertEqual((obtained.scores == expected.scores).all(), True)
+        self.assertEqual((obtained.rotations == expected.rotations).all(), True)
+
+        # the default merge type is clustered by the score matrix calculated in parallel.
+        structures[1] = x + random.normal(scale=1.0, size=x.shape)
+        self.assertEqual(cluster(structures, score_method, True, 0.6, "all", workers=2),
+                         cluster(structures, score_method, True, 0.6, "all"))
+        expected = align(structures, score_method, True, 0.6, "all")
+        obtained = align(structures, score_method, True, 0.6, "all", workers=2)
+        self.assertEqual(len(obtained), len(expected))
+        for cluster_index in expected.keys():
+            for structure_1, structure_2 in zip(obtained[cluster_index], expected[cluster_index]):
+                self.assertEqual(allclose(structure_1, structure_2, atol=1e-6), True)
+
+        with self.assertRaises(ValueError):
+            cluster(structures, score_method, True, 0.6, "leader", workers=2)
+        with self.assertRaises(ValueError):
+            align(structures, score_method, True, 0.6, "leader", workers=2)
+
 
 class TestCluster(TestCase):
 
@@ -135,6 +476,146 @@ class TestCluster(TestCase):
                     cluster_results = cluster(structures, score_method, True, metrics, "all")
                     cluster_expect = {1: [0, 1, 2, 3, 4, 5, 6, 7, 8, 9]}
                     self.assertEqual(cluster_results, list(cluster_expect.values()))
+                    score_matrix = pairwise(structures, score_method, True)
+                    cluster_results = cluster(structures, score_method, True, metrics, "all", score_matrix)
+                    self.assertEqual(cluster_results, list(cluster_expect.values()))
+
+    def test_leader(self):
+        for _ in range(self.test_size):
+            # noinspection PyArgumentList
+            x = cumsum(random.normal(scale=2.0, size=(self.location_length, 3)), axis=0)
+            structures = []
+            for _ in range(self.structure_number * 10):
+                # noinspection PyArgumentList
+                x = x + random.normal(scale=0.2, size=x.shape)
+                structures.append(x.copy())
+
+            for similar_type, metrics in [("RMSD", 0.3), ("TM", 0.8)]:
+                score_method = Score(similar_type, "CA")
+                leader_indices, cluster_expect = [], []
+                for structure_index, structure in enumerate(structures):
+                    for leader_index, members in zip(leader_indices, cluster_expect):
+                        result = score_method(structure, structures[leader_index])
+                        if (result.score <= metrics) if similar_type == "RMSD" else (result.score >= metrics):
+                            members.append(structure_index)
+                            break
+                    else:
+                        leader_indices.append(structure_index)
+                        cluster_expect.append([structure_index])
+                cluster_results = cluster(structures, score_method, True, metrics, "leader")
+                self.assertEqual(cluster_results, cluster_expect)
+
+    def test_prefilter(self):
+        for _ in range(self.test_size // 4):
+            structures = []
+            for _ in range(3):
+                # noinspection PyArgumentList
+                x = cumsum(random.normal(scale=2.0, size=(self.location_length, 3)), axis=0)
+                for _ in range(self.structure_number):
+                    # noinspection PyArgumentList
+                    structures.append(x + random.normal(scale=0.3, size=x.shape))
+            # noinspection PyArgumentList
+            structures = [structures[index] for index in random.permutation(len(structures))]
+
+            score_method = Score("RMSD", "CA")
+            candidate_pairs, statistics = prefilter(structures, score_method, True, 0.15)
+            self.assertEqual(statistics["provable"], True)
+            self.assertEqual(statistics["candidate number"], len(candidate_pairs))
+            self.assertEqual(statistics["candidate number"] < statistics["pair number"], True)
+            for merge_type in ["all", "any", "leader"]:
+                cluster_expect = cluster(structures, score_method, True, 0.15, merge_type)
+                cluster_results = cluster(structures, score_method, True, 0.15, merge_type,
+                                          candidate_pairs=candidate_pairs)
+                self.assertEqual(cluster_results, cluster_expect)
+
+            with self.assertRaises(ValueError):
+                prefilter(structures, Score("TM", "CA"))
+
+    def test_linkage(self):
+        for _ in range(self.test_size // 4):
+            structures, families = [], []
+            for family in range(3):
+                # noinspection PyArgumentList
+                x = cumsum(random.normal(scale=2.0, size=(self.location_length, 3)), axis=0)
+                for _ in range(self.structure_number):
+                    # noinspection PyArgumentList
+                    structures.append(x + random.normal(scale=0.3, size=x.shape))
+                    families.append(family)
+            # noinspection PyArgumentList
+            orders = random.permutation(len(structures))
+            structures, families = [structures[index] for index in orders], [families[index] for index in orders]
+
+            for similar_type, metrics in [("RMSD", 0.3), ("TM", 0.5)]:
+                score_method = Score(similar_type, "CA")
+                score_matrix = pairwise(structures, score_method, True, keep_transforms=False)
+                for merge_type in ["average", "complete", "medoids"]:
+                    cluster_results = cluster(structures, score_method, True, metrics, merge_type, score_matrix,
+                                              cluster_number=3)
+                    self.assertEqual(len(cluster_results), 3)
+                    for indices in cluster_results:
+                        self.assertEqual(len(set([families[index] for index in indices])), 1)
+
+            # the identical structures are never chosen as the medoids twice.
+            score_method = Score("RMSD", "CA")
+            score_matrix = pairwise([structures[0]] * 5, score_method, True, keep_transforms=False)
+            medoid_indices, flags = medoids(score_matrix, 3)
+            self.assertEqual(len(set(medoid_indices)), 3)
+            self.assertEqual(len(set(flags.tolist())), 3)
+
+            # the default metrics of the score method are used as the threshold of the linkage tree.
+            score_method = Score("TM", "CA")
+            score_matrix = pairwise(structures, score_method, True, keep_transforms=False)
+            for merge_type in ["average", "complete"]:
+                self.assertEqual(cluster(structures, score_method, True, None, merge_type, score_matrix),
+                                 cluster(structures, score_method, True, 0.5, merge_type, score_matrix))
+            with self.assertRaises(ValueError):
+                cluster(structures, Score("RMSD", "CA"), True, None, "average")
+
+
+class TestClusterer(TestCase):
+
+    def setUp(self):
+        self.test_size = 5
+        self.location_length = 60
+        self.structure_number = 60
+
+    def test(self):
+        for _ in range(self.test_size):
+            # noinspection PyArgumentList
+            x = cumsum(random.normal(scale=2.0, size=(self.location_length, 3)), axis=0)
+            structures = []
+            for _ in range(self.structure_number):
+                # noinspection PyArgumentList
+                x = x + random.normal(scale=0.2, size=x.shape)
+                structures.append(x.copy())
+
+            for similar_type, metrics in [("RMSD", 0.3), ("TM", 0.8)]:
+                score_method = Score(similar_type, "CA")
+                cluster_expect = cluster(structures, score_method, True, metrics, "leader")
+                clusterer = Clusterer(score_method, True, metrics)
+                flags = clusterer.extend(structures[:self.structure_number // 2])
+                with TemporaryDirectory() as folder:
+                    clusterer.save(path.join(folder, "archive"))
+                    clusterer = Clusterer.load(path.join(folder, "archive"))
+                for structure in structures[self.structure_number // 2:]:
+                    flags.append(clusterer.append(structure))
+                self.assertEqual(clusterer.get_clusters(), cluster_expect)
+                self.assertEqual(flags, clusterer.flags)
+
+                for structure_index, flag in enumerate(clusterer.flags):
+                    leader = structures[clusterer.leader_indices[flag]]
+                    candidate = dot(structures[structure_index], clusterer.rotations[structure_index])
+                    candidate += clusterer.translations[structure_index]
+                    result = score_method(structures[structure_index], leader)
+                    self.assertEqual(linalg.norm(candidate - result.candidate, ord=2) < 1e-6, True)
+                    if similar_type == "RMSD":
+                        self.assertEqual(result.score <= metrics, True)
+
+                # only the flags are kept without the transforms.
+                clusterer = Clusterer(score_method, True, metrics, keep_transforms=False)
+                clusterer.extend(structures)
+                self.assertEqual(clusterer.get_clusters(), cluster_expect)
+                self.assertEqual(len(clusterer.rotations), 0)
 
 
 class TestAlign(TestCase):
@@ -168,6 +649,70 @@ class TestAlign(TestCase):
                     alignment_results = align(structures, score_method, True, metrics, "all")
                     self.assertEqual(0 in alignment_results.keys(), True)
                     self.assertEqual(1 in alignment_results.keys(), False)
+                    score_matrix = pairwise(structures, score_method, True)
+                    matrix_results = align(structures, score_method, True, metrics, "all", score_matrix)
+                    for expected, obtained in zip(alignment_results[0], matrix_results[0]):
+                        self.assertEqual(linalg.norm(expected - obtained, ord=2) < 1e-6, True)
+
+    def test_transforms(self):
+        for _ in range(self.test_size // 4):
+            # noinspection PyArgumentList
+            x = cumsum(random.normal(scale=2.0, size=(self.location_length, 3)), axis=0)
+            # noinspection PyArgumentList
+            structures = [x + random.normal(scale=1.0, size=x.shape) for _ in range(self.structure_number)]
+            structures[3] = structures[3][5:50]
+            for similar_type, metrics in [("RMSD", 0.6), ("TM", 0.5)]:
+                score_method = Score(similar_type, "CA")
+                for merge_type in ["all", "leader", "average"]:
+                    cluster_results, transforms = cluster(structures, score_method, True, metrics, merge_type,
+                                                          return_transforms=True)
+                    self.assertEqual(cluster_results, cluster(structures, score_method, True, metrics, merge_type))
+                    if merge_type != "average":
+                        self.assertEqual(sorted(transforms.keys()), list(range(1, self.structure_number)))
+
+                    alignment_results = align(structures, score_method, True, metrics, merge_type)
+                    for cluster_index, structure_indices in enumerate(cluster_results):
+                        for structure_index, obtained in zip(structure_indices, alignment_results[cluster_index]):
+                            if structure_index > 0:
+                                expected = score_method(structures[structure_index], structures[0]).candidate
+                            else:
+                                expected = structures[0]
+                            self.assertEqual(linalg.norm(expected - obtained, ord=2) < 1e-6, True)
+
+
+class TestProcrustes(TestCase):
+
+    def setUp(self):
+        self.test_size = 5
+        self.location_length = 60
+        self.structure_number = 20
+
+    def test(self):
+        for _ in range(self.test_size):
+            # noinspection PyArgumentList
+            x = cumsum(random.normal(scale=2.0, size=(self.location_length, 3)), axis=0)
+            structures = []
+            for _ in range(self.structure_number):
+                # noinspection PyArgumentList
+                rotation, _ = linalg.qr(random.normal(size=(3, 3)))
+                # noinspection PyArgumentList
+                structures.append(dot(x, rotation) + random.normal(scale=5.0, size=(1, 3)))
+
+            # the rotated and translated structures are aligned exactly.
+            aligned_structures, consensus = procrustes(structures)
+            self.assertEqual(allclose(consensus, structures[0], atol=1e-6), True)
+            self.assertEqual(allclose(aligned_structures, structures[0], atol=1e-6), True)
+
+            # the consensus structure of the noisy structures is closer to the original structure.
+            # noinspection PyArgumentList
+            structures = [structure + random.normal(scale=1.0, size=x.shape) for structure in structures]
+            aligned_structures, consensus = procrustes(structures)
+            score_method = Score("RMSD", "CA")
+            self.assertEqual(score_method(consensus, x).score < score_method(structures[0], x).score, True)
+            self.assertEqual(set_difference(aligned_structures, "CA").shape, (self.location_length,))
+
+            alignment_results = align(structures, score_method, True, 100.0, "all", use_consensus=True)
+            self.assertEqual(allclose(alignment_results[0], aligned_structures, atol=1e-4), True)
 
 
 class TestSetDifference(TestCase):
@@ -192,6 +737,120 @@ class TestSetDifference(TestCase):
                 self.assertEqual(differences.all() == 0, True)
 
 
+class TestStack(TestCase):
+
+    def setUp(self):
+        self.structure_number = 12
+        self.location_length = 30
+
+    def test(self):
+        # noinspection PyArgumentList
+        x = cumsum(random.normal(scale=2.0, size=(self.location_length, 3)), axis=0)
+        # noinspection PyArgumentList
+        structures = [x + random.normal(scale=0.5, size=x.shape) for _ in range(self.structure_number)]
+        with TemporaryDirectory() as directory_path:
+            for index, structure in enumerate(structures):
+                with open(path.join(directory_path, "frame_%02d.pdb" % index), "w") as file:
+                    for location, (x, y, z) in enumerate(structure):
+                        file.write("ATOM  %5d  CA  ALA A%4d    %8.3f%8.3f%8.3f  1.00  0.00           C\n"
+                                   % (location + 1, location + 1, x, y, z))
+            save_structures_to_stack(directory_path, path.join(directory_path, "stack"), "AA", "CA")
+            stack, index = load_structures_from_stack(path.join(directory_path, "stack"))
+            self.assertEqual(stack.shape, (self.structure_number, self.location_length, 3))
+            self.assertEqual(index["names"][0], "frame_00.pdb")
+            self.assertEqual(index["sequences"][0], "A" * self.location_length)
+            self.assertEqual(allclose(stack, structures, atol=1e-2), True)
+
+            # the memory-mapped stack gives the same results as the structures in the memory.
+            structures = [structure.astype("float64") for structure in stack]
+            score_method = Score("RMSD", "CA")
+            self.assertEqual(cluster(stack, score_method, True, 1.0, "leader"),
+                             cluster(structures, score_method, True, 1.0, "leader"))
+            expected = pairwise(structures, score_method, True, chunk_size=16)
+            obtained = pairwise(stack, score_method, True, chunk_size=16, workers=2)
+            self.assertEqual(allclose(expected.scores, obtained.scores), True)
+
+            expected = align(structures, score_method, True, 100.0, "leader")
+            obtained = align(stack, score_method, True, 100.0, "leader", chunk_size=4,
+                             file_path=path.join(directory_path, "aligned.npy"))
+            for expected_structure, obtained_structure in zip(expected[0], obtained[0]):
+                self.assertEqual(allclose(expected_structure, obtained_structure), True)
+
+            aligned_stack = load(path.join(directory_path, "aligned.npy"), mmap_mode="r")
+            self.assertEqual(allclose(set_difference(aligned_stack, "CA", chunk_size=5),
+                                      set_difference(array(expected[0]), "CA")), True)
+            # the blocks are reduced to single chain pairs by the memory size.
+            self.assertEqual(allclose(set_difference(aligned_stack, "CA", memory_size=1e-3),
+                                      set_difference(array(expected[0]), "CA")), True)
+            del stack, aligned_stack, obtained
+
+
+class TestLoadModels(TestCase):
+
+    def setUp(self):
+        self.model_number = 15
+        self.location_length = 30
+
+    def test(self):
+        # noinspection PyArgumentList
+        x = cumsum(random.normal(scale=2.0, size=(self.location_length, 3)), axis=0)
+        # noinspection PyArgumentList
+        structures = [x + random.normal(scale=0.5, size=x.shape) for _ in range(self.model_number)]
+        with TemporaryDirectory() as directory_path:
+            with open(path.join(directory_path, "trajectory.pdb"), "w") as file:
+                for model_index, structure in enumerate(structures):
+                    file.write("MODEL     %4d\n" % (model_index + 1))
+                    for chain_id, shift in [("A", 0.0), ("B", 50.0)]:
+                        for location, (x, y, z) in enumerate(structure + shift):
+                            for atom_name in ["N", "CA", "C", "O"]:
+                                file.write("ATOM  %5d  %-3s ALA %s%4d    %8.3f%8.3f%8.3f  1.00  0.00           %s\n"
+                                           % (location + 1, atom_name, chain_id, location + 1, x, y, z, atom_name[0]))
+                    file.write("ENDMDL\n")
+            with open(path.join(directory_path, "trajectory.cif"), "w") as file:
+                file.write("data_trajectory\nloop_\n")
+                for field in ["group_PDB", "id", "label_atom_id", "label_comp_id", "auth_asym_id", "auth_seq_id",
+                              "Cartn_x", "Cartn_y", "Cartn_z", "pdbx_PDB_model_num"]:
+                    file.write("_atom_site." + field + "\n")
+                for model_index, structure in enumerate(structures):
+                    for location, (x, y, z) in enumerate(structure):
+                        file.write("ATOM %d CA ALA A %d %.3f %.3f %.3f %d\n"
+                                   % (location + 1, location + 1, x, y, z, model_index + 1))
+                file.write("#\n")
+
+            for file_name in ["trajectory.pdb", "trajectory.cif"]:
+                models = list(load_models_from_file(path.join(directory_path, file_name)))
+                self.assertEqual(len(models), self.model_number)
+                self.assertEqual(allclose(models, structures, atol=1e-3), True)
+
+            models = list(load_models_from_file(path.join(directory_path, "trajectory.pdb"), "AA", "N-CA-C-O", "B"))
+            self.assertEqual(models[0].shape, (4 * self.location_length, 3))
+            self.assertEqual(allclose(models[0][1::4], structures[0] + 50.0, atol=1e-3), True)
+
+            # the generator is consumed in the same way as the structures in the memory.
+            file_path, score_method = path.join(directory_path, "trajectory.pdb"), Score("RMSD", "CA")
+            structures = list(load_models_from_file(file_path))
+            for merge_type in ["leader", "all"]:
+                self.assertEqual(cluster(load_models_from_file(file_path), score_method, True, 0.2, merge_type),
+                                 cluster(structures, score_method, True, 0.2, merge_type))
+                expected = align(structures, score_method, True, 0.2, merge_type)
+                obtained = align(load_models_from_file(file_path), score_method, True, 0.2, merge_type)
+                self.assertEqual(expected.keys(), obtained.keys())
+                for cluster_index in expected.keys():
+                    for expected_structure, obtained_structure in zip(expected[cluster_index], obtained[cluster_index]):
+                        self.assertEqual(allclose(expected_structure, obtained_structure), True)
+
+            # the streamed structures are written into the stack as they are aligned.
+            expected = align(structures, score_method, True, 0.2, "leader")
+            obtained = align(load_models_from_file(file_path), score_method, True, 0.2, "leader",
+                             file_path=path.join(directory_path, "aligned.npy"))
+            for cluster_index in expected.keys():
+                for expected_structure, obtained_structure in zip(expected[cluster_index], obtained[cluster_index]):
+                    self.assertEqual(allclose(expected_structure, obtained_structure), True)
+            self.assertEqual(load(path.join(directory_path, "aligned.npy")).shape,
+                             (len(structures),) + structures[0].shape)
+            del obtained
+
+
 class TestMonitor(TestCase):
 
     def setUp(self):